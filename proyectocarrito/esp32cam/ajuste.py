@@ -0,0 +1,200 @@
+# Ajuste automático de la red neuronal para cada equipo.
+# Al arrancar mide los backends y targets de CPU disponibles, varias cantidades
+# de hilos de OpenCV y los tamaños de entrada candidatos sobre cuadros de
+# muestra, y guarda la mejor configuración por equipo en un perfil JSON para no
+# repetir la medición en cada arranque. El perfil se identifica por el hardware
+# y el modelo, no por el nombre del equipo: gateways iguales comparten ajuste.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+REPETICIONES_AJUSTE = 5  # Forwards medidos por combinación (tras uno de calentamiento)
+MUESTRAS_AJUSTE = 4  # Cuadros de muestra usados en la medición
+
+# Backends de OpenCV que pueden correr en CPU, si esta compilación los trae
+BACKENDS_CPU = {nombre: getattr(cv2.dnn, constante) for nombre, constante in (
+    ('opencv', 'DNN_BACKEND_OPENCV'),
+    ('inference_engine', 'DNN_BACKEND_INFERENCE_ENGINE'),
+    ('halide', 'DNN_BACKEND_HALIDE'),
+) if hasattr(cv2.dnn, constante)}
+
+def modelo_cpu():
+    """Nombre del procesador; en Linux `platform.processor()` suele venir vacío."""
+    try:
+        with open('/proc/cpuinfo', 'r', encoding='utf-8', errors='replace') as f:
+            for linea in f:
+                if linea.lower().startswith(('model name', 'hardware', 'cpu model')):
+                    return linea.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def clave_equipo(weights, lote=1):
+    """Identifica el hardware, la versión de OpenCV, el modelo y el camino de inferencia de un ajuste."""
+    try:
+        bytes_modelo = os.path.getsize(weights)
+    except OSError:
+        bytes_modelo = 0
+    camino = f"lotes{lote}" if lote > 1 else 'cuadro'
+    return (f"{modelo_cpu()}|{platform.machine()}|{os.cpu_count()}|{cv2.__version__}|"
+            f"{os.path.basename(weights)}:{bytes_modelo}|{camino}")
+
+def combinaciones_backend():
+    """Pares (nombre, backend, target) disponibles con target CPU."""
+    combinaciones = []
+    for nombre, backend in BACKENDS_CPU.items():
+        try:
+            targets = cv2.dnn.getAvailableTargets(backend)
+        except cv2.error:
+            continue
+        if cv2.dnn.DNN_TARGET_CPU in targets:
+            combinaciones.append((nombre, backend, cv2.dnn.DNN_TARGET_CPU))
+    return combinaciones or [('opencv', cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU)]
+
+def candidatos_hilos(nucleos=None):
+    """1, 2, 4, ... hasta la cantidad de núcleos, incluyéndola."""
+    nucleos = nucleos or os.cpu_count() or 1
+    hilos = {nucleos}
+    valor = 1
+    while valor < nucleos:
+        hilos.add(valor)
+        valor *= 2
+    return sorted(hilos)
+
+def muestras_ajuste(directorio, cantidad=MUESTRAS_AJUSTE, tamano=(800, 600)):
+    """Cuadros de muestra: JPEG guardados en `directorio` o, si no hay, ruido SVGA."""
+    muestras = []
+    if directorio and os.path.isdir(directorio):
+        for nombre in sorted(os.listdir(directorio), reverse=True):
+            if not nombre.lower().endswith(('.jpg', '.jpeg')):
+                continue
+            imagen = cv2.imread(os.path.join(directorio, nombre))
+            if imagen is not None:
+                muestras.append(imagen)
+            if len(muestras) == cantidad:
+                break
+    if not muestras:
+        generador = np.random.default_rng(0)
+        muestras = [generador.integers(0, 256, (tamano[1], tamano[0], 3), dtype=np.uint8) for _ in range(cantidad)]
+    return muestras
+
+def medir(modelo, muestras, repeticiones=REPETICIONES_AJUSTE, lote=1):
+    """Mediana de segundos por cuadro de `modelo` sobre las muestras.
+
+    Con `lote` mayor que 1 se mide `detectar_lote` con lotes de ese tamaño
+    (el camino de `DetectorPorLotes`) y se divide por la cantidad de cuadros.
+    """
+    if lote > 1:
+        imagenes = [muestras[i % len(muestras)] for i in range(lote)]
+        correr = lambda i: modelo.detectar_lote(imagenes)
+    else:
+        correr = lambda i: modelo.detect(muestras[i % len(muestras)])
+    correr(0)
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        correr(i)
+        tiempos.append((time.perf_counter() - inicio) / lote)
+    return statistics.median(tiempos)
+
+def ajustar(crear_modelo, muestras, tamanos, presupuesto, repeticiones=REPETICIONES_AJUSTE, lote=1):
+    """Mide todas las combinaciones y devuelve (mejor ajuste, lista de mediciones).
+
+    `crear_modelo(ajuste)` construye un modelo con un dict de ajuste
+    (backend, target, hilos, tamano). Para cada tamaño se busca la
+    combinación más rápida; se elige el tamaño más grande cuya inferencia
+    entra en `presupuesto` segundos por cuadro, o el más rápido si ninguno
+    entra. `lote` se pasa a `medir`.
+    """
+    mediciones = []
+    hilos_originales = cv2.getNumThreads()
+    try:
+        for tamano in sorted(tamanos, key=lambda t: t[0] * t[1], reverse=True):
+            for nombre, backend, target in combinaciones_backend():
+                for hilos in candidatos_hilos():
+                    ajuste = {'backend': nombre, 'target': 'cpu', 'hilos': hilos, 'tamano': list(tamano)}
+                    try:
+                        segundos = medir(crear_modelo(ajuste), muestras, repeticiones, lote)
+                    except cv2.error as e:
+                        logging.info(f"Ajuste descartado {ajuste}: {e}")
+                        continue
+                    mediciones.append(dict(ajuste, segundos=round(segundos, 6)))
+    finally:
+        cv2.setNumThreads(hilos_originales)
+    if not mediciones:
+        raise RuntimeError("Ninguna configuración de la red pudo ejecutarse")
+
+    mejores = {}
+    for medicion in mediciones:
+        tamano = tuple(medicion['tamano'])
+        if tamano not in mejores or medicion['segundos'] < mejores[tamano]['segundos']:
+            mejores[tamano] = medicion
+    dentro = [m for m in mejores.values() if m['segundos'] <= presupuesto]
+    if dentro:
+        mejor = max(dentro, key=lambda m: m['tamano'][0] * m['tamano'][1])
+    else:
+        mejor = min(mejores.values(), key=lambda m: m['segundos'])
+    return mejor, mediciones
+
+# Perfil en disco
+
+def cargar_perfil(ruta, clave):
+    """Ajuste guardado para `clave`, o None."""
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return json.load(f).get(clave)
+    except (OSError, ValueError):
+        return None
+
+def guardar_perfil(ruta, clave, ajuste):
+    """Guarda el ajuste de `clave` conservando los de otros equipos."""
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            perfiles = json.load(f)
+    except (OSError, ValueError):
+        perfiles = {}
+    perfiles[clave] = ajuste
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(perfiles, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+def obtener_ajuste(crear_modelo, weights, ruta, muestras, tamanos, presupuesto, forzar=False, lote=1):
+    """Ajuste del perfil si existe para este equipo y camino; si no, lo mide y lo guarda."""
+    clave = clave_equipo(weights, lote)
+    ajuste = None if forzar else cargar_perfil(ruta, clave)
+    if ajuste is not None:
+        logging.info(f"Ajuste de la red leído de {ruta}: {ajuste}")
+        return ajuste
+    inicio = time.perf_counter()
+    ajuste, mediciones = ajustar(crear_modelo, muestras(), tamanos, presupuesto, lote=lote)
+    logging.info(f"Ajuste de la red medido en {time.perf_counter() - inicio:.1f} s "
+                 f"({len(mediciones)} combinaciones): {ajuste}")
+    guardar_perfil(ruta, clave, ajuste)
+    return ajuste
+
+# Ajuste desde la línea de comandos
+if __name__ == "__main__":
+    from clasificacion import (CAPTURE_DIR, PERFIL_AJUSTE, PRESUPUESTO_INFERENCIA, TAMANOS_CANDIDATOS,
+                               WEIGHTS_PATH, lote_del_detector, modelo_para_ajuste)
+
+    parser = argparse.ArgumentParser(description="Mide y guarda la mejor configuración de la red para este equipo.")
+    parser.add_argument('--muestras', default=CAPTURE_DIR, help="Carpeta con JPEG de muestra")
+    parser.add_argument('--perfil', default=PERFIL_AJUSTE, help="Archivo JSON de perfiles")
+    parser.add_argument('--presupuesto', type=float, default=PRESUPUESTO_INFERENCIA,
+                        help="Segundos por inferencia que se aceptan")
+    args = parser.parse_args()
+
+    muestras = muestras_ajuste(args.muestras)
+    lote = lote_del_detector()
+    ajuste, mediciones = ajustar(modelo_para_ajuste, muestras, TAMANOS_CANDIDATOS, args.presupuesto, lote=lote)
+    guardar_perfil(args.perfil, clave_equipo(WEIGHTS_PATH, lote), ajuste)
+    print(json.dumps({'ajuste': ajuste, 'mediciones': mediciones}, indent=2, ensure_ascii=False))
@@ -0,0 +1,301 @@
+# Archivo de cuadros de solo anexado con índice aparte.
+# Los JPEG de la cámara se agregan uno tras otro a archivos de segmento y cada
+# cuadro deja una entrada de tamaño fijo en el índice del segmento (hora,
+# desplazamiento, largo y un resumen de las detecciones). El lector mapea los
+# segmentos en memoria y busca por hora en el índice, sin listar miles de
+# archivos sueltos; exportar un rango es copiar un bloque contiguo del segmento.
+
+import argparse
+import logging
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from metricas import REGISTRO
+
+BYTES_SEGMENTO = 256 * 1024 * 1024  # Tamaño a partir del cual se abre un segmento nuevo
+CUADROS_ENTRE_VOLCADOS = 30  # Cuadros entre cada flush del segmento y su índice
+TAMANO_COLA_ARCHIVO = 256  # Cuadros pendientes de escribir como máximo
+
+# Entrada del índice (little-endian, 28 bytes): hora (f64), desplazamiento (u64),
+# largo (u32), número de detecciones (u16), clase con mayor confianza (u16, 0
+# sin detecciones) y esa confianza (f32)
+ENTRADA_INDICE = struct.Struct('<dQIHHf')
+TIPO_INDICE = np.dtype([('marca_tiempo', '<f8'), ('desplazamiento', '<u8'), ('largo', '<u4'),
+                        ('detecciones', '<u2'), ('clase', '<u2'), ('confianza', '<f4')])
+EXTENSION_DATOS = '.jpgs'
+EXTENSION_INDICE = '.idx'
+
+def _nombre_segmento(numero):
+    """Nombre base (sin extensión) del segmento `numero`."""
+    return f"segmento_{numero:06d}"
+
+def resumir_detecciones(detecciones):
+    """(cantidad, clase con mayor confianza, confianza) de un `Detecciones`, o ceros."""
+    if detecciones is None or len(detecciones.class_ids) == 0:
+        return 0, 0, 0.0
+    mejor = int(np.argmax(detecciones.confidences))
+    return (min(len(detecciones.class_ids), 0xFFFF), int(detecciones.class_ids[mejor]),
+            float(detecciones.confidences[mejor]))
+
+# Escritura
+
+class EscritorArchivo:
+    """Agrega cuadros al archivo de una cámara desde un hilo propio.
+
+    Cada cámara escribe en su propia subcarpeta. El índice se escribe después
+    de los datos, así una entrada del índice nunca apunta a bytes que no
+    llegaron al segmento; al reabrir se continúa en un segmento nuevo. Si el
+    disco no da abasto y la cola se llena, los cuadros que no entran se
+    descartan y se cuentan en `descartados`: el índice tiene la hora de cada
+    cuadro, así el hueco queda a la vista al consultar.
+
+    El hilo de captura llama a `agregar` con cada JPEG de la cámara, los haya
+    procesado el detector o no; el bucle de detección informa con `anotar` las
+    últimas detecciones de cada cámara, que quedan en el índice de los
+    cuadros que llegan después.
+    """
+
+    def __init__(self, directorio, bytes_segmento=BYTES_SEGMENTO, tamano_cola=TAMANO_COLA_ARCHIVO):
+        self.directorio = directorio
+        self.bytes_segmento = bytes_segmento
+        self.cuadros = 0
+        self.bytes_escritos = 0
+        self.descartados = 0
+        self._segmentos = {}  # camara -> [número, datos, índice, desplazamiento, sin volcar]
+        self._resumenes = {}  # camara -> resumen de las últimas detecciones anotadas
+        self._cola = queue.Queue(maxsize=tamano_cola)
+        self._hilo = threading.Thread(target=self._bucle, name='archivo-cuadros', daemon=True)
+        self._hilo.start()
+
+    def agregar(self, camara, marca_tiempo, jpeg, detecciones=None):
+        """Encola un cuadro sin esperar; si la cola está llena lo descarta.
+
+        Sin `detecciones` el índice lleva las últimas anotadas para la cámara.
+        """
+        if jpeg is None:
+            return
+        if detecciones is None:
+            resumen = self._resumenes.get(camara, (0, 0, 0.0))
+        else:
+            resumen = resumir_detecciones(detecciones)
+        try:
+            self._cola.put_nowait((camara, marca_tiempo, jpeg, resumen))
+        except queue.Full:
+            self.descartados += 1
+
+    def anotar(self, camara, detecciones):
+        """Detecciones vigentes de la cámara para los cuadros que se agreguen desde ahora."""
+        self._resumenes[camara] = resumir_detecciones(detecciones)
+
+    def pendientes(self):
+        """Cuadros que esperan ser escritos."""
+        return self._cola.qsize()
+
+    def cerrar(self):
+        """Escribe lo pendiente y cierra los segmentos abiertos."""
+        self._cola.put(None)
+        self._hilo.join(timeout=10)
+
+    def _abrir_segmento(self, camara):
+        """Abre el siguiente segmento libre de la cámara."""
+        carpeta = os.path.join(self.directorio, camara)
+        os.makedirs(carpeta, exist_ok=True)
+        existentes = [int(n[len('segmento_'):-len(EXTENSION_INDICE)]) for n in os.listdir(carpeta)
+                      if n.startswith('segmento_') and n.endswith(EXTENSION_INDICE)]
+        numero = max(existentes, default=-1) + 1
+        base = os.path.join(carpeta, _nombre_segmento(numero))
+        segmento = [numero, open(base + EXTENSION_DATOS, 'ab'), open(base + EXTENSION_INDICE, 'ab'), 0, 0]
+        self._segmentos[camara] = segmento
+        logging.info(f"Archivo de cuadros: nuevo segmento {base}{EXTENSION_DATOS}")
+        return segmento
+
+    def _cerrar_segmento(self, camara):
+        """Cierra los archivos del segmento abierto de la cámara."""
+        segmento = self._segmentos.pop(camara, None)
+        if segmento is not None:
+            segmento[1].close()
+            segmento[2].close()
+
+    def _escribir(self, camara, marca_tiempo, jpeg, resumen):
+        """Agrega el JPEG al segmento y su entrada al índice."""
+        segmento = self._segmentos.get(camara)
+        if segmento is not None and segmento[3] + len(jpeg) > self.bytes_segmento and segmento[3] > 0:
+            self._cerrar_segmento(camara)
+            segmento = None
+        if segmento is None:
+            segmento = self._abrir_segmento(camara)
+        _, datos, indice, desplazamiento, _ = segmento
+        datos.write(jpeg)
+        indice.write(ENTRADA_INDICE.pack(marca_tiempo, desplazamiento, len(jpeg), *resumen))
+        segmento[3] += len(jpeg)
+        segmento[4] += 1
+        if segmento[4] >= CUADROS_ENTRE_VOLCADOS:
+            datos.flush()
+            indice.flush()
+            segmento[4] = 0
+        self.cuadros += 1
+        self.bytes_escritos += len(jpeg)
+
+    def _bucle(self):
+        """Escribe cuadros de la cola hasta recibir la señal de fin."""
+        while True:
+            tarea = self._cola.get()
+            if tarea is None:
+                break
+            try:
+                with REGISTRO.medir('archivo'):
+                    self._escribir(*tarea)
+            except Exception as e:
+                logging.error(f"Error al archivar el cuadro de {tarea[0]}: {e}")
+        for camara in list(self._segmentos):
+            self._cerrar_segmento(camara)
+
+    def registrar_metricas(self):
+        """Expone la cola y el volumen escrito en el registro de métricas."""
+        REGISTRO.registrar_medidor('cola_archivo', self.pendientes, 'Cuadros pendientes de archivar')
+        REGISTRO.registrar_medidor('bytes_archivados_total', lambda: self.bytes_escritos,
+                                   'Bytes JPEG agregados al archivo de cuadros', 'counter')
+        REGISTRO.registrar_medidor('cuadros_no_archivados_total', lambda: self.descartados,
+                                   'Cuadros descartados por cola de archivo llena', 'counter')
+
+# Lectura
+
+class LectorArchivo:
+    """Acceso aleatorio por posición o por hora a los cuadros de una cámara.
+
+    Los segmentos se mapean en memoria y los índices se cargan como un arreglo
+    estructurado; `cuadro` devuelve una vista del JPEG sin copiarlo. Las
+    entradas cuyo dato no llegó completo al disco (un corte a mitad de
+    escritura) se ignoran.
+    """
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self._archivos = []
+        self._mapas = []
+        indices, numeros = [], []
+        nombres = sorted(n for n in os.listdir(carpeta) if n.startswith('segmento_') and n.endswith(EXTENSION_INDICE))
+        for nombre in nombres:
+            base = os.path.join(carpeta, nombre[:-len(EXTENSION_INDICE)])
+            with open(base + EXTENSION_INDICE, 'rb') as f:
+                crudo = f.read()
+            indice = np.frombuffer(crudo[:len(crudo) - len(crudo) % TIPO_INDICE.itemsize], dtype=TIPO_INDICE)
+            tamano = os.path.getsize(base + EXTENSION_DATOS)
+            indice = indice[indice['desplazamiento'] + indice['largo'] <= tamano]
+            if tamano == 0 or len(indice) == 0:
+                continue
+            archivo = open(base + EXTENSION_DATOS, 'rb')
+            self._archivos.append(archivo)
+            self._mapas.append(mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ))
+            indices.append(indice)
+            numeros.append(np.full(len(indice), len(self._mapas) - 1, dtype=np.int32))
+        self.indice = np.concatenate(indices) if indices else np.zeros(0, dtype=TIPO_INDICE)
+        self._segmento = np.concatenate(numeros) if numeros else np.zeros(0, dtype=np.int32)
+        # Los segmentos se escriben en orden, pero un reloj que retrocede no debe romper la búsqueda
+        orden = np.argsort(self.indice['marca_tiempo'], kind='stable')
+        self.indice = self.indice[orden]
+        self._segmento = self._segmento[orden]
+
+    def __len__(self):
+        return len(self.indice)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    def cerrar(self):
+        """Libera los mapas y archivos de los segmentos."""
+        for mapa in self._mapas:
+            mapa.close()
+        for archivo in self._archivos:
+            archivo.close()
+        self._mapas, self._archivos = [], []
+
+    def jpeg(self, posicion):
+        """Vista de memoria con los bytes JPEG del cuadro en `posicion`."""
+        entrada = self.indice[posicion]
+        inicio = int(entrada['desplazamiento'])
+        return memoryview(self._mapas[self._segmento[posicion]])[inicio:inicio + int(entrada['largo'])]
+
+    def cuadro(self, posicion):
+        """(marca_tiempo, jpeg, resumen) del cuadro en `posicion`."""
+        entrada = self.indice[posicion]
+        resumen = {'detecciones': int(entrada['detecciones']), 'clase': int(entrada['clase']),
+                   'confianza': float(entrada['confianza'])}
+        return float(entrada['marca_tiempo']), self.jpeg(posicion), resumen
+
+    def buscar(self, marca_tiempo):
+        """Posición del primer cuadro con hora mayor o igual a `marca_tiempo`."""
+        return int(np.searchsorted(self.indice['marca_tiempo'], marca_tiempo, side='left'))
+
+    def rango(self, desde=None, hasta=None):
+        """Posiciones [inicio, fin) de los cuadros entre dos horas."""
+        inicio = 0 if desde is None else self.buscar(desde)
+        fin = len(self) if hasta is None else int(np.searchsorted(self.indice['marca_tiempo'], hasta, side='right'))
+        return inicio, max(inicio, fin)
+
+    def __iter__(self):
+        for posicion in range(len(self)):
+            yield self.cuadro(posicion)
+
+    def exportar(self, destino, desde=None, hasta=None):
+        """Escribe los JPEG del rango concatenados en `destino` (un archivo binario abierto).
+
+        Los cuadros contiguos de un mismo segmento se copian en una sola
+        escritura, así la exportación queda limitada por el disco.
+        """
+        inicio, fin = self.rango(desde, hasta)
+        escritos = 0
+        posicion = inicio
+        while posicion < fin:
+            segmento = self._segmento[posicion]
+            desplazamiento = int(self.indice['desplazamiento'][posicion])
+            final = desplazamiento + int(self.indice['largo'][posicion])
+            siguiente = posicion + 1
+            while (siguiente < fin and self._segmento[siguiente] == segmento
+                   and int(self.indice['desplazamiento'][siguiente]) == final):
+                final += int(self.indice['largo'][siguiente])
+                siguiente += 1
+            destino.write(memoryview(self._mapas[segmento])[desplazamiento:final])
+            escritos += siguiente - posicion
+            posicion = siguiente
+        return escritos
+
+def es_archivo(carpeta):
+    """True si la carpeta contiene segmentos de un archivo de cuadros."""
+    return os.path.isdir(carpeta) and any(n.endswith(EXTENSION_INDICE) for n in os.listdir(carpeta))
+
+# Herramienta de consulta y exportación
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulta o exporta un archivo de cuadros de una cámara.")
+    parser.add_argument('carpeta', help="Carpeta de la cámara dentro del archivo (por ejemplo archivo/esp32cam)")
+    parser.add_argument('--desde', type=float, help="Hora inicial (segundos Unix)")
+    parser.add_argument('--hasta', type=float, help="Hora final (segundos Unix)")
+    parser.add_argument('--exportar', help="Escribe los JPEG del rango concatenados en este archivo ('-' para stdout)")
+    args = parser.parse_args()
+
+    with LectorArchivo(args.carpeta) as lector:
+        inicio, fin = lector.rango(args.desde, args.hasta)
+        if args.exportar:
+            destino = sys.stdout.buffer if args.exportar == '-' else open(args.exportar, 'wb')
+            try:
+                cuadros = lector.exportar(destino, args.desde, args.hasta)
+            finally:
+                if destino is not sys.stdout.buffer:
+                    destino.close()
+            print(f"{cuadros} cuadros exportados", file=sys.stderr)
+        else:
+            seleccion = lector.indice[inicio:fin]
+            print(f"Cuadros: {fin - inicio} de {len(lector)}")
+            if len(seleccion):
+                print(f"Desde {seleccion['marca_tiempo'][0]:.3f} hasta {seleccion['marca_tiempo'][-1]:.3f}")
+                print(f"Bytes JPEG: {int(seleccion['largo'].sum())}")
+                print(f"Cuadros con detecciones: {int(np.count_nonzero(seleccion['detecciones']))}")
@@ -0,0 +1,153 @@
+# Benchmark reproducible del pipeline de detección.
+# Reproduce una carpeta (o un .zip) de imágenes JPEG por el mismo camino que
+# clasificacion.py y reporta la latencia por etapa y los FPS sostenidos en JSON.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zipfile
+
+import cv2
+import numpy as np
+
+from archivo import LectorArchivo, es_archivo
+from ajuste import cargar_perfil, clave_equipo
+from clasificacion import (CLASSES_FILE, CONFIG_PATH, PERFIL_AJUSTE, TAMANO_ENTRADA, UMBRAL_DETECTOR, WEIGHTS_PATH,
+                           TablaClases, cargar_clases, decodificar_jpeg, dibujar_detecciones, guardar_captura)
+from detector import configurar_modelo, detectar
+
+ETAPAS = ('decodificar', 'inferencia', 'anotar', 'guardar')
+
+# Lectura de las imágenes a reproducir
+
+def leer_jpegs(origen, desde=None, hasta=None):
+    """Devuelve la lista de JPEG de una carpeta, un .zip o un archivo de cuadros, en orden.
+
+    De un archivo de cuadros se devuelven vistas sobre los segmentos mapeados
+    (sin copiar), opcionalmente solo las del rango de horas [desde, hasta].
+    """
+    if es_archivo(origen):
+        lector = LectorArchivo(origen)
+        inicio, fin = lector.rango(desde, hasta)
+        return [lector.jpeg(posicion) for posicion in range(inicio, fin)]
+    if os.path.isdir(origen):
+        nombres = sorted(n for n in os.listdir(origen) if n.lower().endswith(('.jpg', '.jpeg')))
+        jpegs = []
+        for nombre in nombres:
+            with open(os.path.join(origen, nombre), 'rb') as f:
+                jpegs.append(f.read())
+        return jpegs
+    if zipfile.is_zipfile(origen):
+        with zipfile.ZipFile(origen) as archivo:
+            nombres = sorted(n for n in archivo.namelist() if n.lower().endswith(('.jpg', '.jpeg')))
+            return [archivo.read(nombre) for nombre in nombres]
+    raise ValueError(f"Origen no reconocido: {origen}")
+
+# Estadísticas
+
+def resumir(latencias):
+    """Percentiles p50/p95/p99, media y máximo de una lista de latencias en ms."""
+    if not latencias:
+        return {'muestras': 0}
+    valores = np.asarray(latencias, dtype=np.float64)
+    p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+    return {
+        'muestras': int(valores.size),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'media_ms': round(float(valores.mean()), 3),
+        'max_ms': round(float(valores.max()), 3),
+    }
+
+# Reproducción
+
+def ejecutar(jpegs, modelo, tabla, directorio_salida=None, repeticiones=1, calentamiento=5):
+    """Pasa cada JPEG por decodificar → detectar → dibujar → guardar y mide cada etapa."""
+    for jpeg in jpegs[:calentamiento]:
+        detectar(modelo, decodificar_jpeg(jpeg), UMBRAL_DETECTOR)
+
+    latencias = {etapa: [] for etapa in ETAPAS}
+    cuadros = 0
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for jpeg in jpegs:
+            t0 = time.perf_counter()
+            imagen = decodificar_jpeg(jpeg)
+            t1 = time.perf_counter()
+            if imagen is None:
+                continue
+            detecciones = tabla.filtrar(detectar(modelo, imagen, UMBRAL_DETECTOR))
+            t2 = time.perf_counter()
+            dibujar_detecciones(imagen, detecciones, tabla, registrar=False)
+            t3 = time.perf_counter()
+            latencias['decodificar'].append((t1 - t0) * 1000)
+            latencias['inferencia'].append((t2 - t1) * 1000)
+            latencias['anotar'].append((t3 - t2) * 1000)
+            if directorio_salida is not None:
+                guardar_captura(imagen, directorio_salida)
+                latencias['guardar'].append((time.perf_counter() - t3) * 1000)
+            cuadros += 1
+    duracion = time.perf_counter() - inicio
+
+    return {
+        'cuadros': cuadros,
+        'duracion_s': round(duracion, 3),
+        'fps_sostenido': round(cuadros / duracion, 3) if duracion > 0 else 0.0,
+        'etapas': {etapa: resumir(valores) for etapa, valores in latencias.items()},
+    }
+
+def describir_entorno():
+    """Datos del equipo para comparar resultados entre gateways."""
+    return {
+        'host': platform.node(),
+        'cpu': platform.processor() or platform.machine(),
+        'nucleos': os.cpu_count(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'hilos_opencv': cv2.getNumThreads(),
+    }
+
+# Flujo principal del benchmark
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de detección con imágenes grabadas.")
+    parser.add_argument('origen', help="Carpeta o archivo .zip con imágenes JPEG, o carpeta de un archivo de cuadros")
+    parser.add_argument('--desde', type=float, help="Hora inicial en un archivo de cuadros (segundos Unix)")
+    parser.add_argument('--hasta', type=float, help="Hora final en un archivo de cuadros (segundos Unix)")
+    parser.add_argument('--repeticiones', type=int, default=1, help="Veces que se reproduce el conjunto")
+    parser.add_argument('--calentamiento', type=int, default=5, help="Cuadros de calentamiento sin medir")
+    parser.add_argument('--sin-guardar', action='store_true', help="No mide la etapa de guardado")
+    parser.add_argument('--salida', help="Archivo JSON de resultados (por defecto, stdout)")
+    parser.add_argument('--perfil', default=PERFIL_AJUSTE, help="Archivo JSON de perfiles de ajuste")
+    parser.add_argument('--sin-ajuste', action='store_true',
+                        help="Usa la configuración predeterminada de la red en lugar del perfil de este equipo")
+    args = parser.parse_args()
+
+    jpegs = leer_jpegs(args.origen, args.desde, args.hasta)
+    if not jpegs:
+        sys.exit(f"No se encontraron imágenes JPEG en {args.origen}")
+    tabla = TablaClases(cargar_clases(CLASSES_FILE))
+    # El benchmark recorre cuadro por cuadro, así que se usa el ajuste medido para ese camino
+    ajuste = None if args.sin_ajuste else cargar_perfil(args.perfil, clave_equipo(WEIGHTS_PATH))
+    if ajuste is None and not args.sin_ajuste:
+        print(f"Sin ajuste para este equipo en {args.perfil}; se usa la configuración predeterminada",
+              file=sys.stderr)
+    modelo = configurar_modelo(CONFIG_PATH, WEIGHTS_PATH, ajuste, TAMANO_ENTRADA)
+
+    with tempfile.TemporaryDirectory() as temporal:
+        directorio_salida = None if args.sin_guardar else temporal
+        resultado = ejecutar(jpegs, modelo, tabla, directorio_salida, args.repeticiones, args.calentamiento)
+    resultado['origen'] = args.origen
+    resultado['entorno'] = describir_entorno()
+    resultado['ajuste'] = ajuste
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
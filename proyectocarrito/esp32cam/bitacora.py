@@ -0,0 +1,105 @@
+# Registro de eventos sin bloquear el bucle de detección.
+# Los mensajes se encolan con un QueueHandler y un QueueListener los escribe en
+# deteccion.log desde su propio hilo, con rotación por tamaño. Los mensajes
+# repetitivos llevan una clave (por ejemplo ('deteccion', cámara, clase)) y se
+# escribe como mucho uno por clave cada cierto intervalo; el siguiente que pasa
+# indica cuántos se omitieron. Los procesos trabajadores no abren el archivo:
+# mandan sus registros al proceso principal por una cola de multiprocessing.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from metricas import REGISTRO
+
+FORMATO = '%(asctime)s - %(message)s'
+
+class FiltroFrecuencia(logging.Filter):
+    """Deja pasar como mucho un registro por clave cada `intervalo` segundos.
+
+    La clave se da con `extra={'clave': ...}`; los registros sin clave pasan
+    siempre.
+    """
+
+    def __init__(self, intervalo=1.0):
+        super().__init__()
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._estado = {}  # clave -> [última vez escrita, omitidos desde entonces]
+
+    def filter(self, registro):
+        clave = getattr(registro, 'clave', None)
+        if clave is None:
+            return True
+        ahora = time.monotonic()
+        with self._lock:
+            estado = self._estado.get(clave)
+            if estado is not None and ahora - estado[0] < self.intervalo:
+                estado[1] += 1
+                omitido = True
+            else:
+                omitidos = estado[1] if estado is not None else 0
+                self._estado[clave] = [ahora, 0]
+                omitido = False
+        if omitido:
+            REGISTRO.incrementar('mensajes_omitidos', tipo=str(clave[0]) if isinstance(clave, tuple) else str(clave))
+            return False
+        if omitidos:
+            # Sin '%' en el agregado, así no interfiere con los argumentos del mensaje
+            registro.msg = f"{registro.msg} (+{omitidos} similares omitidos)"
+        return True
+
+def _crear_escucha(cola, archivo, bytes_maximos, copias):
+    """QueueListener que escribe la cola en `archivo` con rotación por tamaño."""
+    manejador = logging.handlers.RotatingFileHandler(archivo, maxBytes=bytes_maximos, backupCount=copias,
+                                                     encoding='utf-8')
+    manejador.setFormatter(logging.Formatter(FORMATO))
+    escucha = logging.handlers.QueueListener(cola, manejador, respect_handler_level=True)
+    escucha.start()
+    return escucha
+
+def configurar_registro(archivo, nivel=logging.INFO, bytes_maximos=10 * 1024 * 1024, copias=5, intervalo=1.0):
+    """Configura el logger raíz con cola, filtro de frecuencia y rotación; devuelve el QueueListener."""
+    cola = queue.SimpleQueue()
+    manejador = logging.handlers.QueueHandler(cola)
+    manejador.addFilter(FiltroFrecuencia(intervalo))
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers):
+        raiz.removeHandler(anterior)
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+
+    escucha = _crear_escucha(cola, archivo, bytes_maximos, copias)
+    # Al salir se vacía la cola antes de que logging cierre los manejadores
+    atexit.register(escucha.stop)
+    return escucha
+
+# Registro desde procesos trabajadores
+
+class _Reenvio(logging.Handler):
+    """Pasa cada registro recibido de otro proceso a los manejadores de este."""
+
+    def emit(self, registro):
+        logging.getLogger(registro.name).handle(registro)
+
+def escuchar_procesos(cola):
+    """Arranca un QueueListener que reenvía al registro de este proceso lo que llega por `cola`.
+
+    `cola` es una `multiprocessing.Queue` compartida con los trabajadores; los
+    registros pasan por el mismo filtro de frecuencia y el mismo archivo que
+    los del proceso principal.
+    """
+    escucha = logging.handlers.QueueListener(cola, _Reenvio())
+    escucha.start()
+    return escucha
+
+def registrar_en_cola(cola, nivel=logging.INFO):
+    """En un proceso trabajador: manda todo el registro a `cola` en lugar de a un archivo."""
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers):
+        raiz.removeHandler(anterior)
+    raiz.addHandler(logging.handlers.QueueHandler(cola))
+    raiz.setLevel(nivel)
@@ -1,10 +1,14 @@
 # Este proyecto permite la transmisión de video en tiempo real desde un ESP32 con cámara.
 # También incluye la funcionalidad de cargar datos a Firebase, simulando el almacenamiento de capturas.
 # Funciona configurando un servidor HTTP local para streaming y enviando datos periódicamente.
+# En el puerto 8081 atiende /control?framesize=VGA&quality=12 para que el detector
+# ajuste resolución y compresión según lo que la red y la inferencia aguantan.
 
 import network
 import esp
 import socket
+import select
+import json
 import gc
 import camera
 import time
@@ -16,6 +20,15 @@ gc.collect()
 
 # URL de Firebase (actualizar con tu proyecto)
 FIREBASE_URL = 'https://<tu-proyecto>.firebaseio.com/streaming.json'
+INTERVALO_FIREBASE = 30  # Segundos entre subidas a Firebase mientras hay un stream activo
+# Con stream activo /control espera a que termine la subida: el detector corta a los 3 s
+TIMEOUT_FIREBASE = 1  # Segundos de espera de cada operación de red de la subida
+
+# Ajustes de imagen que se pueden cambiar en marcha desde /control
+PUERTO_CONTROL = 8081
+TIMEOUT_CONTROL = 2  # Segundos que se espera a un cliente de /control antes de cerrarlo
+TAMANOS_CONTROL = ('QVGA', 'CIF', 'VGA', 'SVGA', 'XGA', 'HD', 'SXGA', 'UXGA')
+ajustes_camara = {'framesize': 'SVGA', 'quality': 15}  # SVGA para mayor detalle, calidad ajustada
 
 # Inicialización de la cámara
 def inicializar_camara():
@@ -24,10 +37,10 @@ def inicializar_camara():
     """
     camera.deinit()
     camera.init(0, format=camera.JPEG)
-    camera.framesize(camera.FRAME_SVGA)  # Tamaño SVGA para mayor detalle
+    camera.framesize(getattr(camera, 'FRAME_' + ajustes_camara['framesize']))
     camera.flip(1)  # Voltear imagen verticalmente
     camera.mirror(1)  # Reflejar imagen horizontalmente
-    camera.quality(15)  # Calidad ajustada
+    camera.quality(ajustes_camara['quality'])
     camera.brightness(-2)  # Ajustar brillo para iluminación baja
     camera.saturation(-1)  # Reducir saturación para colores naturales
     print("Cámara lista para capturas.")
@@ -60,16 +73,76 @@ def subir_a_firebase(datos):
     """
     try:
         print("Enviando datos a Firebase...")
-        respuesta = urequests.put(FIREBASE_URL, json=datos)
+        respuesta = urequests.put(FIREBASE_URL, json=datos, timeout=TIMEOUT_FIREBASE)
         print(f"Respuesta de Firebase: {respuesta.status_code}")
         respuesta.close()
     except Exception as error:
         print(f"Error al subir datos: {error}")
 
+# Control de resolución y calidad
+def aplicar_ajustes(parametros):
+    """
+    Aplica framesize (nombre, por ejemplo VGA) y quality (10 a 63, menor es mejor).
+    Devuelve False si algún valor no es válido.
+    """
+    tamano = parametros.get('framesize')
+    calidad = parametros.get('quality')
+    if tamano is not None:
+        tamano = tamano.upper()
+        if tamano not in TAMANOS_CONTROL or not hasattr(camera, 'FRAME_' + tamano):
+            return False
+    if calidad is not None:
+        try:
+            calidad = int(calidad)
+        except ValueError:
+            return False
+        if not 10 <= calidad <= 63:
+            return False
+    if tamano is not None and tamano != ajustes_camara['framesize']:
+        camera.framesize(getattr(camera, 'FRAME_' + tamano))
+        ajustes_camara['framesize'] = tamano
+    if calidad is not None and calidad != ajustes_camara['quality']:
+        camera.quality(calidad)
+        ajustes_camara['quality'] = calidad
+    return True
+
+def atender_control(control):
+    """
+    Atiende una petición GET /control?framesize=...&quality=... y responde los ajustes vigentes en JSON.
+    """
+    cliente, _ = control.accept()
+    try:
+        # Un cliente que conecta y no envía nada no debe congelar el stream
+        cliente.settimeout(TIMEOUT_CONTROL)
+        cliente_file = cliente.makefile('rwb', 0)
+        solicitud = cliente_file.readline().decode()
+        while True:
+            linea = cliente_file.readline()
+            if not linea or linea == b'\r\n':
+                break
+        partes = solicitud.split(' ')
+        ruta = partes[1] if len(partes) > 1 else '/'
+        parametros = {}
+        if '?' in ruta:
+            for par in ruta.split('?', 1)[1].split('&'):
+                nombre, _, valor = par.partition('=')
+                parametros[nombre] = valor
+        if aplicar_ajustes(parametros):
+            cliente.send(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n')
+            cliente.send(json.dumps(ajustes_camara).encode())
+            if parametros:
+                print(f"Ajustes de cámara: {ajustes_camara}")
+        else:
+            cliente.send(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n')
+    except Exception as error:
+        print(f"Error en control: {error}")
+    finally:
+        cliente.close()
+
 # Configuración del servidor de streaming
 def iniciar_streaming():
     """
-    Configura un servidor HTTP para transmitir video en tiempo real.
+    Configura un servidor HTTP para transmitir video en tiempo real y otro para el control.
     """
     ip = conectar_a_wifi()
     direccion = socket.getaddrinfo(ip, 8080)[0][-1]
@@ -79,21 +152,43 @@ def iniciar_streaming():
     servidor.listen(3)  # Aceptar hasta 3 conexiones simultáneas
     print(f"Servidor disponible en http://{ip}:8080")
 
+    control = socket.socket()
+    control.bind(socket.getaddrinfo(ip, PUERTO_CONTROL)[0][-1])
+    control.listen(1)
+    print(f"Control disponible en http://{ip}:{PUERTO_CONTROL}/control")
+
+    # Se espera en ambos sockets: el control se atiende aunque nadie esté viendo el stream
+    sondeo = select.poll()
+    sondeo.register(servidor, select.POLLIN)
+    sondeo.register(control, select.POLLIN)
     while True:
-        try:
-            cliente, direccion_cliente = servidor.accept()
-            print(f"Nueva conexión desde: {direccion_cliente}")
-            manejar_cliente(cliente)
-        except Exception as error:
-            print(f"Error manejando cliente: {error}")
-        finally:
-            cliente.close()
+        for evento in sondeo.poll():
+            if evento[0] is control:
+                atender_control(control)
+                continue
+            cliente = None
+            try:
+                cliente, direccion_cliente = servidor.accept()
+                print(f"Nueva conexión desde: {direccion_cliente}")
+                manejar_cliente(cliente, control)
+            except Exception as error:
+                print(f"Error manejando cliente: {error}")
+            finally:
+                if cliente is not None:
+                    cliente.close()
 
 # Manejo de solicitudes de clientes
-def manejar_cliente(cliente):
+def manejar_cliente(cliente, control=None):
     """
-    Envia el streaming de video y simula una carga periódica a Firebase.
+    Envia el streaming de video al ritmo de la cámara y sube un registro a
+    Firebase cada INTERVALO_FIREBASE segundos, sin frenar los cuadros.
+    Entre cuadro y cuadro, y antes de cada subida, atiende las peticiones de
+    control pendientes, así ninguna espera más que un cuadro y una subida.
     """
+    sondeo_control = None
+    if control is not None:
+        sondeo_control = select.poll()
+        sondeo_control.register(control, select.POLLIN)
     cliente_file = cliente.makefile('rwb', 0)
     while True:
         linea = cliente_file.readline()
@@ -103,21 +198,28 @@ def manejar_cliente(cliente):
     cliente.send(b'HTTP/1.1 200 OK\r\n')
     cliente.send(b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n\r\n')
 
+    ultima_subida = None
     try:
         while True:
+            if sondeo_control is not None and sondeo_control.poll(0):
+                atender_control(control)
             imagen = camera.capture()
             cliente.send(b'--frame\r\n')
-            cliente.send(b'Content-Type: image/jpeg\r\n\r\n')
+            cliente.send(b'Content-Type: image/jpeg\r\n')
+            cliente.send(('Content-Length: %d\r\n\r\n' % len(imagen)).encode())
             cliente.send(imagen)
             cliente.send(b'\r\n')
 
-            datos_firebase = {
-                "timestamp": time.time(),
-                "info": "Imagen enviada a cliente"
-            }
-            subir_a_firebase(datos_firebase)
-
-            time.sleep(3)
+            ahora = time.ticks_ms()
+            if ultima_subida is None or time.ticks_diff(ahora, ultima_subida) >= INTERVALO_FIREBASE * 1000:
+                if sondeo_control is not None and sondeo_control.poll(0):
+                    atender_control(control)
+                datos_firebase = {
+                    "timestamp": time.time(),
+                    "info": "Imagen enviada a cliente"
+                }
+                subir_a_firebase(datos_firebase)
+                ultima_subida = ahora
     except Exception as error:
         print(f"Conexión finalizada: {error}")
 
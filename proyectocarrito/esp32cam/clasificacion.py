@@ -1,21 +1,125 @@
 import cv2  # OpenCV para procesamiento de imágenes
 import urllib.request  # Para manejar solicitudes HTTP
+import urllib.error
+import urllib.parse
+import json
 import numpy as np
 import time
 import logging  # Para el registro de eventos y errores
 import os  # Para manejo de archivos locales
+import sys
+import threading  # Para capturar cuadros en segundo plano
+import queue  # Cola acotada para el guardado asíncrono
+import itertools
+from concurrent.futures import ThreadPoolExecutor  # Arranque con carga del modelo en paralelo
+
+from bitacora import configurar_registro  # Registro en cola, con rotación y límite de frecuencia
+from metricas import REGISTRO, iniciar_servidor_metricas  # Métricas por ventana y exportador Prometheus
+from salida import SalidaDetecciones  # Detecciones en NDJSON o binario para el modo sin pantalla
+from multicamara import CapturadorMulticamara  # Descarga concurrente de varias cámaras con asyncio
+from trabajadores import BYTES_RANURA, PoolInferencia  # Procesos de inferencia con cuadros en memoria compartida
+from grabacion import GrabadorClips  # Clips con segundos previos y posteriores a cada evento
+from archivo import EscritorArchivo  # Archivo de cuadros en segmentos con índice por hora
+from historial import HistorialDetecciones  # Detecciones en bloques columnares para reportes
+from retransmision import DifusorMJPEG, iniciar_servidor_mjpeg  # Stream anotado para varios espectadores
+from puente_mqtt import PuenteMQTT  # Eventos de detección y órdenes de alto al carrito por MQTT
+from duplicados import EsperaDuplicados, FiltroDuplicados  # Huella del JPEG crudo para saltar cuadros repetidos
+from ajuste import muestras_ajuste, obtener_ajuste  # Backend, hilos y entrada medidos por equipo
+from detector import (Cuadro, Detecciones, DetectorMosaicos, DetectorPorLotes,  # Red y tipos compartidos
+                      a_cuadro_completo, calentar_modelo, configurar_modelo, detectar_lote,
+                      recortes_de_interes)
+from detector import (LOTE_MAXIMO, NIVELES_MOSAICOS, PRESUPUESTO_MOSAICOS,  # Configuración del detector
+                      SOLAPE_MOSAICOS, TAMANO_ENTRADA, UMBRAL_CONFIANZA, UMBRAL_NMS_MOSAICOS)
 
 # CONFIGURACIÓN DEL PROGRAMA
 CAMERA_URL = 'http://192.168.1.191/cam-hi.jpg'  # Dirección IP de la cámara
+STREAM_URL = 'http://192.168.1.191:8080/'  # Stream MJPEG servido por esp32cam/boot.py
+MODO_CAPTURA = 'snapshot'  # 'snapshot' (una petición por cuadro) o 'mjpeg' (una sola conexión)
 CLASSES_FILE = 'coco.names'  # Archivo con nombres de clases
 CONFIG_PATH = 'ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt'  # Configuración del modelo
 WEIGHTS_PATH = 'frozen_inference_graph.pb'  # Pesos del modelo
 WINDOW_NAME = 'Detección en Tiempo Real'
 LOG_FILE = 'deteccion.log'  # Archivo de registro
+BYTES_MAXIMOS_LOG = 10 * 1024 * 1024  # Tamaño de deteccion.log antes de rotarlo
+COPIAS_LOG = 5  # Archivos rotados que se conservan (deteccion.log.1 ... .5)
+INTERVALO_LOG_REPETIDO = 1.0  # Segundos mínimos entre mensajes iguales (misma clase y cámara)
 CAPTURE_DIR = 'captures/'  # Carpeta para guardar capturas
+ESPERA_REINTENTO = 0.5  # Segundos de espera tras un error de captura
+TIMEOUT_STREAM = 10  # Segundos sin datos antes de reconectar el stream
+TIMEOUT_CAPTURA = 5  # Segundos de espera de una captura suelta antes de reintentar
+CONTROL_CAMARA = None  # URL de control de esp32cam/boot.py, p. ej. 'http://192.168.1.191:8081/control'; None = calidad fija
+ESCALONES_CAMARA = [('QVGA', 20), ('CIF', 18), ('VGA', 15), ('SVGA', 15), ('XGA', 12)]  # (framesize, quality) de menor a mayor
+LATENCIA_MAXIMA_CAMARA = 0.5  # Segundos de descarga por cuadro a partir de los cuales se baja un escalón
+OCUPACION_MAXIMA_CAMARA = 0.8  # Fracción del tiempo entre cuadros que puede ocupar la transferencia del stream
+ANCHO_BANDA_MAXIMO_CAMARA = 1024 * 1024  # Bytes por segundo que puede consumir la cámara; None = sin tope
+INTERVALO_CONTROL_CAMARA = 5.0  # Segundos de mediciones entre decisiones del control de calidad
+ESPERA_SUBIDA_CAMARA = 30.0  # Segundos tras una bajada antes de volver a probar un escalón mayor
+TIMEOUT_CONTROL = 3  # Segundos de espera de una petición de control; boot.py responde en un cuadro y una subida
+TAMANO_BLOQUE = 16384  # Bytes leídos del stream en cada llamada
+TAMANO_BUFFER_JPEG = 256 * 1024  # Buffer inicial reutilizado para descargar capturas sueltas
+ESCRITORES_CAPTURA = 2  # Hilos que guardan capturas en disco
+TAMANO_COLA_CAPTURAS = 32  # Capturas pendientes de guardar como máximo
+POLITICA_COLA_CAPTURAS = 'descartar_antigua'  # 'descartar_antigua' o 'bloquear' cuando la cola está llena
+GUARDAR_JPEG_ORIGINAL = False  # True: guarda el JPEG de la cámara sin volver a codificar
+MODO_GUARDADO = 'clips'  # 'clips' (solo alrededor de eventos), 'cuadros' (cada cuadro) o None
+CLASES_GRABACION = ['persona']  # Clases cuya detección dispara un clip
+SEGUNDOS_ANTES_CLIP = 5.0  # Segundos previos al evento que se guardan en el clip
+SEGUNDOS_DESPUES_CLIP = 10.0  # Segundos que se sigue grabando tras la última detección
+SEGUNDOS_MAXIMOS_CLIP = 300.0  # Duración máxima de un archivo de clip; después se abre un segmento nuevo
+FORMATO_CLIP = 'mjpeg'  # 'mjpeg' (JPEG concatenados, sin recodificar) o 'avi' (cv2.VideoWriter MJPG)
+ARCHIVO_CUADROS = None  # Carpeta del archivo continuo de cuadros (leer con archivo.py), o None
+HISTORIAL_DETECCIONES = 'historial/'  # Carpeta del historial columnar (reportes con historial.py), o None
+# TAMANO_ENTRADA, UMBRAL_CONFIANZA, LOTE_MAXIMO y los parámetros de los mosaicos se configuran en detector.py
+AJUSTE_AUTOMATICO = True  # Mide backend, hilos y tamaño de entrada la primera vez en cada equipo
+PERFIL_AJUSTE = 'perfil_dnn.json'  # Archivo donde se guarda el ajuste de cada equipo
+TAMANOS_CANDIDATOS = [(320, 320), (288, 288), (256, 256)]  # Tamaños de entrada que prueba el ajuste
+PRESUPUESTO_INFERENCIA = 0.1  # Segundos por inferencia; el ajuste elige el mayor tamaño que entra
+DECODIFICACION_REDUCIDA = False  # Decodifica a 1/2, 1/4 o 1/8 si sobra resolución para la red
+REGIONES_INTERES = []  # [(x, y, ancho, alto)] en píxeles del cuadro completo; vacío = cuadro entero
+MODO_MOSAICOS = False  # Detecta también en mosaicos solapados para objetos pequeños o lejanos
+DESCARTAR_DUPLICADOS = True  # Salta sin decodificar los JPEG idénticos al anterior de la misma cámara
+CLASES_INTERES = []  # Nombres de coco.names que se procesan, p. ej. ['persona', 'car', 'dog']; vacío = todas
+UMBRALES_CLASE = {}  # Confianza mínima por clase, p. ej. {'persona': 0.4}; las demás usan UMBRAL_CONFIANZA
+COMPUERTA_MOVIMIENTO = True  # Omite la red neuronal si la escena no cambió
+TAMANO_MOVIMIENTO = (80, 60)  # Resolución reducida para comparar cuadros
+UMBRAL_PIXEL_MOVIMIENTO = 25  # Diferencia de gris para considerar que un píxel cambió
+UMBRAL_MOVIMIENTO = 0.01  # Fracción de píxeles cambiados que dispara la detección
+MAX_SEGUNDOS_SIN_DETECCION = 5.0  # Fuerza una detección aunque la escena parezca quieta
+MODO_RASTREO = False  # Detecta cada N cuadros y rastrea las cajas entre detecciones
+DETECTAR_CADA = 5  # Cuadros entre detecciones completas en modo rastreo
+UMBRAL_IOU_RASTREO = 0.3  # IoU mínima para asociar una detección con una pista
+DECAIMIENTO_RASTREO = 0.9  # Factor por cuadro con el que baja la confianza de una pista
+UMBRAL_CONFIANZA_RASTREO = 0.35  # Bajo esta confianza se fuerza una detección
+MAX_PERDIDAS_RASTREO = 2  # Detecciones seguidas sin asociar antes de borrar una pista
+PUERTO_METRICAS = 9108  # Puerto local de /metrics (None para desactivar)
+PUERTO_RETRANSMISION = 8090  # Puerto del stream MJPEG anotado para espectadores (None para desactivar)
+DIRECCION_RETRANSMISION = '127.0.0.1'  # Solo este equipo; '0.0.0.0' la abre a la red (sin autenticación)
+CALIDAD_RETRANSMISION = 70  # Calidad JPEG de los cuadros retransmitidos
+MQTT_ACTIVO = False  # Publica detecciones y órdenes de alto en el broker del carrito
+SERVIDOR_MQTT = 'broker.mqttdashboard.com'  # Mismo broker que esp32/esp32 1/boot.py
+PUERTO_MQTT = 1883
+TOPICO_DETECCIONES = b"detecpapi"  # Un evento JSON compacto por cuadro con detecciones
+TOPICO_ALTO = b"altopapi"  # Tópico de alto al que está suscrito el carrito
+CLASES_ALTO = ['persona']  # Clases que detienen el carrito si aparecen en la región de peligro
+REGION_PELIGRO = None  # (x, y, ancho, alto) en píxeles del cuadro completo; None = todo el cuadro
+INTERVALO_ALTO = 0.5  # Segundos mínimos entre órdenes de alto de una misma cámara
+SIN_PANTALLA = False  # True en gateways sin monitor: sin ventana ni dibujo salvo para guardar
+SALIDA_DETECCIONES = None  # '-' para stdout, una ruta de archivo o None para no emitir
+FORMATO_DETECCIONES = 'ndjson'  # 'ndjson' (una línea JSON por cuadro) o 'binario'
+ID_CAMARA = 'esp32cam'  # Identificador de la cámara en la salida estructurada
+# Modo multicámara: si la lista no está vacía se ignoran CAMERA_URL/STREAM_URL y
+# todas las cámaras comparten un solo modelo. Ejemplo:
+# CAMARAS = [{'id': 'carro1', 'url': 'http://192.168.1.191:8080/', 'modo': 'mjpeg'},
+#            {'id': 'carro2', 'url': 'http://192.168.1.192/cam-hi.jpg', 'modo': 'snapshot'}]
+CAMARAS = []
+POLITICA_CAMARAS = 'round_robin'  # 'round_robin' o 'mas_reciente' para repartir el detector
+INFERENCIA_POR_LOTES = False  # Junta cuadros pendientes en un solo forward de la red
+LATENCIA_MAXIMA_LOTE = 0.25  # Segundos que puede tardar un lote antes de reducir su tamaño
+TRABAJADORES_INFERENCIA = 0  # Procesos con su propio modelo (0: inferencia en este proceso)
 
-# Configuración de logging
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(message)s')
+# El detector corta con el umbral más bajo configurado; `TablaClases.filtrar`
+# aplica después el de cada clase
+UMBRAL_DETECTOR = min([UMBRAL_CONFIANZA, *UMBRALES_CLASE.values()])
 
 # Función para cargar clases desde el archivo
 
@@ -24,90 +128,1268 @@ def cargar_clases(archivo):
     with open(archivo, 'rt') as f:
         return f.read().strip().split('\n')
 
+class TablaClases:
+    """Umbrales, etiquetas, colores y tamaños de texto por clase, calculados una sola vez.
+
+    Los arreglos se indexan con el id de clase del detector (que empieza en 1);
+    la posición 0 y la última representan ids desconocidos. Las clases fuera de
+    la lista de interés tienen umbral infinito, así `filtrar` las descarta con
+    una sola máscara de NumPy antes de cualquier trabajo por caja.
+    """
+
+    FUENTE = cv2.FONT_HERSHEY_SIMPLEX
+    ESCALA_FUENTE = 0.5
+    GROSOR_FUENTE = 2
+
+    def __init__(self, nombres, interes=CLASES_INTERES, umbrales=UMBRALES_CLASE, umbral=UMBRAL_CONFIANZA):
+        desconocidas = (set(interes) | set(umbrales)) - set(nombres)
+        if desconocidas:
+            logging.warning(f"Clases configuradas que no están en {CLASSES_FILE}: {sorted(desconocidas)}")
+        self.nombres = nombres
+        self.desconocida = len(nombres) + 1
+        self.umbrales = np.full(len(nombres) + 2, np.inf, dtype=np.float32)
+        for class_id, nombre in enumerate(nombres, start=1):
+            if not interes or nombre in interes:
+                self.umbrales[class_id] = umbrales.get(nombre, umbral)
+        self.etiquetas = ['?'] + list(nombres) + ['?']
+        # Tonos repartidos con la razón áurea: clases vecinas quedan con colores distintos
+        tonos = (np.arange(len(self.etiquetas)) * 0.618034 % 1.0 * 180).astype(np.uint8)
+        hsv = np.stack([tonos, np.full_like(tonos, 220), np.full_like(tonos, 255)], axis=1).reshape(-1, 1, 3)
+        self.colores = [tuple(int(c) for c in bgr) for bgr in cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR).reshape(-1, 3)]
+        self.tamanos_texto = [cv2.getTextSize(f"{etiqueta}: 0.00", self.FUENTE, self.ESCALA_FUENTE,
+                                              self.GROSOR_FUENTE)[0] for etiqueta in self.etiquetas]
+        self._mascaras = {}
+
+    def indices(self, class_ids):
+        """Lleva los ids fuera de rango a una posición de clase desconocida."""
+        return np.clip(class_ids, 0, self.desconocida)
+
+    def de_clases(self, nombres):
+        """Máscara booleana por id de clase, True para las clases nombradas."""
+        clave = tuple(nombres)
+        mascara = self._mascaras.get(clave)
+        if mascara is None:
+            mascara = np.zeros(len(self.umbrales), dtype=bool)
+            for class_id, nombre in enumerate(self.nombres, start=1):
+                mascara[class_id] = nombre in nombres
+            self._mascaras[clave] = mascara
+        return mascara
+
+    def filtrar(self, detecciones):
+        """Deja las detecciones de clases de interés que superan el umbral de su clase."""
+        if len(detecciones.class_ids) == 0:
+            return detecciones
+        mascara = detecciones.confidences >= self.umbrales[self.indices(detecciones.class_ids)]
+        if mascara.all():
+            return detecciones
+        REGISTRO.incrementar('detecciones_filtradas', int(mascara.size - np.count_nonzero(mascara)))
+        track_ids = detecciones.track_ids
+        return Detecciones(detecciones.class_ids[mascara], detecciones.confidences[mascara],
+                           detecciones.boxes[mascara],
+                           None if track_ids is None else np.asarray(track_ids)[mascara])
+
 # Configuración de la red neuronal
 
-def configurar_modelo(config, weights):
-    """Configura el modelo de detección con parámetros predeterminados."""
-    modelo = cv2.dnn_DetectionModel(weights, config)
-    modelo.setInputSize(320, 320)
-    modelo.setInputScale(1.0 / 127.5)
-    modelo.setInputMean((127.5, 127.5, 127.5))
-    modelo.setInputSwapRB(True)
-    logging.info("Modelo de detección configurado correctamente.")
-    return modelo
+def lote_del_detector():
+    """Cuadros por forward del detector local: LOTE_MAXIMO con inferencia por lotes, si no 1."""
+    return LOTE_MAXIMO if INFERENCIA_POR_LOTES and not TRABAJADORES_INFERENCIA else 1
+
+def red_por_lotes():
+    """True si el modelo local debe ser `DetectorPorLotes`.
+
+    Con mosaicos también: el cuadro y sus mosaicos van en un solo forward, y
+    con `cv2.dnn_DetectionModel` serían un forward por mosaico.
+    """
+    return (INFERENCIA_POR_LOTES or MODO_MOSAICOS) and not TRABAJADORES_INFERENCIA
+
+def modelo_para_ajuste(ajuste):
+    """Modelo con el que se mide un ajuste: el mismo camino que usará `preparar_detector`."""
+    if red_por_lotes():
+        return DetectorPorLotes(CONFIG_PATH, WEIGHTS_PATH, TAMANO_ENTRADA, ajuste=ajuste, lote_maximo=LOTE_MAXIMO)
+    return configurar_modelo(CONFIG_PATH, WEIGHTS_PATH, ajuste, TAMANO_ENTRADA)
+
+def ajuste_del_equipo(forzar=False):
+    """Ajuste de la red para este equipo (del perfil o medido ahora), o None si está desactivado."""
+    if not AJUSTE_AUTOMATICO:
+        return None
+    return obtener_ajuste(modelo_para_ajuste, WEIGHTS_PATH, PERFIL_AJUSTE, lambda: muestras_ajuste(CAPTURE_DIR),
+                          TAMANOS_CANDIDATOS, PRESUPUESTO_INFERENCIA, forzar, lote_del_detector())
+
+def opciones_mosaicos():
+    """Parámetros de `DetectorMosaicos` según la configuración."""
+    return {'niveles': NIVELES_MOSAICOS, 'solape': SOLAPE_MOSAICOS, 'umbral_nms': UMBRAL_NMS_MOSAICOS,
+            'presupuesto': PRESUPUESTO_MOSAICOS}
+
+def preparar_detector():
+    """Mide o lee el ajuste, carga y calienta el modelo; devuelve (modelo, pool).
+
+    Pensada para correr en un hilo mientras la cámara se conecta: OpenCV
+    suelta el GIL al leer el grafo y durante el forward.
+    """
+    ajuste = ajuste_del_equipo()
+    if TRABAJADORES_INFERENCIA:
+        # Los modelos viven en los procesos trabajadores, no en este
+        # Con control de calidad las ranuras se dimensionan para el mayor escalón de la cámara
+        bytes_ranura = BYTES_RANURA
+        if CONTROL_CAMARA and not CAMARAS:
+            bytes_ranura = max(bytes_ranura, 3 * max(PIXELES_CAMARA[tamano] for tamano, _ in ESCALONES_CAMARA))
+        pool = PoolInferencia(CONFIG_PATH, WEIGHTS_PATH, TRABAJADORES_INFERENCIA, bytes_ranura=bytes_ranura,
+                              regiones=REGIONES_INTERES, mosaicos=opciones_mosaicos() if MODO_MOSAICOS else None, ajuste=ajuste,
+                              tamano=TAMANO_ENTRADA, umbral=UMBRAL_DETECTOR).iniciar()
+        return None, pool
+    with REGISTRO.medir('carga_modelo'):
+        if red_por_lotes():
+            modelo = DetectorPorLotes(CONFIG_PATH, WEIGHTS_PATH, TAMANO_ENTRADA, ajuste=ajuste, lote_maximo=LOTE_MAXIMO)
+        else:
+            modelo = configurar_modelo(CONFIG_PATH, WEIGHTS_PATH, ajuste, TAMANO_ENTRADA)
+    # Se calienta antes de envolver en mosaicos: el primer forward lento bajaría el nivel
+    calentar_modelo(modelo)
+    if MODO_MOSAICOS:
+        modelo = DetectorMosaicos(modelo, **opciones_mosaicos())
+        REGISTRO.registrar_medidor('mosaicos_por_cuadro', modelo.mosaicos, 'Mosaicos del nivel actual')
+    return modelo, None
 
 # Captura imágenes desde la cámara IP
 
-def capturar_imagen(url):
-    """Captura y decodifica una imagen desde una URL."""
+# Banderas de cv2.imdecode según el factor de reducción
+BANDERAS_REDUCCION = {
+    1: -1,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def decodificar_jpeg(datos, factor=1):
+    """Decodifica bytes JPEG (bytes, bytearray o memoryview) sin copiarlos.
+
+    Con `factor` 2, 4 u 8 el decodificador JPEG entrega la imagen ya reducida,
+    lo que es bastante más rápido que decodificarla completa.
+    """
+    return cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), BANDERAS_REDUCCION[factor])
+
+def dimensiones_jpeg(datos):
+    """Devuelve (ancho, alto) leídos del marcador SOF del JPEG, o None."""
+    vista = memoryview(datos)
+    i = 2
+    while i + 9 < len(vista):
+        if vista[i] != 0xFF:
+            i += 1
+            continue
+        marcador = vista[i + 1]
+        if marcador == 0xFF or marcador == 0x01 or 0xD0 <= marcador <= 0xD8:
+            i += 1 if marcador == 0xFF else 2
+            continue
+        # SOF0..SOF15 salvo DHT (C4), JPG (C8) y DAC (CC)
+        if 0xC0 <= marcador <= 0xCF and marcador not in (0xC4, 0xC8, 0xCC):
+            alto = (vista[i + 5] << 8) | vista[i + 6]
+            ancho = (vista[i + 7] << 8) | vista[i + 8]
+            return ancho, alto
+        i += 2 + ((vista[i + 2] << 8) | vista[i + 3])
+    return None
+
+def factor_reduccion(dimensiones, entrada=TAMANO_ENTRADA, regiones=REGIONES_INTERES):
+    """Mayor factor (1, 2, 4 u 8) que deja a la zona analizada al menos del tamaño de la red.
+
+    Se compara el lado mayor de la zona (el cuadro o la región de interés más
+    grande) con el lado mayor de la entrada de la red.
+    """
+    if dimensiones is None:
+        return 1
+    ancho, alto = dimensiones
+    if regiones:
+        lado = max(max(min(w, ancho), min(h, alto)) for _, _, w, h in regiones)
+    else:
+        lado = max(ancho, alto)
+    for factor in (8, 4, 2):
+        if lado / factor >= max(entrada):
+            return factor
+    return 1
+
+def decodificar_cuadro(datos, reducida=DECODIFICACION_REDUCIDA):
+    """Decodifica un JPEG de la cámara y devuelve (imagen, escala)."""
+    factor = factor_reduccion(dimensiones_jpeg(datos)) if reducida else 1
+    return decodificar_jpeg(datos, factor), factor
+
+def abrir_captura(url, timeout=TIMEOUT_CAPTURA):
+    """Abre la URL de una captura; si la cámara no responde a tiempo lanza TimeoutError."""
     try:
-        respuesta = urllib.request.urlopen(url)
-        datos = np.array(bytearray(respuesta.read()), dtype=np.uint8)
-        imagen = cv2.imdecode(datos, -1)
-        return imagen
-    except Exception as e:
-        logging.error(f"Error al capturar imagen: {e}")
-        return None
+        return urllib.request.urlopen(url, timeout=timeout)
+    except urllib.error.URLError as e:
+        # urlopen envuelve el timeout de la conexión; se expone como tal para el registro
+        if isinstance(e.reason, TimeoutError):
+            raise TimeoutError(f"La cámara no respondió en {timeout} s") from e
+        raise
+
+class DescargadorJPEG:
+    """Descarga capturas sueltas leyendo siempre en el mismo buffer.
+
+    Con Content-Length el cuerpo se lee con `readinto` en un bytearray
+    preasignado y se devuelve una vista sin copiar. La vista se sobrescribe en
+    la siguiente descarga: quien necesite conservar los bytes debe copiarlos.
+    Si la cámara deja de responder la descarga lanza TimeoutError tras
+    `timeout` segundos; el capturador lo registra y vuelve a pedir.
+    """
+
+    def __init__(self, url, tamano=TAMANO_BUFFER_JPEG, timeout=TIMEOUT_CAPTURA):
+        self.url = url
+        self.timeout = timeout
+        self._buffer = bytearray(tamano)
+
+    def descargar(self):
+        """Devuelve un memoryview con el JPEG recién descargado."""
+        with abrir_captura(self.url, self.timeout) as respuesta:
+            longitud = respuesta.length
+            if longitud is None:
+                return memoryview(respuesta.read())
+            if longitud > len(self._buffer):
+                # Buffer nuevo en lugar de redimensionar: las vistas anteriores siguen válidas
+                self._buffer = bytearray(longitud + longitud // 2)
+            vista = memoryview(self._buffer)
+            leidos = 0
+            while leidos < longitud:
+                n = respuesta.readinto(vista[leidos:longitud])
+                if not n:
+                    raise ConnectionError("Respuesta incompleta de la cámara")
+                leidos += n
+            return vista[:longitud]
+
+# Lectura del stream MJPEG (multipart/x-mixed-replace)
+
+class LectorMJPEG:
+    """Mantiene una sola conexión al stream MJPEG y separa los cuadros JPEG.
+
+    Cada cuadro se delimita por el boundary del Content-Type. Si la parte trae
+    Content-Length se usa directamente; si no, el cuadro termina en el marcador
+    EOI de JPEG (FF D9), así no hay que esperar al siguiente boundary.
+    """
+
+    def __init__(self, url, timeout=TIMEOUT_STREAM):
+        self.url = url
+        self.timeout = timeout
+        self._respuesta = None
+        self._delimitador = b'--frame'
+        self._buffer = bytearray()
+        self._consumido = 0
+        self.transferencia = 0.0  # Segundos que tardó en llegar el cuerpo del último JPEG
+
+    def conectar(self):
+        """Abre la conexión y lee el boundary anunciado por la cámara."""
+        self._respuesta = urllib.request.urlopen(self.url, timeout=self.timeout)
+        boundary = self._respuesta.headers.get_param('boundary')
+        if boundary:
+            boundary = boundary.strip('"')
+            if not boundary.startswith('--'):
+                boundary = '--' + boundary
+            self._delimitador = boundary.encode('ascii')
+        self._buffer = bytearray()
+        self._consumido = 0
+        logging.info(f"Conectado al stream MJPEG {self.url}")
+        return self
+
+    def cerrar(self):
+        """Cierra la conexión con la cámara."""
+        if self._respuesta is not None:
+            self._respuesta.close()
+            self._respuesta = None
+
+    def _leer_mas(self):
+        """Agrega al buffer los bytes disponibles en el socket."""
+        bloque = self._respuesta.read1(TAMANO_BLOQUE)
+        if not bloque:
+            raise ConnectionError("El stream MJPEG se cerró")
+        self._buffer += bloque
+
+    def _buscar(self, patron, desde):
+        """Busca un patrón en el buffer leyendo del socket hasta encontrarlo."""
+        while True:
+            posicion = self._buffer.find(patron, desde)
+            if posicion >= 0:
+                return posicion
+            desde = max(desde, len(self._buffer) - len(patron) + 1)
+            self._leer_mas()
+
+    def leer_jpeg(self):
+        """Devuelve un memoryview con el siguiente JPEG del stream.
+
+        El cuadro no se copia. La vista sigue siendo válida después de otras
+        llamadas porque el lector nunca vuelve a modificar ese buffer.
+        """
+        # Se descarta lo ya entregado creando un buffer nuevo con el resto, así
+        # las vistas (y arreglos de NumPy) del cuadro anterior siguen siendo válidas.
+        if self._consumido:
+            self._buffer = self._buffer[self._consumido:]
+            self._consumido = 0
+
+        inicio_parte = self._buscar(self._delimitador, 0)
+        fin_cabeceras = self._buscar(b'\r\n\r\n', inicio_parte)
+        cabeceras = bytes(self._buffer[inicio_parte:fin_cabeceras]).decode('latin-1')
+        inicio = fin_cabeceras + 4
+
+        longitud = None
+        for linea in cabeceras.split('\r\n')[1:]:
+            nombre, _, valor = linea.partition(':')
+            if nombre.strip().lower() == 'content-length':
+                longitud = int(valor)
+        # Solo se mide el cuerpo: la espera hasta las cabeceras es el ritmo de la cámara, no la red
+        inicio_transferencia = time.perf_counter()
+        if longitud is not None:
+            while len(self._buffer) < inicio + longitud:
+                self._leer_mas()
+            fin = inicio + longitud
+        else:
+            fin = self._buscar(b'\xff\xd9', inicio) + 2
+        self.transferencia = time.perf_counter() - inicio_transferencia
+
+        self._consumido = fin
+        return memoryview(self._buffer)[inicio:fin]
+
+# Captura en segundo plano: conserva solo el cuadro más reciente
+
+class CapturadorFrames:
+    """Hilo que captura cuadros sin parar y entrega siempre el más reciente.
+
+    Los cuadros que nadie alcanzó a procesar se descartan y se cuentan en
+    `descartados`, de modo que el detector nunca trabaja con imágenes viejas.
+    Los bytes JPEG solo se conservan en el `Cuadro` si `conservar_jpeg` es
+    True; si no, `Cuadro.jpeg` es None y la descarga reutiliza su buffer. Con
+    un `FiltroDuplicados` un JPEG idéntico al anterior se descarta antes de
+    decodificarlo y el detector no recibe cuadro nuevo; con capturas sueltas
+    el siguiente pedido se demora con `EsperaDuplicados`. Con un
+    `ControladorCalidad` cada JPEG nuevo le informa su tiempo de llegada y su
+    tamaño. Los `receptores` (el grabador de clips y el archivo) reciben con
+    `agregar(camara, marca_tiempo, jpeg)` cada JPEG nuevo desde este hilo, al
+    ritmo de la cámara, aunque el detector no llegue a procesarlo.
+    """
+
+    def __init__(self, url, modo=MODO_CAPTURA, camara=ID_CAMARA, conservar_jpeg=False, duplicados=None,
+                 controlador=None, receptores=()):
+        self.url = url
+        self.modo = modo
+        self.camara = camara
+        self.receptores = list(receptores)
+        # Los receptores guardan el JPEG, así que necesitan una copia propia
+        self.conservar_jpeg = conservar_jpeg or bool(self.receptores)
+        self.duplicados = duplicados
+        self.controlador = controlador
+        self._descargador = DescargadorJPEG(url)
+        self._espera = EsperaDuplicados()
+        self.capturados = 0
+        self.descartados = 0
+        self._cuadro = None
+        self._activo = False
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._lector = None
+
+    def iniciar(self):
+        """Arranca el hilo de captura."""
+        self._activo = True
+        self._hilo = threading.Thread(target=self._bucle, name='captura', daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        """Detiene el hilo de captura y despierta a quien esté esperando."""
+        with self._condicion:
+            self._activo = False
+            self._condicion.notify_all()
+        if self._hilo is not None:
+            self._hilo.join(timeout=2)
+        if self._lector is not None:
+            self._lector.cerrar()
+
+    def _leer_jpeg(self):
+        """Obtiene los bytes JPEG del siguiente cuadro según el modo de captura."""
+        if self.modo != 'mjpeg':
+            return self._descargador.descargar()
+        if self._lector is None:
+            self._lector = LectorMJPEG(self.url).conectar()
+        return self._lector.leer_jpeg()
+
+    def _capturar(self):
+        """Obtiene y decodifica un cuadro; devuelve (imagen, jpeg, escala) o (None, None, 1).
+
+        Si el JPEG repite el anterior devuelve None sin decodificarlo.
+        """
+        try:
+            inicio = time.perf_counter()
+            with REGISTRO.medir('descarga', camara=self.camara):
+                jpeg = self._leer_jpeg()
+            if self.duplicados is not None and self.duplicados.repetido(self.camara, jpeg):
+                return None
+            if self.controlador is not None:
+                # Con stream cuenta solo la transferencia del JPEG, no la espera entre cuadros
+                segundos = self._lector.transferencia if self.modo == 'mjpeg' else time.perf_counter() - inicio
+                self.controlador.medir_descarga(segundos, len(jpeg))
+            with REGISTRO.medir('decodificacion', camara=self.camara):
+                imagen, escala = decodificar_cuadro(jpeg)
+            if not self.conservar_jpeg:
+                return imagen, None, escala
+            # Las vistas del stream MJPEG no se reutilizan; las del descargador sí
+            return imagen, jpeg if self.modo == 'mjpeg' else bytes(jpeg), escala
+        except Exception as e:
+            REGISTRO.incrementar('errores_captura', camara=self.camara)
+            logging.error("Error al capturar imagen: %s", e, extra={'clave': ('error_captura', self.camara)})
+            if self._lector is not None:
+                self._lector.cerrar()
+                self._lector = None
+            return None, None, 1
+
+    def _bucle(self):
+        """Captura cuadros y reemplaza el anterior si no fue consumido."""
+        while self._activo:
+            capturado = self._capturar()
+            if capturado is None:
+                # El stream ya marca el ritmo; sondeando, la cámara todavía no tiene cuadro nuevo
+                if self.modo != 'mjpeg':
+                    time.sleep(self._espera.siguiente())
+                continue
+            imagen, jpeg, escala = capturado
+            if imagen is None:
+                time.sleep(ESPERA_REINTENTO)
+                continue
+            self._espera.reiniciar()
+            marca_tiempo = time.time()
+            for receptor in self.receptores:
+                receptor.agregar(self.camara, marca_tiempo, jpeg)
+            with self._condicion:
+                if self._cuadro is not None:
+                    self.descartados += 1
+                self.capturados += 1
+                self._cuadro = Cuadro(imagen, jpeg, marca_tiempo, self.capturados, self.camara, escala)
+                self._condicion.notify()
+
+    def obtener(self, timeout=1.0):
+        """Espera un cuadro nuevo y lo devuelve como `Cuadro`, o None si no llegó."""
+        with self._condicion:
+            self._condicion.wait_for(lambda: self._cuadro is not None or not self._activo, timeout)
+            cuadro, self._cuadro = self._cuadro, None
+            return cuadro
+
+    def obtener_lote(self, maximo, timeout=1.0):
+        """Con una sola cámara el lote tiene a lo sumo el cuadro más reciente."""
+        cuadro = self.obtener(timeout)
+        return [cuadro] if cuadro is not None else []
+
+    def pendientes(self):
+        """1 si hay un cuadro esperando al detector."""
+        return int(self._cuadro is not None)
+
+    def estadisticas(self):
+        """Cuadros capturados y descartados."""
+        return {self.camara: {'capturados': self.capturados, 'descartados': self.descartados}}
+
+    def registrar_metricas(self):
+        """Expone los contadores de captura en el registro de métricas."""
+        REGISTRO.registrar_medidor('cuadros_capturados_total', lambda: self.capturados,
+                                   'Cuadros recibidos de la cámara', 'counter')
+        REGISTRO.registrar_medidor('cuadros_descartados_total', lambda: self.descartados,
+                                   'Cuadros reemplazados antes de llegar al detector', 'counter')
+
+# Control adaptativo de resolución y calidad de la cámara
+
+PIXELES_CAMARA = {'QVGA': 320 * 240, 'CIF': 400 * 296, 'VGA': 640 * 480, 'SVGA': 800 * 600,
+                  'XGA': 1024 * 768, 'HD': 1280 * 720, 'SXGA': 1280 * 1024, 'UXGA': 1600 * 1200}
+
+class ControladorCalidad:
+    """Lleva a la ESP32-CAM al mayor escalón de framesize/quality que la red y el detector aguantan.
+
+    El capturador informa cuánto tardó en llegar cada JPEG y cuánto pesa; el
+    bucle principal informa los cuadros procesados y llama a `revisar`. Cada
+    `intervalo` segundos se baja un escalón si la descarga supera
+    `latencia_maxima` o, con stream, si la transferencia ocupa más de
+    `ocupacion_maxima` del tiempo, o si los bytes recibidos superan
+    `ancho_banda_maximo` por segundo (cuadros grandes que saturan la WiFi aunque
+    lleguen a tiempo). Se sube uno si el escalón siguiente, estimado por la
+    proporción de píxeles, sigue con holgura en las tres medidas y el detector
+    alcanza a procesar los cuadros que llegan. Después de una bajada se espera
+    `espera_subida` antes de volver a subir, así no oscila en el límite. Las
+    peticiones a la cámara van en un hilo aparte para no frenar el bucle.
+    `reloj` da los segundos monótonos que miden los intervalos.
+    """
+
+    def __init__(self, url, escalones=ESCALONES_CAMARA, continuo=False, latencia_maxima=LATENCIA_MAXIMA_CAMARA,
+                 ocupacion_maxima=OCUPACION_MAXIMA_CAMARA, ancho_banda_maximo=ANCHO_BANDA_MAXIMO_CAMARA,
+                 intervalo=INTERVALO_CONTROL_CAMARA, espera_subida=ESPERA_SUBIDA_CAMARA, reloj=time.monotonic):
+        self.url = url
+        self.reloj = reloj
+        self.escalones = escalones
+        self.continuo = continuo
+        self.latencia_maxima = latencia_maxima
+        self.ocupacion_maxima = ocupacion_maxima
+        self.ancho_banda_maximo = ancho_banda_maximo
+        self.ancho_banda = 0.0  # Bytes por segundo del último intervalo
+        self.intervalo = intervalo
+        self.espera_subida = espera_subida
+        self.escalon = None  # Desconocido hasta consultar la cámara
+        self.cambios = 0
+        self._lock = threading.Lock()
+        self._ocupado = False
+        self._ultima_bajada = float('-inf')
+        self._reiniciar(self.reloj())
+
+    def _reiniciar(self, ahora):
+        """Empieza un intervalo de mediciones nuevo."""
+        self._inicio = ahora
+        self._descargas = 0
+        self._segundos = 0.0
+        self._bytes = 0
+        self._procesados = 0
+
+    def medir_descarga(self, segundos, tamano):
+        """Registra un JPEG nuevo: segundos que tardó en llegar y bytes; lo llama el hilo de captura."""
+        with self._lock:
+            self._descargas += 1
+            self._segundos += segundos
+            self._bytes += tamano
+
+    def medir_procesado(self, cantidad=1):
+        """Registra cuadros que terminaron de pasar por el detector."""
+        with self._lock:
+            self._procesados += cantidad
+
+    def _pedir(self, parametros=None):
+        """GET al control de la cámara; devuelve los ajustes vigentes."""
+        url = self.url + ('?' + urllib.parse.urlencode(parametros) if parametros else '')
+        with urllib.request.urlopen(url, timeout=TIMEOUT_CONTROL) as respuesta:
+            return json.loads(respuesta.read())
+
+    def _en_segundo_plano(self, funcion, *args):
+        """Corre una petición a la cámara sin bloquear a quien llama."""
+        self._ocupado = True
+        threading.Thread(target=funcion, args=args, name='control_camara', daemon=True).start()
+
+    def _consultar(self):
+        """Toma el escalón más parecido a los ajustes actuales de la cámara y lo aplica."""
+        try:
+            actual = self._pedir()
+            pixeles = PIXELES_CAMARA.get(actual.get('framesize'), 0)
+            escalon = min(range(len(self.escalones)),
+                          key=lambda i: (abs(PIXELES_CAMARA[self.escalones[i][0]] - pixeles),
+                                         abs(self.escalones[i][1] - actual.get('quality', 0))))
+        except Exception as e:
+            logging.error("No se pudo consultar el control de la cámara: %s", e,
+                          extra={'clave': ('control_camara', self.url)})
+            self._terminar()
+            return
+        self._aplicar(escalon)
+
+    def _aplicar(self, escalon):
+        """Pide a la cámara el escalón indicado."""
+        tamano, calidad = self.escalones[escalon]
+        try:
+            self._pedir({'framesize': tamano, 'quality': calidad})
+            if escalon != self.escalon:
+                logging.info(f"Cámara en {tamano} con calidad {calidad} (escalón {escalon}).")
+                if self.escalon is not None:
+                    self.cambios += 1
+            self.escalon = escalon
+        except Exception as e:
+            logging.error("No se pudo cambiar la calidad de la cámara: %s", e,
+                          extra={'clave': ('control_camara', self.url)})
+        self._terminar()
+
+    def _terminar(self):
+        """Descarta lo medido durante la petición: pudo ser con el tamaño anterior."""
+        with self._lock:
+            self._reiniciar(self.reloj())
+        self._ocupado = False
+
+    def revisar(self):
+        """Decide si hay que cambiar de escalón; lo llama el bucle principal."""
+        ahora = self.reloj()
+        if self._ocupado or ahora - self._inicio < self.intervalo:
+            return
+        if self.escalon is None:
+            self._en_segundo_plano(self._consultar)
+            return
+        with self._lock:
+            lapso = ahora - self._inicio
+            descargas, segundos, procesados = self._descargas, self._segundos, self._procesados
+            recibidos = self._bytes
+            self._reiniciar(ahora)
+        # Sin cuadros en todo el intervalo la descarga tardó al menos eso
+        latencia = segundos / descargas if descargas else lapso
+        ocupacion = segundos / lapso
+        self.ancho_banda = recibidos / lapso
+        excedida = self.ancho_banda_maximo is not None and self.ancho_banda > self.ancho_banda_maximo
+        saturada = (latencia > self.latencia_maxima or excedida
+                    or (self.continuo and ocupacion > self.ocupacion_maxima))
+        if saturada:
+            if self.escalon > 0:
+                logging.info(f"Bajando la calidad de la cámara: descarga {latencia:.2f} s, ocupación {ocupacion:.0%}, "
+                             f"{self.ancho_banda / 1024:.0f} KiB/s.")
+                self._ultima_bajada = ahora
+                self._en_segundo_plano(self._aplicar, self.escalon - 1)
+            return
+        if self.escalon + 1 >= len(self.escalones) or ahora - self._ultima_bajada < self.espera_subida:
+            return
+        # El detector debe alcanzar a procesar lo que llega; si no, más resolución solo cuesta decodificación
+        if procesados < 0.8 * descargas:
+            return
+        crecimiento = (PIXELES_CAMARA[self.escalones[self.escalon + 1][0]]
+                       / PIXELES_CAMARA[self.escalones[self.escalon][0]])
+        holgada = latencia * crecimiento < 0.7 * self.latencia_maxima
+        if self.continuo:
+            holgada = holgada and ocupacion * crecimiento < 0.7 * self.ocupacion_maxima
+        if self.ancho_banda_maximo is not None:
+            holgada = holgada and self.ancho_banda * crecimiento < 0.7 * self.ancho_banda_maximo
+        if holgada:
+            self._en_segundo_plano(self._aplicar, self.escalon + 1)
+
+    def registrar_metricas(self):
+        """Expone el escalón actual y los cambios en el registro de métricas."""
+        REGISTRO.registrar_medidor('escalon_camara', lambda: -1 if self.escalon is None else self.escalon,
+                                   'Escalón de framesize/quality de la cámara (0 = el menor, -1 = desconocido)')
+        REGISTRO.registrar_medidor('cambios_calidad_camara_total', lambda: self.cambios,
+                                   'Cambios de escalón pedidos a la cámara', 'counter')
+        REGISTRO.registrar_medidor('ancho_banda_camara_bytes', lambda: self.ancho_banda,
+                                   'Bytes por segundo recibidos de la cámara en el último intervalo')
 
 # Guardar capturas en disco
 
+_secuencia_capturas = itertools.count()
+
+def nombre_captura(directorio):
+    """Ruta única para una captura: milisegundos más un contador, sin pisar cuadros del mismo segundo."""
+    return os.path.join(directorio, f"captura_{int(time.time() * 1000)}_{next(_secuencia_capturas)}.jpg")
+
 def guardar_captura(imagen, directorio):
     """Guarda la imagen capturada en el disco con un nombre único."""
     if not os.path.exists(directorio):
         os.makedirs(directorio)
-    nombre_archivo = os.path.join(directorio, f"captura_{int(time.time())}.jpg")
+    nombre_archivo = nombre_captura(directorio)
     cv2.imwrite(nombre_archivo, imagen)
-    logging.info(f"Imagen guardada en {nombre_archivo}")
-
-# Procesamiento de detección
-
-def procesar_deteccion(modelo, imagen, clases):
-    """Realiza detección en la imagen y muestra resultados en tiempo real."""
-    class_ids, confidences, boxes = modelo.detect(imagen, confThreshold=0.5)
-    for class_id, confidence, box in zip(class_ids.flatten(), confidences.flatten(), boxes):
-        etiqueta = clases[class_id - 1]
-        cv2.rectangle(imagen, box, color=(0, 255, 0), thickness=3)
-        cv2.putText(imagen, f"{etiqueta}: {confidence:.2f}", (box[0], box[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        logging.info(f"Detección: {etiqueta} con confianza {confidence:.2f}")
+    logging.info("Imagen guardada en %s", nombre_archivo, extra={'clave': ('guardado', directorio)})
+
+def guardar_jpeg(datos, directorio):
+    """Guarda los bytes JPEG originales de la cámara sin volver a codificarlos."""
+    nombre_archivo = nombre_captura(directorio)
+    with open(nombre_archivo, 'wb') as f:
+        f.write(datos)
+    logging.info("Imagen guardada en %s", nombre_archivo, extra={'clave': ('guardado', directorio)})
+
+# Guardado asíncrono de capturas
+
+class EscritorCapturas:
+    """Guarda capturas en disco desde hilos propios usando una cola acotada.
+
+    Con la política 'descartar_antigua' una cola llena descarta la captura más
+    vieja para no frenar la detección; con 'bloquear' quien guarda espera.
+    """
+
+    def __init__(self, directorio, hilos=ESCRITORES_CAPTURA, tamano_cola=TAMANO_COLA_CAPTURAS,
+                 politica=POLITICA_COLA_CAPTURAS):
+        if politica not in ('descartar_antigua', 'bloquear'):
+            raise ValueError(f"Política de cola desconocida: {politica}")
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.politica = politica
+        self.guardadas = 0
+        self.descartadas = 0
+        self._cola = queue.Queue(maxsize=tamano_cola)
+        self._hilos = [threading.Thread(target=self._bucle, name=f'escritor-{i}', daemon=True)
+                       for i in range(hilos)]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def guardar(self, imagen=None, jpeg=None):
+        """Encola una captura: bytes JPEG originales si se dan, si no la imagen."""
+        tarea = (imagen, jpeg)
+        if self.politica == 'bloquear':
+            self._cola.put(tarea)
+            return
+        while True:
+            try:
+                self._cola.put_nowait(tarea)
+                return
+            except queue.Full:
+                try:
+                    self._cola.get_nowait()
+                    self._cola.task_done()
+                    self.descartadas += 1
+                except queue.Empty:
+                    pass
+
+    def pendientes(self):
+        """Número de capturas que esperan ser escritas."""
+        return self._cola.qsize()
+
+    def cerrar(self):
+        """Espera a que se escriban las capturas pendientes y detiene los hilos."""
+        self._cola.join()
+        for _ in self._hilos:
+            self._cola.put((None, None))
+        for hilo in self._hilos:
+            hilo.join(timeout=2)
+
+    def _bucle(self):
+        """Escribe capturas de la cola hasta recibir la señal de fin."""
+        while True:
+            imagen, jpeg = self._cola.get()
+            try:
+                if imagen is None and jpeg is None:
+                    return
+                with REGISTRO.medir('guardado'):
+                    if jpeg is not None:
+                        guardar_jpeg(jpeg, self.directorio)
+                    else:
+                        guardar_captura(imagen, self.directorio)
+                self.guardadas += 1
+            except Exception as e:
+                logging.error(f"Error al guardar captura: {e}")
+            finally:
+                self._cola.task_done()
+
+# Compuerta de movimiento antes de la red neuronal
+
+class CompuertaMovimiento:
+    """Decide si vale la pena correr el detector comparando cuadros reducidos.
+
+    Cada cuadro se reduce a escala de grises y se compara contra el último
+    cuadro que sí pasó por el detector; si cambió menos de `umbral` (fracción
+    de píxeles) se reutilizan las detecciones anteriores.
+    """
+
+    def __init__(self, tamano=TAMANO_MOVIMIENTO, umbral_pixel=UMBRAL_PIXEL_MOVIMIENTO,
+                 umbral=UMBRAL_MOVIMIENTO, max_segundos=MAX_SEGUNDOS_SIN_DETECCION):
+        self.tamano = tamano
+        self.umbral_pixel = umbral_pixel
+        self.umbral = umbral
+        self.max_segundos = max_segundos
+        self.procesados = 0
+        self.omitidos = 0
+        self.ultimas = None
+        self._referencia = None
+        self._ultima_deteccion = 0.0
+
+    def _reducir(self, imagen):
+        """Devuelve la imagen en gris y a baja resolución como int16."""
+        pequena = cv2.resize(imagen, self.tamano, interpolation=cv2.INTER_AREA)
+        if pequena.ndim == 3:
+            pequena = cv2.cvtColor(pequena, cv2.COLOR_BGR2GRAY)
+        return pequena.astype(np.int16)
+
+    def cambio(self, reducida):
+        """Fracción de píxeles que cambiaron respecto a la referencia."""
+        if self._referencia is None or self._referencia.shape != reducida.shape:
+            return 1.0
+        diferencia = np.abs(reducida - self._referencia)
+        return np.count_nonzero(diferencia > self.umbral_pixel) / diferencia.size
+
+    def consultar(self, imagen):
+        """Devuelve las últimas detecciones si la escena no cambió, o None si hay que detectar."""
+        reducida = self._reducir(imagen)
+        vencida = time.time() - self._ultima_deteccion >= self.max_segundos
+        if self.ultimas is not None and not vencida and self.cambio(reducida) < self.umbral:
+            self.omitidos += 1
+            return self.ultimas
+        return None
+
+    def actualizar(self, imagen, detecciones):
+        """Guarda el resultado del detector para el cuadro que `consultar` dejó pasar."""
+        # Se reduce de nuevo: con trabajadores puede haber otros cuadros consultados en medio
+        self.ultimas = detecciones
+        self._referencia = self._reducir(imagen)
+        self._ultima_deteccion = time.time()
+        self.procesados += 1
+        return detecciones
+
+    def estadisticas(self):
+        """Cuadros procesados y omitidos por la compuerta."""
+        total = self.procesados + self.omitidos
+        return {
+            'procesados': self.procesados,
+            'omitidos': self.omitidos,
+            'fraccion_omitida': self.omitidos / total if total else 0.0,
+        }
+
+# Rastreo de cajas entre detecciones
+
+def calcular_iou(cajas_a, cajas_b):
+    """Matriz de IoU entre dos conjuntos de cajas (x, y, ancho, alto)."""
+    a = np.asarray(cajas_a, dtype=np.float32).reshape(-1, 1, 4)
+    b = np.asarray(cajas_b, dtype=np.float32).reshape(1, -1, 4)
+    x1 = np.maximum(a[..., 0], b[..., 0])
+    y1 = np.maximum(a[..., 1], b[..., 1])
+    x2 = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2])
+    y2 = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3])
+    interseccion = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - interseccion
+    return interseccion / np.maximum(union, 1e-6)
+
+class RastreadorIoU:
+    """Corre el detector cada `detectar_cada` cuadros y rastrea cajas en medio.
+
+    Las detecciones se asocian a pistas por IoU (misma clase), lo que mantiene
+    estables los identificadores. Entre detecciones cada caja se desplaza con la
+    velocidad estimada de su centro y su confianza decae por cuadro; si alguna
+    baja de `umbral_confianza` se adelanta la siguiente detección.
+    """
+
+    def __init__(self, detectar_cada=DETECTAR_CADA, umbral_iou=UMBRAL_IOU_RASTREO,
+                 decaimiento=DECAIMIENTO_RASTREO, umbral_confianza=UMBRAL_CONFIANZA_RASTREO,
+                 max_perdidas=MAX_PERDIDAS_RASTREO):
+        self.detectar_cada = detectar_cada
+        self.umbral_iou = umbral_iou
+        self.decaimiento = decaimiento
+        self.umbral_confianza = umbral_confianza
+        self.max_perdidas = max_perdidas
+        self.procesados = 0
+        self.omitidos = 0
+        self._siguiente_id = 1
+        self._pistas = []  # dicts con id, class_id, confianza, caja, velocidad, tiempo, perdidas
+        self._cuadros_sin_detectar = 0
+        self._tiempo_deteccion = 0.0
+
+    def _predecir(self, ahora):
+        """Cajas de las pistas desplazadas hasta el instante `ahora`."""
+        if not self._pistas:
+            return np.zeros((0, 4), dtype=np.float32)
+        cajas = np.array([p['caja'] for p in self._pistas], dtype=np.float32)
+        velocidades = np.array([p['velocidad'] for p in self._pistas], dtype=np.float32)
+        tiempos = np.array([ahora - p['tiempo'] for p in self._pistas], dtype=np.float32)
+        cajas[:, :2] += velocidades * tiempos[:, None]
+        return cajas
+
+    def _asociar(self, detecciones, ahora):
+        """Actualiza las pistas con detecciones nuevas usando emparejamiento voraz por IoU."""
+        predichas = self._predecir(ahora)
+        iou = calcular_iou(predichas, detecciones.boxes)
+        if iou.size:
+            misma_clase = np.array([p['class_id'] for p in self._pistas])[:, None] == detecciones.class_ids[None, :]
+            iou = np.where(misma_clase, iou, 0.0)
+        asignadas = set()
+        usadas = set()
+        for indice in np.argsort(iou, axis=None)[::-1]:
+            i, j = np.unravel_index(indice, iou.shape)
+            if iou[i, j] < self.umbral_iou:
+                break
+            if i in asignadas or j in usadas:
+                continue
+            asignadas.add(i)
+            usadas.add(j)
+            pista = self._pistas[i]
+            caja = detecciones.boxes[j].astype(np.float32)
+            intervalo = ahora - pista['tiempo']
+            if intervalo > 0:
+                centro_anterior = pista['caja'][:2] + pista['caja'][2:] / 2
+                centro = caja[:2] + caja[2:] / 2
+                pista['velocidad'] = 0.5 * pista['velocidad'] + 0.5 * (centro - centro_anterior) / intervalo
+            pista.update(caja=caja, confianza=float(detecciones.confidences[j]), tiempo=ahora, perdidas=0)
+
+        for i, pista in enumerate(self._pistas):
+            if i not in asignadas:
+                pista['perdidas'] += 1
+        self._pistas = [p for p in self._pistas if p['perdidas'] <= self.max_perdidas]
+
+        for j in range(len(detecciones.class_ids)):
+            if j not in usadas:
+                self._pistas.append({
+                    'id': self._siguiente_id,
+                    'class_id': int(detecciones.class_ids[j]),
+                    'confianza': float(detecciones.confidences[j]),
+                    'caja': detecciones.boxes[j].astype(np.float32),
+                    'velocidad': np.zeros(2, dtype=np.float32),
+                    'tiempo': ahora,
+                    'perdidas': 0,
+                })
+                self._siguiente_id += 1
+
+    def _resultado(self, ahora, cuadros):
+        """Detecciones visibles (pistas asociadas en la última detección) en `ahora`."""
+        visibles = [i for i, p in enumerate(self._pistas) if p['perdidas'] == 0]
+        cajas = self._predecir(ahora)[visibles] if visibles else np.zeros((0, 4), dtype=np.float32)
+        factor = self.decaimiento ** cuadros
+        return Detecciones(
+            np.array([self._pistas[i]['class_id'] for i in visibles], dtype=np.int32),
+            np.array([self._pistas[i]['confianza'] * factor for i in visibles], dtype=np.float32),
+            np.round(cajas).astype(np.int32),
+            np.array([self._pistas[i]['id'] for i in visibles], dtype=np.int32),
+        )
+
+    def consultar(self, imagen):
+        """Devuelve las cajas rastreadas, o None si toca correr el detector."""
+        ahora = time.time()
+        self._cuadros_sin_detectar += 1
+        if self.procesados and self._cuadros_sin_detectar < self.detectar_cada:
+            detecciones = self._resultado(ahora, self._cuadros_sin_detectar)
+            if len(detecciones.confidences) == 0 or detecciones.confidences.min() >= self.umbral_confianza:
+                self.omitidos += 1
+                return detecciones
+        self._tiempo_deteccion = ahora
+        return None
+
+    def actualizar(self, imagen, detecciones):
+        """Asocia el resultado del detector a las pistas y devuelve las detecciones con IDs."""
+        self._asociar(detecciones, self._tiempo_deteccion)
+        self._cuadros_sin_detectar = 0
+        self.procesados += 1
+        return self._resultado(self._tiempo_deteccion, 0)
+
+    def estadisticas(self):
+        """Cuadros con detección completa, cuadros rastreados y pistas activas."""
+        total = self.procesados + self.omitidos
+        return {
+            'procesados': self.procesados,
+            'omitidos': self.omitidos,
+            'fraccion_omitida': self.omitidos / total if total else 0.0,
+            'pistas': len(self._pistas),
+        }
+
+# Detección por lotes de cuadros
+
+def detectar_cuadros(modelo, cuadros, regiones=REGIONES_INTERES):
+    """Detecta en las regiones de varios cuadros con un solo lote."""
+    recortes, origenes, duenos = [], [], []
+    for indice, cuadro in enumerate(cuadros):
+        for recorte, origen in recortes_de_interes(cuadro.imagen, regiones, cuadro.escala):
+            recortes.append(recorte)
+            origenes.append(origen)
+            duenos.append(indice)
+    lote = detectar_lote(modelo, recortes, UMBRAL_DETECTOR)
+    resultados = []
+    for indice, cuadro in enumerate(cuadros):
+        propios = [j for j, dueno in enumerate(duenos) if dueno == indice]
+        resultados.append(a_cuadro_completo([lote[j] for j in propios], [origenes[j] for j in propios],
+                                            cuadro.escala))
+    return resultados
+
+class ControlLote:
+    """Ajusta el tamaño de lote a la cola bajo un techo de latencia.
+
+    Crece de a un cuadro mientras haya cuadros esperando y el último lote quedó
+    holgado bajo `latencia_maxima`; se reduce a la mitad si lo superó.
+    """
+
+    def __init__(self, maximo=LOTE_MAXIMO, latencia_maxima=LATENCIA_MAXIMA_LOTE):
+        self.maximo = maximo
+        self.latencia_maxima = latencia_maxima
+        self.tamano = 1
+
+    def registrar(self, procesados, duracion, pendientes):
+        """Actualiza el tamaño con la duración del último lote y la cola restante."""
+        if duracion > self.latencia_maxima:
+            self.tamano = max(1, self.tamano // 2)
+        elif pendientes > 0 and procesados >= self.tamano and duracion < 0.8 * self.latencia_maxima:
+            self.tamano = min(self.maximo, self.tamano + 1)
+        REGISTRO.observar('lote', duracion)
+
+def procesar_lote(modelo, cuadros, compuertas, tabla=None):
+    """Devuelve [(detecciones, nuevas)] por cuadro corriendo el detector una sola vez.
+
+    Primero cada compuerta decide si su cuadro necesita al detector; solo esos
+    cuadros forman el lote. Con una `TablaClases` las detecciones nuevas se
+    filtran por clase antes de llegar a la compuerta.
+    """
+    resultados = [None] * len(cuadros)
+    pendientes = []
+    for indice, cuadro in enumerate(cuadros):
+        compuerta = compuertas.get(cuadro.camara)
+        reutilizadas = compuerta.consultar(cuadro.imagen) if compuerta is not None else None
+        if reutilizadas is not None:
+            resultados[indice] = (reutilizadas, False)
+        else:
+            pendientes.append(indice)
+    if pendientes:
+        lote = detectar_cuadros(modelo, [cuadros[i] for i in pendientes])
+        for indice, detecciones in zip(pendientes, lote):
+            if tabla is not None:
+                detecciones = tabla.filtrar(detecciones)
+            compuerta = compuertas.get(cuadros[indice].camara)
+            if compuerta is not None:
+                detecciones = compuerta.actualizar(cuadros[indice].imagen, detecciones)
+            resultados[indice] = (detecciones, True)
+    REGISTRO.incrementar('cuadros_en_lote', len(pendientes))
+    return resultados
+
+def procesar_con_trabajadores(pool, cuadros, compuertas, tabla=None):
+    """Envía a los trabajadores los cuadros que necesitan detector y devuelve los listos.
+
+    Devuelve [(cuadro, detecciones, nuevas)] en el orden de llegada de los
+    cuadros, que puede incluir cuadros enviados en llamadas anteriores.
+    """
+    for cuadro in cuadros:
+        compuerta = compuertas.get(cuadro.camara)
+        reutilizadas = compuerta.consultar(cuadro.imagen) if compuerta is not None else None
+        if reutilizadas is not None:
+            pool.agregar_listo(cuadro, reutilizadas)
+        else:
+            pool.enviar(cuadro.imagen, cuadro, cuadro.escala)
+    listos = []
+    for cuadro, detecciones, nuevas in pool.resultados(bloquear=not cuadros and pool.en_vuelo() > 0):
+        compuerta = compuertas.get(cuadro.camara)
+        if nuevas and tabla is not None:
+            detecciones = tabla.filtrar(detecciones)
+        if nuevas and compuerta is not None:
+            detecciones = compuerta.actualizar(cuadro.imagen, detecciones)
+        listos.append((cuadro, detecciones, nuevas))
+    return listos
+
+def registrar_detecciones(detecciones, tabla, camara=ID_CAMARA):
+    """Escribe cada detección en el archivo de registro, como mucho una por clase y cámara por intervalo."""
+    for class_id, confidence in zip(tabla.indices(detecciones.class_ids).tolist(), detecciones.confidences.tolist()):
+        # Formato diferido: el texto solo se arma si el filtro deja pasar el mensaje
+        logging.info("Detección: %s con confianza %.2f", tabla.etiquetas[class_id], confidence,
+                     extra={'clave': ('deteccion', camara, class_id)})
+
+def dibujar_detecciones(imagen, detecciones, tabla, registrar=True, escala=1):
+    """Dibuja las detecciones sobre la imagen y opcionalmente las registra.
+
+    Las cajas vienen en coordenadas del cuadro completo; `escala` las lleva a
+    la imagen si se decodificó reducida. Etiquetas, colores y altos de texto
+    salen de la `TablaClases`; si la caja toca el borde superior la etiqueta
+    va por dentro.
+    """
+    if registrar:
+        registrar_detecciones(detecciones, tabla)
+    if len(detecciones.class_ids) == 0:
+        return imagen
+    cajas = detecciones.boxes if escala == 1 else np.round(detecciones.boxes / escala).astype(np.int32)
+    track_ids = detecciones.track_ids
+    if track_ids is None:
+        track_ids = [None] * len(detecciones.class_ids)
+    for class_id, confidence, (x, y, ancho, alto), track_id in zip(tabla.indices(detecciones.class_ids).tolist(),
+                                                                   detecciones.confidences.tolist(),
+                                                                   cajas.tolist(), track_ids):
+        color = tabla.colores[class_id]
+        etiqueta = tabla.etiquetas[class_id]
+        if track_id is not None:
+            etiqueta = f"{etiqueta} #{track_id}"
+        alto_texto = tabla.tamanos_texto[class_id][1]
+        y_texto = y - 10 if y - 10 >= alto_texto else y + alto_texto + 5
+        cv2.rectangle(imagen, (x, y, ancho, alto), color=color, thickness=3)
+        cv2.putText(imagen, f"{etiqueta}: {confidence:.2f}", (x, y_texto), tabla.FUENTE, tabla.ESCALA_FUENTE,
+                    color, tabla.GROSOR_FUENTE)
     return imagen
 
-# Función para calcular FPS
+# Registro de métricas del pipeline
+
+def registrar_metricas(capturador, escritor, compuertas):
+    """Expone colas y contadores de los componentes del pipeline en las métricas."""
+    capturador.registrar_metricas()
+    REGISTRO.registrar_medidor('cola_capturas', escritor.pendientes, 'Capturas pendientes de guardar')
+    REGISTRO.registrar_medidor('capturas_guardadas_total', lambda: escritor.guardadas,
+                               'Capturas escritas en disco', 'counter')
+    REGISTRO.registrar_medidor('capturas_descartadas_total', lambda: escritor.descartadas,
+                               'Capturas descartadas por cola llena', 'counter')
+    # Sin compuerta configurada cada cámara guarda None: ningún cuadro reutiliza detecciones
+    REGISTRO.registrar_medidor('detector_ejecutado_total',
+                               lambda: {(('camara', c),): g.procesados if g is not None else 0
+                                       for c, g in list(compuertas.items())},
+                               'Cuadros que pasaron por la red neuronal', 'counter')
+    REGISTRO.registrar_medidor('detector_omitido_total',
+                               lambda: {(('camara', c),): g.omitidos if g is not None else 0
+                                       for c, g in list(compuertas.items())},
+                               'Cuadros que reutilizaron detecciones', 'counter')
+
+def crear_compuerta():
+    """Compuerta del detector según la configuración; cada cámara tiene la suya."""
+    if MODO_RASTREO:
+        return RastreadorIoU()
+    if COMPUERTA_MOVIMIENTO:
+        return CompuertaMovimiento()
+    return None
 
-def calcular_fps(tiempo_inicial, num_frames):
-    """Calcula los cuadros por segundo en función del tiempo y los frames procesados."""
-    tiempo_transcurrido = time.time() - tiempo_inicial
-    if tiempo_transcurrido > 0:
-        fps = num_frames / tiempo_transcurrido
-        logging.info(f"FPS: {fps:.2f}")
-        return fps
-    return 0
+# Atención de cada cuadro procesado
+
+def dispara_grabacion(detecciones, tabla, clases_grabacion=CLASES_GRABACION):
+    """True si alguna detección es de una clase que dispara clips."""
+    return bool(tabla.de_clases(clases_grabacion)[tabla.indices(detecciones.class_ids)].any())
+
+def atender_cuadro(cuadro, detecciones, nuevas, tabla, escritor, salida=None, grabador=None, archivador=None,
+                   historial=None, difusor=None, puente=None):
+    """Registra, emite, guarda y muestra el resultado de un cuadro."""
+    # Primero el puente MQTT: una orden de alto no debe esperar al resto del cuadro
+    if puente is not None:
+        puente.publicar_cuadro(cuadro.camara, cuadro.marca_tiempo, cuadro.id_cuadro, detecciones, tabla, nuevas)
+    if nuevas:
+        registrar_detecciones(detecciones, tabla, cuadro.camara)
+        if historial is not None:
+            historial.agregar(cuadro.camara, cuadro.marca_tiempo, detecciones)
+    if salida is not None:
+        salida.escribir(detecciones, cuadro.marca_tiempo, cuadro.id_cuadro, nuevas, cuadro.camara)
+    # Los cuadros de clips y archivo llegan desde la captura; acá solo se dispara y se anota
+    if grabador is not None and dispara_grabacion(detecciones, tabla):
+        grabador.disparar(cuadro.camara, cuadro.marca_tiempo)
+    if archivador is not None:
+        archivador.anotar(cuadro.camara, detecciones)
+
+    # Solo se dibuja si alguien va a ver el cuadro: la ventana, la captura guardada o un espectador
+    frame = cuadro.imagen
+    guardar_cuadro = MODO_GUARDADO == 'cuadros'
+    retransmitir = difusor is not None and difusor.espectadores(cuadro.camara) > 0
+    if not SIN_PANTALLA or (guardar_cuadro and not GUARDAR_JPEG_ORIGINAL) or retransmitir:
+        with REGISTRO.medir('anotacion'):
+            dibujar_detecciones(frame, detecciones, tabla, registrar=False, escala=cuadro.escala)
+    if retransmitir:
+        difusor.publicar(cuadro.camara, frame)
+    if guardar_cuadro and GUARDAR_JPEG_ORIGINAL:
+        escritor.guardar(jpeg=cuadro.jpeg)
+    elif guardar_cuadro and SIN_PANTALLA:
+        escritor.guardar(imagen=frame)
+    elif guardar_cuadro:
+        # Copia: el texto de FPS se dibuja después sobre el mismo cuadro
+        escritor.guardar(imagen=frame.copy())
+    REGISTRO.marcar_cuadro(camara=cuadro.camara)
+    REGISTRO.observar('antiguedad', time.time() - cuadro.marca_tiempo, camara=cuadro.camara)
+
+    if not SIN_PANTALLA:
+        fps = REGISTRO.fps(camara=cuadro.camara)
+        cv2.putText(frame, f"FPS: {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+        ventana = f"{WINDOW_NAME} - {cuadro.camara}" if CAMARAS else WINDOW_NAME
+        cv2.imshow(ventana, frame)
 
 # Flujo principal del programa
 if __name__ == "__main__":
-    clases = cargar_clases(CLASSES_FILE)
-    modelo = configurar_modelo(CONFIG_PATH, WEIGHTS_PATH)
-
-    cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_AUTOSIZE)
-    print("Iniciando detección en tiempo real...")
+    # Con la salida estructurada en stdout los mensajes de consola van a stderr
+    consola = sys.stderr if SALIDA_DETECCIONES == '-' else sys.stdout
+    inicio_programa = time.perf_counter()
+    # El registro se configura solo al correr como programa: importar este módulo no toca deteccion.log.
+    # La escritura al archivo ocurre en el hilo del QueueListener, no en el bucle de detección
+    configurar_registro(LOG_FILE, logging.INFO, BYTES_MAXIMOS_LOG, COPIAS_LOG, INTERVALO_LOG_REPETIDO)
+    print("Iniciando detección en tiempo real...", file=consola)
     logging.info("Inicio del programa de detección.")
 
-    tiempo_inicial = time.time()
-    num_frames = 0
+    # La cámara se conecta y el modelo se carga y calienta a la vez; la ventana
+    # se crea en el hilo principal mientras tanto
+    # Un JPEG repetido no se decodifica ni pasa por la red: siguen valiendo las detecciones del anterior
+    duplicados = FiltroDuplicados() if DESCARTAR_DUPLICADOS else None
+    controlador = None  # El control de calidad es para una sola cámara con esp32cam/boot.py
+    # Clips y archivo reciben los JPEG desde la captura, así que existen antes que el capturador
+    grabador = None
+    if MODO_GUARDADO == 'clips':
+        grabador = GrabadorClips(CAPTURE_DIR, SEGUNDOS_ANTES_CLIP, SEGUNDOS_DESPUES_CLIP, FORMATO_CLIP,
+                                 segundos_maximos=SEGUNDOS_MAXIMOS_CLIP)
+        grabador.registrar_metricas()
+    archivador = None
+    if ARCHIVO_CUADROS:
+        archivador = EscritorArchivo(ARCHIVO_CUADROS)
+        archivador.registrar_metricas()
+    receptores = [receptor for receptor in (grabador, archivador) if receptor is not None]
+    if CAMARAS:
+        capturador = CapturadorMulticamara(CAMARAS, decodificar_cuadro, POLITICA_CAMARAS, duplicados,
+                                           receptores).iniciar()
+    else:
+        url_captura = STREAM_URL if MODO_CAPTURA == 'mjpeg' else CAMERA_URL
+        if CONTROL_CAMARA:
+            controlador = ControladorCalidad(CONTROL_CAMARA, continuo=MODO_CAPTURA == 'mjpeg')
+            controlador.registrar_metricas()
+            if REGIONES_INTERES or REGION_PELIGRO:
+                logging.warning("Las regiones están en píxeles de un tamaño de cuadro fijo y el control de "
+                                "calidad cambia ese tamaño.")
+        capturador = CapturadorFrames(url_captura, MODO_CAPTURA, conservar_jpeg=GUARDAR_JPEG_ORIGINAL,
+                                      duplicados=duplicados, controlador=controlador,
+                                      receptores=receptores).iniciar()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='arranque') as ejecutor:
+        futuro_detector = ejecutor.submit(preparar_detector)
+        futuro_clases = ejecutor.submit(cargar_clases, CLASSES_FILE)
+        if not SIN_PANTALLA and not CAMARAS:
+            # Con varias cámaras cada una abre su propia ventana al mostrar su primer cuadro
+            cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_AUTOSIZE)
+        clases = futuro_clases.result()
+        tabla = TablaClases(clases)
+        modelo, pool = futuro_detector.result()
+    logging.info(f"Detector listo a {time.perf_counter() - inicio_programa:.2f} s del arranque.")
+    primera_deteccion = None
+
+    escritor = EscritorCapturas(CAPTURE_DIR)
+    historial = HistorialDetecciones(HISTORIAL_DETECCIONES) if HISTORIAL_DETECCIONES else None
+    puente = None
+    if MQTT_ACTIVO:
+        puente = PuenteMQTT(SERVIDOR_MQTT, PUERTO_MQTT, TOPICO_DETECCIONES, TOPICO_ALTO, CLASES_ALTO,
+                            REGION_PELIGRO, INTERVALO_ALTO)
+        puente.registrar_metricas()
+    difusor = None
+    if PUERTO_RETRANSMISION:
+        difusor = DifusorMJPEG(CALIDAD_RETRANSMISION)
+        ids_camaras = [c['id'] for c in CAMARAS] or [ID_CAMARA]
+        for id_camara in ids_camaras:
+            difusor.canal(id_camara)
+        difusor.registrar_metricas()
+        iniciar_servidor_mjpeg(difusor, PUERTO_RETRANSMISION, DIRECCION_RETRANSMISION, ids_camaras[0])
+        print(f"Retransmisión anotada en http://{DIRECCION_RETRANSMISION}:{PUERTO_RETRANSMISION}/<cámara>",
+              file=consola)
+    compuertas = {}  # Una compuerta por cámara: guardan estado entre cuadros
+    control_lote = ControlLote(LOTE_MAXIMO if INFERENCIA_POR_LOTES else 1)
+    REGISTRO.registrar_medidor('tamano_lote', lambda: control_lote.tamano, 'Cuadros por lote del detector')
+    if pool is not None:
+        pool.registrar_metricas()
+    salida = None
+    if SALIDA_DETECCIONES:
+        salida = SalidaDetecciones(SALIDA_DETECCIONES, FORMATO_DETECCIONES, ID_CAMARA, clases)
+    registrar_metricas(capturador, escritor, compuertas)
+    if PUERTO_METRICAS:
+        iniciar_servidor_metricas(PUERTO_METRICAS)
+        print(f"Métricas disponibles en http://127.0.0.1:{PUERTO_METRICAS}/metrics", file=consola)
+
+    try:
+        while True:
+            if pool is not None:
+                # Mientras haya cuadros en vuelo no se espera a la cámara más de lo necesario
+                espera = 0.005 if pool.en_vuelo() else 1.0
+                cuadros = capturador.obtener_lote(max(1, pool.libres()), espera)
+            else:
+                cuadros = capturador.obtener_lote(control_lote.tamano)
+            for cuadro in cuadros:
+                if cuadro.camara not in compuertas:
+                    compuertas[cuadro.camara] = crear_compuerta()
 
-    while True:
-        frame = capturar_imagen(CAMERA_URL)
-        if frame is not None:
-            frame = procesar_deteccion(modelo, frame, clases)
-            guardar_captura(frame, CAPTURE_DIR)
-            num_frames += 1
-            fps = calcular_fps(tiempo_inicial, num_frames)
-            cv2.putText(frame, f"FPS: {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-            cv2.imshow(WINDOW_NAME, frame)
+            if pool is not None:
+                listos = procesar_con_trabajadores(pool, cuadros, compuertas, tabla)
+            elif cuadros:
+                inicio = time.perf_counter()
+                with REGISTRO.medir('deteccion'):
+                    resultados = procesar_lote(modelo, cuadros, compuertas, tabla)
+                control_lote.registrar(len(cuadros), time.perf_counter() - inicio, capturador.pendientes())
+                listos = [(cuadro, detecciones, nuevas) for cuadro, (detecciones, nuevas) in zip(cuadros, resultados)]
+            else:
+                listos = []
+            for cuadro, detecciones, nuevas in listos:
+                atender_cuadro(cuadro, detecciones, nuevas, tabla, escritor, salida, grabador, archivador,
+                               historial, difusor, puente)
+            if controlador is not None:
+                controlador.medir_procesado(len(listos))
+                controlador.revisar()
+            if primera_deteccion is None and listos:
+                primera_deteccion = time.perf_counter() - inicio_programa
+                REGISTRO.registrar_medidor('segundos_hasta_primera_deteccion', lambda: round(primera_deteccion, 3),
+                                           'Segundos desde el arranque hasta el primer cuadro detectado')
+                logging.info(f"Primera detección a {primera_deteccion:.2f} s del arranque.")
+                print(f"Primera detección a {primera_deteccion:.2f} s del arranque.", file=consola)
 
-        # Salir al presionar la tecla ESC
-        if cv2.waitKey(1) & 0xFF == 27:
-            break
+            # Salir al presionar la tecla ESC (en modo sin pantalla, con Ctrl+C)
+            if not SIN_PANTALLA and cv2.waitKey(1) & 0xFF == 27:
+                break
+    except KeyboardInterrupt:
+        pass
 
-    cv2.destroyAllWindows()
+    capturador.detener()
+    if pool is not None:
+        pool.detener()
+    escritor.cerrar()
+    if grabador is not None:
+        grabador.cerrar()
+        logging.info(f"Clips grabados: {grabador.clips}, cuadros: {grabador.cuadros_escritos}, "
+                     f"descartados: {grabador.cuadros_descartados}")
+    if puente is not None:
+        puente.cerrar()
+        logging.info(f"Eventos MQTT publicados: {puente.publicados}, altos: {puente.altos}")
+    if historial is not None:
+        historial.cerrar()
+        logging.info(f"Detecciones en el historial: {historial.filas}")
+    if archivador is not None:
+        archivador.cerrar()
+        logging.info(f"Cuadros archivados: {archivador.cuadros} ({archivador.bytes_escritos} bytes), "
+                     f"descartados: {archivador.descartados}")
+    if salida is not None:
+        salida.cerrar()
+    if not SIN_PANTALLA:
+        cv2.destroyAllWindows()
+    logging.info(f"Cuadros por cámara: {capturador.estadisticas()}")
+    logging.info(f"Capturas guardadas: {escritor.guardadas}, descartadas: {escritor.descartadas}")
+    for camara, compuerta in compuertas.items():
+        if compuerta is not None:
+            logging.info(f"Detecciones omitidas en {camara}: {compuerta.estadisticas()}")
     logging.info("Programa finalizado.")
-    print("Programa finalizado.")
+    print("Programa finalizado.", file=consola)
@@ -0,0 +1,272 @@
+# Detector SSD MobileNet v3 y las piezas que comparten el proceso principal y
+# los trabajadores: cuadros y resultados, configuración del modelo, inferencia
+# por lotes, regiones de interés y mosaicos. Importarlo no tiene efectos (no
+# configura el registro ni abre archivos), así los procesos trabajadores y las
+# herramientas de línea de comandos pueden usarlo sin arrastrar clasificacion.py.
+# Los valores de abajo son la configuración del detector; clasificacion.py los
+# importa de acá en lugar de repetirlos.
+
+import logging
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from ajuste import BACKENDS_CPU
+from metricas import REGISTRO
+
+TAMANO_ENTRADA = (320, 320)  # Tamaño de entrada de la red (ancho, alto)
+ESCALA_ENTRADA = 1.0 / 127.5  # Normalización de píxeles que espera SSD MobileNet v3
+MEDIA_ENTRADA = (127.5, 127.5, 127.5)  # Media restada a cada canal
+UMBRAL_CONFIANZA = 0.5  # Confianza mínima para aceptar una detección
+LOTE_MAXIMO = 8  # Imágenes por forward como máximo
+NIVELES_MOSAICOS = [(1, 1), (2, 1), (2, 2), (3, 2), (3, 3)]  # (columnas, filas) de menos a más mosaicos
+SOLAPE_MOSAICOS = 0.2  # Fracción de cada mosaico que se solapa con el vecino
+UMBRAL_NMS_MOSAICOS = 0.5  # IoU a partir de la cual dos cajas de la misma clase se fusionan
+PRESUPUESTO_MOSAICOS = 0.2  # Segundos de detección por cuadro que se permiten en modo mosaicos
+
+# Cuadro capturado: imagen decodificada, bytes JPEG originales, hora de captura,
+# número de cuadro, cámara de origen y escala (píxeles del cuadro completo por
+# píxel de la imagen, mayor que 1 con decodificación reducida)
+Cuadro = namedtuple('Cuadro', ['imagen', 'jpeg', 'marca_tiempo', 'id_cuadro', 'camara', 'escala'],
+                    defaults=(None, 1))
+
+# Resultado del detector; track_ids solo existe en modo rastreo
+Detecciones = namedtuple('Detecciones', ['class_ids', 'confidences', 'boxes', 'track_ids'], defaults=(None,))
+
+# Configuración de la red neuronal
+
+def aplicar_ajuste(red, ajuste):
+    """Aplica backend, target e hilos de un ajuste a una red o modelo de OpenCV."""
+    if ajuste is None:
+        return
+    red.setPreferableBackend(BACKENDS_CPU.get(ajuste.get('backend'), cv2.dnn.DNN_BACKEND_OPENCV))
+    red.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+    if ajuste.get('hilos'):
+        cv2.setNumThreads(ajuste['hilos'])
+
+def configurar_modelo(config, weights, ajuste=None, tamano=TAMANO_ENTRADA):
+    """Configura el modelo de detección con parámetros predeterminados o con un ajuste medido."""
+    modelo = cv2.dnn_DetectionModel(weights, config)
+    tamano = tuple(ajuste['tamano']) if ajuste is not None else tamano
+    modelo.setInputSize(*tamano)
+    modelo.setInputScale(ESCALA_ENTRADA)
+    modelo.setInputMean(MEDIA_ENTRADA)
+    modelo.setInputSwapRB(True)
+    aplicar_ajuste(modelo, ajuste)
+    logging.info("Modelo de detección configurado correctamente.")
+    return modelo
+
+def calentar_modelo(modelo, tamano=(800, 600)):
+    """Corre un forward sobre un cuadro negro para que el primero real no pague la inicialización."""
+    with REGISTRO.medir('calentamiento'):
+        detectar(modelo, np.zeros((tamano[1], tamano[0], 3), dtype=np.uint8))
+
+def detectar(modelo, imagen, umbral=UMBRAL_CONFIANZA):
+    """Corre el detector y devuelve `Detecciones` con arreglos planos."""
+    class_ids, confidences, boxes = modelo.detect(imagen, confThreshold=umbral)
+    # Sin detecciones OpenCV devuelve tuplas vacías en lugar de arreglos
+    return Detecciones(np.asarray(class_ids, dtype=np.int32).reshape(-1),
+                       np.asarray(confidences, dtype=np.float32).reshape(-1),
+                       np.asarray(boxes, dtype=np.int32).reshape(-1, 4))
+
+# Inferencia por lotes
+
+class DetectorPorLotes:
+    """Red SSD que procesa varias imágenes en un solo forward.
+
+    Arma un blob con `cv2.dnn.blobFromImages` usando los mismos parámetros que
+    `configurar_modelo` y separa la salida de DetectionOutput por imagen (la
+    columna 0 es el índice dentro del lote). También ofrece `detect` para poder
+    usarse en lugar de `cv2.dnn_DetectionModel`.
+    """
+
+    def __init__(self, config, weights, tamano=TAMANO_ENTRADA, escala=ESCALA_ENTRADA, media=MEDIA_ENTRADA,
+                 swap_rb=True, ajuste=None, lote_maximo=LOTE_MAXIMO):
+        self.red = cv2.dnn.readNetFromTensorflow(weights, config)
+        aplicar_ajuste(self.red, ajuste)
+        self.tamano = tuple(ajuste['tamano']) if ajuste is not None else tamano
+        self.escala = escala
+        self.media = media
+        self.swap_rb = swap_rb
+        self.lote_maximo = lote_maximo
+        logging.info("Red para inferencia por lotes configurada correctamente.")
+
+    def _separar(self, salida, imagenes, umbral):
+        """Convierte las filas [lote, clase, confianza, x1, y1, x2, y2] en `Detecciones` por imagen."""
+        salida = salida.reshape(-1, 7)
+        salida = salida[salida[:, 2] >= umbral]
+        resultados = []
+        for indice, imagen in enumerate(imagenes):
+            filas = salida[salida[:, 0] == indice]
+            alto, ancho = imagen.shape[:2]
+            # Mismo redondeo y recorte que DetectionModel::detect
+            izquierda = np.clip((filas[:, 3] * ancho).astype(np.int32), 0, ancho - 1)
+            arriba = np.clip((filas[:, 4] * alto).astype(np.int32), 0, alto - 1)
+            anchos = np.clip((filas[:, 5] * ancho).astype(np.int32) - izquierda + 1, 1, ancho - izquierda)
+            altos = np.clip((filas[:, 6] * alto).astype(np.int32) - arriba + 1, 1, alto - arriba)
+            resultados.append(Detecciones(filas[:, 1].astype(np.int32), filas[:, 2].astype(np.float32),
+                                          np.stack([izquierda, arriba, anchos, altos], axis=1).astype(np.int32)))
+        return resultados
+
+    def _forward(self, imagenes):
+        """Un forward con todas las imágenes apiladas en el blob."""
+        blob = cv2.dnn.blobFromImages(imagenes, self.escala, self.tamano, self.media, self.swap_rb, crop=False)
+        self.red.setInput(blob)
+        return self.red.forward()
+
+    def detectar_lote(self, imagenes, umbral=UMBRAL_CONFIANZA):
+        """Devuelve una lista de `Detecciones`, una por imagen, con un solo forward."""
+        if len(imagenes) > 1 and self.lote_maximo > 1:
+            try:
+                return self._separar(self._forward(imagenes), imagenes, umbral)
+            except cv2.error as e:
+                # Algunos grafos exportados fijan el lote en 1: se sigue imagen por imagen
+                logging.error(f"La red no acepta lotes, se procesará de a una imagen: {e}")
+                self.lote_maximo = 1
+        return [self._separar(self._forward([imagen]), [imagen], umbral)[0] for imagen in imagenes]
+
+    def detect(self, imagen, confThreshold=UMBRAL_CONFIANZA):
+        """Compatible con `cv2.dnn_DetectionModel.detect`."""
+        detecciones = self.detectar_lote([imagen], confThreshold)[0]
+        return detecciones.class_ids, detecciones.confidences, detecciones.boxes
+
+def detectar_lote(modelo, imagenes, umbral=UMBRAL_CONFIANZA):
+    """Detecta en varias imágenes; un solo forward si el modelo admite lotes."""
+    if hasattr(modelo, 'detectar_lote'):
+        return modelo.detectar_lote(imagenes, umbral)
+    return [detectar(modelo, imagen, umbral) for imagen in imagenes]
+
+# Regiones de interés y coordenadas del cuadro completo
+
+def recortes_de_interes(imagen, regiones=(), escala=1):
+    """Devuelve [(recorte, (x0, y0))] de las regiones, en píxeles de `imagen`.
+
+    Las regiones están en píxeles del cuadro completo; `escala` las lleva a la
+    imagen decodificada. Los recortes son vistas, no copias. Sin regiones se
+    devuelve la imagen entera.
+    """
+    if not regiones:
+        return [(imagen, (0, 0))]
+    alto, ancho = imagen.shape[:2]
+    recortes = []
+    for x, y, w, h in regiones:
+        x0, y0 = max(0, int(x / escala)), max(0, int(y / escala))
+        x1, y1 = min(ancho, int((x + w) / escala)), min(alto, int((y + h) / escala))
+        if x1 > x0 and y1 > y0:
+            recortes.append((imagen[y0:y1, x0:x1], (x0, y0)))
+    return recortes
+
+def a_cuadro_completo(detecciones_por_recorte, origenes, escala=1):
+    """Une las detecciones de varios recortes en coordenadas del cuadro completo."""
+    if len(detecciones_por_recorte) == 1 and origenes[0] == (0, 0) and escala == 1:
+        return detecciones_por_recorte[0]
+    cajas = [d.boxes.astype(np.float32) + np.array([x0, y0, 0, 0], dtype=np.float32)
+             for d, (x0, y0) in zip(detecciones_por_recorte, origenes)]
+    cajas = np.concatenate(cajas) if cajas else np.zeros((0, 4), dtype=np.float32)
+    return Detecciones(
+        np.concatenate([d.class_ids for d in detecciones_por_recorte] or [np.zeros(0, np.int32)]).astype(np.int32),
+        np.concatenate([d.confidences for d in detecciones_por_recorte] or [np.zeros(0, np.float32)]).astype(np.float32),
+        np.round(cajas * escala).astype(np.int32).reshape(-1, 4))
+
+def detectar_en_regiones(modelo, imagen, regiones=(), escala=1, umbral=UMBRAL_CONFIANZA):
+    """Detecta solo en las regiones de interés y devuelve cajas del cuadro completo."""
+    recortes = recortes_de_interes(imagen, regiones, escala)
+    lote = detectar_lote(modelo, [recorte for recorte, _ in recortes], umbral)
+    return a_cuadro_completo(lote, [origen for _, origen in recortes], escala)
+
+# Detección en mosaicos para objetos pequeños
+
+def cuadricula_mosaicos(ancho, alto, columnas, filas, solape=SOLAPE_MOSAICOS):
+    """Rectángulos (x0, y0, x1, y1) de una cuadrícula de mosaicos que se solapan."""
+    ancho_mosaico = ancho / (columnas - (columnas - 1) * solape)
+    alto_mosaico = alto / (filas - (filas - 1) * solape)
+    mosaicos = []
+    for fila in range(filas):
+        for columna in range(columnas):
+            x0 = int(round(columna * ancho_mosaico * (1 - solape)))
+            y0 = int(round(fila * alto_mosaico * (1 - solape)))
+            mosaicos.append((x0, y0, min(ancho, int(round(x0 + ancho_mosaico))),
+                             min(alto, int(round(y0 + alto_mosaico)))))
+    return mosaicos
+
+def suprimir_no_maximos(detecciones, umbral_iou=UMBRAL_NMS_MOSAICOS):
+    """NMS por clase sobre `Detecciones` (las cajas de clases distintas no compiten)."""
+    if len(detecciones.class_ids) < 2:
+        return detecciones
+    cajas = detecciones.boxes.astype(np.float32)
+    # Se desplaza cada clase a una zona propia para hacer un solo NMSBoxes
+    desplazamiento = (cajas[:, :2] + cajas[:, 2:]).max() + 1
+    cajas[:, :2] += (detecciones.class_ids.astype(np.float32) * desplazamiento)[:, None]
+    indices = np.asarray(cv2.dnn.NMSBoxes(cajas.tolist(), detecciones.confidences.tolist(), 0.0, umbral_iou),
+                         dtype=np.int64).reshape(-1)
+    indices.sort()
+    return Detecciones(detecciones.class_ids[indices], detecciones.confidences[indices],
+                       detecciones.boxes[indices])
+
+class DetectorMosaicos:
+    """Envuelve un modelo para detectar en el cuadro entero y en mosaicos solapados.
+
+    Al reducir el cuadro SVGA a la entrada de la red los objetos lejanos quedan
+    en pocos píxeles; cada mosaico se reduce mucho menos. El cuadro completo y
+    sus mosaicos van en un solo lote, las cajas vuelven a coordenadas del
+    cuadro y se fusionan con NMS entre mosaicos. El nivel de la cuadrícula baja
+    cuando la detección de un cuadro supera `presupuesto` segundos y sube
+    cuando sobra holgura.
+    """
+
+    def __init__(self, modelo, niveles=NIVELES_MOSAICOS, solape=SOLAPE_MOSAICOS,
+                 umbral_nms=UMBRAL_NMS_MOSAICOS, presupuesto=PRESUPUESTO_MOSAICOS):
+        self.modelo = modelo
+        self.niveles = list(niveles)
+        self.solape = solape
+        self.umbral_nms = umbral_nms
+        self.presupuesto = presupuesto
+        self.nivel = len(self.niveles) - 1
+
+    def _mosaicos(self, imagen):
+        """Cuadro completo más los mosaicos del nivel actual, como [(recorte, origen)]."""
+        alto, ancho = imagen.shape[:2]
+        columnas, filas = self.niveles[self.nivel]
+        recortes = [(imagen, (0, 0))]
+        if columnas * filas > 1:
+            recortes += [(imagen[y0:y1, x0:x1], (x0, y0))
+                         for x0, y0, x1, y1 in cuadricula_mosaicos(ancho, alto, columnas, filas, self.solape)]
+        return recortes
+
+    def _ajustar(self, duracion, imagenes):
+        """Sube o baja el nivel según el tiempo por cuadro del último lote."""
+        por_cuadro = duracion / max(1, imagenes)
+        if por_cuadro > self.presupuesto and self.nivel > 0:
+            self.nivel -= 1
+        elif por_cuadro < 0.5 * self.presupuesto and self.nivel < len(self.niveles) - 1:
+            self.nivel += 1
+        REGISTRO.observar('mosaicos', por_cuadro)
+
+    def detectar_lote(self, imagenes, umbral=UMBRAL_CONFIANZA):
+        """Detecta en los mosaicos de todas las imágenes con un solo lote."""
+        inicio = time.perf_counter()
+        por_imagen = [self._mosaicos(imagen) for imagen in imagenes]
+        recortes = [recorte for mosaicos in por_imagen for recorte, _ in mosaicos]
+        if hasattr(self.modelo, 'detectar_lote'):
+            lote = self.modelo.detectar_lote(recortes, umbral)
+        else:
+            lote = [detectar(self.modelo, recorte, umbral) for recorte in recortes]
+        resultados = []
+        for mosaicos in por_imagen:
+            propias, lote = lote[:len(mosaicos)], lote[len(mosaicos):]
+            unidas = a_cuadro_completo(propias, [origen for _, origen in mosaicos])
+            resultados.append(suprimir_no_maximos(unidas, self.umbral_nms))
+        self._ajustar(time.perf_counter() - inicio, len(imagenes))
+        return resultados
+
+    def detect(self, imagen, confThreshold=UMBRAL_CONFIANZA):
+        """Compatible con `cv2.dnn_DetectionModel.detect`."""
+        detecciones = self.detectar_lote([imagen], confThreshold)[0]
+        return detecciones.class_ids, detecciones.confidences, detecciones.boxes
+
+    def mosaicos(self):
+        """Mosaicos por cuadro en el nivel actual, sin contar el cuadro completo."""
+        columnas, filas = self.niveles[self.nivel]
+        return columnas * filas
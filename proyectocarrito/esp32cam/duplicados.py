@@ -0,0 +1,65 @@
+# Detección de cuadros repetidos antes de decodificar.
+# Cuando la ESP32-CAM es más lenta que el sondeo, cam-hi.jpg devuelve el mismo
+# JPEG dos veces. Se calcula una huella de los bytes crudos (largo más BLAKE2b)
+# y un cuadro idéntico al anterior de la misma cámara se descarta sin
+# decodificarlo ni pasarlo por la red: las detecciones del cuadro anterior
+# siguen siendo las vigentes. Al sondear capturas sueltas, cada repetición
+# seguida duplica la espera antes del próximo pedido, para no martillar a la
+# cámara con peticiones que solo devuelven el mismo cuadro.
+
+import hashlib
+import threading
+
+from metricas import REGISTRO
+
+BYTES_HUELLA = 16  # Tamaño del resumen BLAKE2b
+ESPERA_DUPLICADO_MINIMA = 0.02  # Segundos de espera tras el primer cuadro repetido
+ESPERA_DUPLICADO_MAXIMA = 0.25  # Tope de la espera entre sondeos con cuadros repetidos
+
+def huella_jpeg(datos):
+    """Huella de los bytes JPEG: (largo, resumen BLAKE2b)."""
+    return len(datos), hashlib.blake2b(datos, digest_size=BYTES_HUELLA).digest()
+
+class FiltroDuplicados:
+    """Recuerda la huella del último JPEG de cada cámara y reconoce repeticiones exactas."""
+
+    def __init__(self):
+        self.unicos = 0
+        self.duplicados = 0
+        self._ultimas = {}
+        self._lock = threading.Lock()
+
+    def repetido(self, camara, datos):
+        """True si `datos` es idéntico al último JPEG de la cámara; cuenta el cuadro en las métricas."""
+        huella = huella_jpeg(datos)
+        with self._lock:
+            repetido = self._ultimas.get(camara) == huella
+            self._ultimas[camara] = huella
+            if repetido:
+                self.duplicados += 1
+            else:
+                self.unicos += 1
+        REGISTRO.marcar_cuadro('cuadros_duplicados' if repetido else 'cuadros_unicos', camara=camara)
+        return repetido
+
+class EsperaDuplicados:
+    """Espera creciente entre sondeos mientras la cámara devuelve el mismo JPEG.
+
+    `siguiente` da la espera a aplicar tras un repetido y la duplica hasta
+    `maxima`; `reiniciar` vuelve a `minima` cuando llega un cuadro nuevo.
+    """
+
+    def __init__(self, minima=ESPERA_DUPLICADO_MINIMA, maxima=ESPERA_DUPLICADO_MAXIMA):
+        self.minima = minima
+        self.maxima = maxima
+        self._actual = minima
+
+    def siguiente(self):
+        """Segundos a esperar antes del próximo sondeo."""
+        espera = self._actual
+        self._actual = min(self._actual * 2, self.maxima)
+        return espera
+
+    def reiniciar(self):
+        """Llegó un cuadro nuevo: el próximo repetido vuelve a esperar lo mínimo."""
+        self._actual = self.minima
@@ -0,0 +1,210 @@
+# Grabación de clips disparada por detecciones.
+# Cada cámara conserva en memoria los JPEG de sus últimos segundos, al ritmo de
+# la cámara y no del detector; cuando aparece una clase configurada se escribe
+# un clip con esos segundos previos y se sigue grabando hasta unos segundos
+# después de la última detección. Así el
+# disco solo recibe los cuadros de los incidentes y no se pierde lo que pasó
+# justo antes. Un clip largo se parte en segmentos de duración máxima para que
+# una presencia continua no deje un archivo abierto para siempre.
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from metricas import REGISTRO
+
+FPS_AVI = 10  # Cuadros por segundo de un clip AVI cuando el anillo no alcanza para medirlos
+TAMANO_COLA_CLIPS = 256  # Cuadros pendientes de escribir como máximo; los que sobran se descartan
+
+def fps_de_cuadros(cuadros, predeterminado=FPS_AVI):
+    """Cuadros por segundo de [(marca_tiempo, jpeg)] según sus horas, o `predeterminado` si no se puede medir."""
+    if len(cuadros) < 2 or cuadros[-1][0] <= cuadros[0][0]:
+        return predeterminado
+    return (len(cuadros) - 1) / (cuadros[-1][0] - cuadros[0][0])
+
+class GrabadorClips:
+    """Anillo de JPEG recientes por cámara y escritura de clips en un hilo propio.
+
+    El hilo de captura llama a `agregar` con cada JPEG que llega de la cámara;
+    el bucle de detección llama a `disparar` cuando aparece una clase que
+    graba. Si la cámara no estaba grabando se abre un clip con los cuadros del
+    anillo; si ya grababa, el clip se extiende. El clip se cierra cuando pasan
+    `segundos_despues` sin otro disparo, o se parte en un segmento nuevo al
+    llegar a `segundos_maximos`. Los AVI declaran los cuadros por segundo
+    medidos en el anillo al abrir el clip, así duran lo mismo que lo grabado;
+    `fps_avi` se usa si el anillo tiene un solo cuadro. Si el escritor se
+    atrasa (por ejemplo recodificando AVI) la cola se llena y los cuadros que
+    no entran se descartan y se cuentan; abrir y cerrar clips nunca se pierde.
+    Con formato 'mjpeg' los JPEG de la cámara se concatenan sin recodificar (se
+    reproduce con ffplay/VLC); con 'avi' se escriben con cv2.VideoWriter MJPG.
+    """
+
+    def __init__(self, directorio, segundos_antes=5.0, segundos_despues=10.0, formato='mjpeg', fps_avi=FPS_AVI,
+                 segundos_maximos=300.0, tamano_cola=TAMANO_COLA_CLIPS):
+        if formato not in ('mjpeg', 'avi'):
+            raise ValueError(f"Formato de clip desconocido: {formato}")
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.segundos_antes = segundos_antes
+        self.segundos_despues = segundos_despues
+        self.formato = formato
+        self.fps_avi = fps_avi
+        self.segundos_maximos = segundos_maximos
+        self.clips = 0
+        self.cuadros_escritos = 0
+        self.cuadros_descartados = 0
+        self._anillos = {}  # camara -> deque[(marca_tiempo, jpeg)]
+        self._fines = {}  # camara -> marca de tiempo en que se cierra el clip abierto
+        self._inicios = {}  # camara -> marca de tiempo del primer cuadro del segmento abierto
+        self._abiertos = {}  # camara -> [archivo o VideoWriter, tamaño, ruta, fps]; solo lo usa el hilo escritor
+        # Captura y detección corren en hilos distintos y comparten anillos y clips abiertos
+        self._lock = threading.Lock()
+        # Acotada: el anillo limita la memoria de los cuadros previos, la cola la de los pendientes
+        self._cola = queue.Queue(maxsize=tamano_cola)
+        self._hilo = threading.Thread(target=self._bucle, name='grabador-clips', daemon=True)
+        self._hilo.start()
+
+    def agregar(self, camara, marca_tiempo, jpeg):
+        """Guarda el cuadro en el anillo y lo pasa al clip abierto de la cámara, o lo cierra si venció."""
+        if jpeg is None:
+            return
+        with self._lock:
+            anillo = self._anillos.get(camara)
+            if anillo is None:
+                anillo = self._anillos[camara] = deque()
+            anillo.append((marca_tiempo, jpeg))
+            while anillo and anillo[0][0] < marca_tiempo - self.segundos_antes:
+                anillo.popleft()
+
+            fin = self._fines.get(camara)
+            if fin is None:
+                return
+            if marca_tiempo > fin:
+                self._cola.put(('cerrar', camara, None))
+                del self._fines[camara]
+                del self._inicios[camara]
+            elif marca_tiempo - self._inicios[camara] >= self.segundos_maximos:
+                # Segmento nuevo: el clip sigue, pero en otro archivo
+                self._cola.put(('cerrar', camara, None))
+                self._cola.put(('abrir', camara, [(marca_tiempo, jpeg)]))
+                self._inicios[camara] = marca_tiempo
+            else:
+                self._encolar_cuadro(camara, marca_tiempo, jpeg)
+
+    def disparar(self, camara, marca_tiempo):
+        """Abre un clip con los cuadros del anillo, o extiende el abierto, por una detección en `marca_tiempo`."""
+        with self._lock:
+            if camara in self._fines:
+                self._fines[camara] = max(self._fines[camara], marca_tiempo + self.segundos_despues)
+                return
+            anillo = self._anillos.get(camara)
+            if not anillo:
+                return
+            previos = list(anillo)
+            self._cola.put(('abrir', camara, previos))
+            self._fines[camara] = marca_tiempo + self.segundos_despues
+            self._inicios[camara] = previos[0][0]
+
+    def _encolar_cuadro(self, camara, marca_tiempo, jpeg):
+        """Pasa un cuadro al escritor sin esperar; si la cola está llena lo descarta."""
+        try:
+            self._cola.put_nowait(('cuadro', camara, [(marca_tiempo, jpeg)]))
+        except queue.Full:
+            self.cuadros_descartados += 1
+
+    def grabando(self):
+        """Cámaras con un clip abierto."""
+        return len(self._fines)
+
+    def cerrar(self):
+        """Cierra los clips abiertos y detiene el hilo escritor."""
+        with self._lock:
+            for camara in list(self._fines):
+                self._cola.put(('cerrar', camara, None))
+            self._fines.clear()
+            self._inicios.clear()
+        self._cola.put(None)
+        self._hilo.join(timeout=5)
+
+    def _ruta(self, camara, marca_tiempo):
+        """Nombre del clip: cámara y hora de su primer cuadro, con milisegundos."""
+        hora = time.strftime('%Y%m%d_%H%M%S', time.localtime(marca_tiempo))
+        extension = 'avi' if self.formato == 'avi' else 'mjpg'
+        return os.path.join(self.directorio, f"clip_{camara}_{hora}_{int(marca_tiempo * 1000) % 1000:03d}.{extension}")
+
+    def _abrir(self, camara, cuadros):
+        """Crea el archivo del clip y escribe los cuadros previos al disparo."""
+        ruta = self._ruta(camara, cuadros[0][0])
+        if self.formato == 'avi':
+            # El VideoWriter se crea con el primer cuadro
+            self._abiertos[camara] = [None, None, ruta, fps_de_cuadros(cuadros, self.fps_avi)]
+        else:
+            self._abiertos[camara] = [open(ruta, 'wb'), None, ruta, None]
+        self.clips += 1
+        REGISTRO.incrementar('clips', camara=camara)
+        logging.info(f"Grabando clip {ruta} con {len(cuadros)} cuadros previos")
+        self._escribir(camara, cuadros)
+
+    def _escribir(self, camara, cuadros):
+        """Agrega cuadros al clip abierto de la cámara."""
+        abierto = self._abiertos.get(camara)
+        if abierto is None:
+            return
+        for _, jpeg in cuadros:
+            if self.formato == 'mjpeg':
+                abierto[0].write(jpeg)
+            else:
+                imagen = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if imagen is None:
+                    continue
+                if abierto[0] is None:
+                    abierto[1] = (imagen.shape[1], imagen.shape[0])
+                    abierto[0] = cv2.VideoWriter(abierto[2], cv2.VideoWriter_fourcc(*'MJPG'), abierto[3], abierto[1])
+                elif (imagen.shape[1], imagen.shape[0]) != abierto[1]:
+                    # La resolución de la cámara puede cambiar a mitad del clip
+                    imagen = cv2.resize(imagen, abierto[1])
+                abierto[0].write(imagen)
+            self.cuadros_escritos += 1
+
+    def _cerrar_clip(self, camara):
+        """Cierra el archivo del clip de la cámara."""
+        abierto = self._abiertos.pop(camara, None)
+        if abierto is None or abierto[0] is None:
+            return
+        if self.formato == 'avi':
+            abierto[0].release()
+        else:
+            abierto[0].close()
+        logging.info(f"Clip terminado: {abierto[2]}")
+
+    def _bucle(self):
+        """Atiende las órdenes de la cola hasta recibir la señal de fin."""
+        while True:
+            orden = self._cola.get()
+            if orden is None:
+                return
+            accion, camara, cuadros = orden
+            try:
+                with REGISTRO.medir('grabacion'):
+                    if accion == 'abrir':
+                        self._abrir(camara, cuadros)
+                    elif accion == 'cuadro':
+                        self._escribir(camara, cuadros)
+                    else:
+                        self._cerrar_clip(camara)
+            except Exception as e:
+                logging.error(f"Error al grabar el clip de {camara}: {e}")
+
+    def registrar_metricas(self):
+        """Expone los clips abiertos y los cuadros escritos en el registro de métricas."""
+        REGISTRO.registrar_medidor('clips_abiertos', self.grabando, 'Cámaras grabando un clip')
+        REGISTRO.registrar_medidor('cuadros_en_clips_total', lambda: self.cuadros_escritos,
+                                   'Cuadros escritos en clips', 'counter')
+        REGISTRO.registrar_medidor('cuadros_descartados_clips_total', lambda: self.cuadros_descartados,
+                                   'Cuadros que no entraron en la cola del grabador', 'counter')
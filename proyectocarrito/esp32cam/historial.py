@@ -0,0 +1,222 @@
+# Historial de detecciones en columnas para consultas por rango de horas.
+# Cada detección se guarda como una fila de un arreglo estructurado de NumPy
+# (hora, cámara, clase, confianza y caja). Las filas se juntan en bloques .npy
+# y un archivo de metadatos guarda la hora mínima y máxima de cada bloque, así
+# una consulta solo carga los bloques del rango y filtra y agrega con
+# operaciones vectorizadas en lugar de releer deteccion.log. Los bloques se
+# escriben en un hilo aparte para que el disco no frene el bucle de detección.
+
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+FILAS_POR_BLOQUE = 65536  # Detecciones por bloque como máximo
+SEGUNDOS_POR_BLOQUE = 300.0  # Un bloque se escribe aunque no esté lleno tras este tiempo
+BLOQUES_PENDIENTES = 4  # Bloques completos en espera de escritura como máximo
+ARCHIVO_METADATOS = 'bloques.json'
+
+TIPO_DETECCION = np.dtype([('marca_tiempo', '<f8'), ('camara', '<u2'), ('clase', '<u2'), ('confianza', '<f4'),
+                           ('x', '<i2'), ('y', '<i2'), ('ancho', '<i2'), ('alto', '<i2')])
+
+def _leer_metadatos(directorio):
+    """Metadatos del historial: bloques con su rango de horas y códigos de cámara."""
+    try:
+        with open(os.path.join(directorio, ARCHIVO_METADATOS), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'bloques': [], 'camaras': {}}
+
+# Escritura
+
+class HistorialDetecciones:
+    """Acumula detecciones en memoria y las escribe por bloques en `directorio`.
+
+    Las cámaras se guardan como un código numérico; la tabla de códigos va en
+    los metadatos junto con la hora mínima y máxima y las filas de cada bloque.
+    `volcar` entrega el bloque lleno a un hilo escritor junto con una copia de
+    los metadatos y sigue con un bloque nuevo; el escritor guarda el .npy antes
+    que los metadatos, así estos nunca nombran un bloque que no está en disco.
+    Solo se espera al escritor si ya tiene `bloques_pendientes` sin escribir.
+    """
+
+    def __init__(self, directorio, filas_por_bloque=FILAS_POR_BLOQUE, segundos_por_bloque=SEGUNDOS_POR_BLOQUE,
+                 bloques_pendientes=BLOQUES_PENDIENTES):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.filas_por_bloque = filas_por_bloque
+        self.segundos_por_bloque = segundos_por_bloque
+        self.filas = 0
+        self._metadatos = _leer_metadatos(directorio)
+        self._bloque = np.zeros(filas_por_bloque, dtype=TIPO_DETECCION)
+        self._usadas = 0
+        self._inicio_bloque = time.monotonic()
+        self._cola = queue.Queue(maxsize=bloques_pendientes)
+        self._hilo = threading.Thread(target=self._bucle, name='historial', daemon=True)
+        self._hilo.start()
+
+    def _codigo_camara(self, camara):
+        """Código numérico de la cámara, asignando uno nuevo si hace falta."""
+        camaras = self._metadatos['camaras']
+        if camara not in camaras:
+            camaras[camara] = len(camaras)
+        return camaras[camara]
+
+    def agregar(self, camara, marca_tiempo, detecciones):
+        """Agrega las detecciones de un cuadro como filas del bloque en curso."""
+        cantidad = len(detecciones.class_ids)
+        if cantidad == 0:
+            if self._usadas and time.monotonic() - self._inicio_bloque >= self.segundos_por_bloque:
+                self.volcar()
+            return
+        if self._usadas + cantidad > len(self._bloque):
+            self.volcar()
+        filas = self._bloque[self._usadas:self._usadas + cantidad]
+        filas['marca_tiempo'] = marca_tiempo
+        filas['camara'] = self._codigo_camara(camara)
+        filas['clase'] = detecciones.class_ids
+        filas['confianza'] = detecciones.confidences
+        cajas = np.asarray(detecciones.boxes).reshape(-1, 4)
+        filas['x'], filas['y'], filas['ancho'], filas['alto'] = cajas[:, 0], cajas[:, 1], cajas[:, 2], cajas[:, 3]
+        self._usadas += cantidad
+        self.filas += cantidad
+        if self._usadas == len(self._bloque) or time.monotonic() - self._inicio_bloque >= self.segundos_por_bloque:
+            self.volcar()
+
+    def volcar(self):
+        """Pasa el bloque en curso al hilo escritor y empieza uno nuevo."""
+        self._inicio_bloque = time.monotonic()
+        if self._usadas == 0:
+            return
+        filas = self._bloque[:self._usadas]
+        nombre = f"bloque_{len(self._metadatos['bloques']):06d}.npy"
+        self._metadatos['bloques'].append({
+            'archivo': nombre,
+            'desde': float(filas['marca_tiempo'].min()),
+            'hasta': float(filas['marca_tiempo'].max()),
+            'filas': int(self._usadas),
+        })
+        # El escritor recibe su propia copia: el bucle sigue agregando cámaras y bloques
+        metadatos = {'bloques': list(self._metadatos['bloques']), 'camaras': dict(self._metadatos['camaras'])}
+        self._cola.put((nombre, filas, metadatos))
+        self._bloque = np.zeros(self.filas_por_bloque, dtype=TIPO_DETECCION)
+        self._usadas = 0
+
+    def _escribir(self, nombre, filas, metadatos):
+        """Guarda un bloque y, después, los metadatos que lo incluyen."""
+        np.save(os.path.join(self.directorio, nombre), filas)
+        ruta = os.path.join(self.directorio, ARCHIVO_METADATOS)
+        with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(metadatos, f, ensure_ascii=False)
+        os.replace(ruta + '.tmp', ruta)
+
+    def _bucle(self):
+        """Escribe los bloques de la cola hasta recibir la señal de fin."""
+        while True:
+            tarea = self._cola.get()
+            if tarea is None:
+                return
+            try:
+                self._escribir(*tarea)
+            except Exception as e:
+                logging.error(f"Error al escribir {tarea[0]} del historial: {e}")
+
+    def cerrar(self):
+        """Escribe las detecciones que quedan en memoria y espera al hilo escritor."""
+        self.volcar()
+        self._cola.put(None)
+        self._hilo.join(timeout=10)
+
+# Consultas
+
+class ConsultaHistorial:
+    """Filtros y agregados vectorizados sobre los bloques de un historial.
+
+    Solo se cargan (mapeados en memoria) los bloques cuyo rango de horas se
+    cruza con el pedido.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        metadatos = _leer_metadatos(directorio)
+        self.bloques = metadatos['bloques']
+        self.camaras = metadatos['camaras']
+
+    def _cargar(self, desde, hasta):
+        """Filas de los bloques que se cruzan con [desde, hasta]."""
+        partes = [np.load(os.path.join(self.directorio, b['archivo']), mmap_mode='r')
+                  for b in self.bloques
+                  if (desde is None or b['hasta'] >= desde) and (hasta is None or b['desde'] <= hasta)]
+        return np.concatenate(partes) if partes else np.zeros(0, dtype=TIPO_DETECCION)
+
+    def filtrar(self, desde=None, hasta=None, camaras=None, clases=None, confianza_minima=0.0):
+        """Detecciones del rango de horas que cumplen los filtros, como arreglo estructurado."""
+        filas = self._cargar(desde, hasta)
+        mascara = filas['confianza'] >= confianza_minima
+        if desde is not None:
+            mascara &= filas['marca_tiempo'] >= desde
+        if hasta is not None:
+            mascara &= filas['marca_tiempo'] <= hasta
+        if camaras is not None:
+            mascara &= np.isin(filas['camara'], [self.camaras.get(c, -1) for c in camaras])
+        if clases is not None:
+            mascara &= np.isin(filas['clase'], list(clases))
+        return filas[mascara]
+
+    def contar_por_intervalo(self, segundos, desde, hasta, **filtros):
+        """(inicio de cada intervalo, detecciones en él) entre `desde` y `hasta`."""
+        filas = self.filtrar(desde, hasta, **filtros)
+        intervalos = int(np.ceil((hasta - desde) / segundos)) or 1
+        posiciones = np.minimum(((filas['marca_tiempo'] - desde) // segundos).astype(np.int64), intervalos - 1)
+        return desde + segundos * np.arange(intervalos), np.bincount(posiciones, minlength=intervalos)
+
+    def contar_por_clase(self, desde=None, hasta=None, **filtros):
+        """{id de clase: detecciones} en el rango."""
+        clases, conteos = np.unique(self.filtrar(desde, hasta, **filtros)['clase'], return_counts=True)
+        return dict(zip(clases.tolist(), conteos.tolist()))
+
+    def contar_por_camara(self, desde=None, hasta=None, **filtros):
+        """{cámara: detecciones} en el rango."""
+        nombres = {codigo: camara for camara, codigo in self.camaras.items()}
+        codigos, conteos = np.unique(self.filtrar(desde, hasta, **filtros)['camara'], return_counts=True)
+        return {nombres.get(c, str(c)): n for c, n in zip(codigos.tolist(), conteos.tolist())}
+
+# Reportes desde la línea de comandos
+if __name__ == "__main__":
+    from clasificacion import CLASSES_FILE, cargar_clases
+
+    parser = argparse.ArgumentParser(description="Reportes sobre el historial de detecciones.")
+    parser.add_argument('directorio', help="Carpeta del historial")
+    parser.add_argument('--desde', type=float, help="Hora inicial (segundos Unix; por defecto, hace 7 días)")
+    parser.add_argument('--hasta', type=float, help="Hora final (segundos Unix; por defecto, ahora)")
+    parser.add_argument('--clase', action='append', help="Nombre de clase a contar (se puede repetir)")
+    parser.add_argument('--camara', action='append', help="Cámara a incluir (se puede repetir)")
+    parser.add_argument('--confianza', type=float, default=0.0, help="Confianza mínima")
+    parser.add_argument('--intervalo', type=float, default=3600.0, help="Segundos por fila del reporte")
+    args = parser.parse_args()
+
+    clases = cargar_clases(CLASSES_FILE)
+    hasta = args.hasta if args.hasta is not None else time.time()
+    desde = args.desde if args.desde is not None else hasta - 7 * 24 * 3600
+    desconocidas = [nombre for nombre in args.clase or () if nombre not in clases]
+    if desconocidas:
+        parser.error(f"Clase desconocida: {', '.join(desconocidas)} (las clases están en {CLASSES_FILE})")
+    ids = [clases.index(nombre) + 1 for nombre in args.clase] if args.clase else None
+    consulta = ConsultaHistorial(args.directorio)
+    filtros = {'camaras': args.camara, 'clases': ids, 'confianza_minima': args.confianza}
+
+    inicio = time.perf_counter()
+    inicios, conteos = consulta.contar_por_intervalo(args.intervalo, desde, hasta, **filtros)
+    por_clase = consulta.contar_por_clase(desde, hasta, **filtros)
+    duracion = time.perf_counter() - inicio
+    for marca, conteo in zip(inicios, conteos):
+        if conteo:
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(marca))}  {conteo}")
+    print("Por clase: " + ", ".join(f"{clases[c - 1] if 0 < c <= len(clases) else c}={n}"
+                                    for c, n in sorted(por_clase.items(), key=lambda p: -p[1])))
+    print(f"Consulta en {duracion * 1000:.1f} ms")
@@ -0,0 +1,240 @@
+# Métricas del detector en tiempo real.
+# Lleva FPS por ventana deslizante, histogramas de latencia por etapa, contadores
+# y medidores (profundidad de colas, cuadros descartados) y los expone en formato
+# de texto de Prometheus desde un pequeño servidor HTTP local.
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIJO = 'deteccion_'
+VENTANA_FPS = 5.0  # Segundos que abarca el cálculo de FPS
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _clave(etiquetas):
+    """Convierte un dict de etiquetas en una clave ordenada y hasheable."""
+    return tuple(sorted(etiquetas.items()))
+
+def _escapar_valor(valor):
+    """Valor de etiqueta con `\\`, `"` y saltos de línea escapados como pide el formato de texto."""
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatear_etiquetas(clave, extra=()):
+    """Etiquetas en la sintaxis de Prometheus: {a="1",b="2"}."""
+    pares = list(clave) + list(extra)
+    if not pares:
+        return ''
+    texto = ','.join(f'{nombre}="{_escapar_valor(valor)}"' for nombre, valor in pares)
+    return '{' + texto + '}'
+
+# Histograma de latencias
+
+class Histograma:
+    """Histograma acumulado con límites fijos, como los de Prometheus."""
+
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = tuple(buckets)
+        self.conteos = [0] * (len(self.buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        """Registra un valor en el bucket que le corresponde."""
+        self.conteos[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def acumulados(self):
+        """Pares (límite, conteo acumulado) incluyendo +Inf."""
+        acumulado = 0
+        resultado = []
+        for limite, conteo in zip(self.buckets + (float('inf'),), self.conteos):
+            acumulado += conteo
+            resultado.append(('+Inf' if limite == float('inf') else repr(limite), acumulado))
+        return resultado
+
+# FPS en ventana deslizante
+
+class VentanaFPS:
+    """Cuenta eventos en los últimos `ventana` segundos para dar FPS actuales."""
+
+    def __init__(self, ventana=VENTANA_FPS):
+        self.ventana = ventana
+        self._marcas = deque()
+
+    def _recortar(self, ahora):
+        """Olvida los eventos que salieron de la ventana."""
+        limite = ahora - self.ventana
+        while self._marcas and self._marcas[0] < limite:
+            self._marcas.popleft()
+
+    def marcar(self, ahora=None):
+        """Registra un evento."""
+        ahora = time.monotonic() if ahora is None else ahora
+        self._marcas.append(ahora)
+        self._recortar(ahora)
+
+    def fps(self, ahora=None):
+        """Eventos por segundo dentro de la ventana."""
+        ahora = time.monotonic() if ahora is None else ahora
+        self._recortar(ahora)
+        if len(self._marcas) < 2:
+            return 0.0
+        # Al arrancar la ventana aún no está llena: se usa el lapso realmente cubierto
+        lapso = ahora - self._marcas[0]
+        if lapso < self.ventana:
+            return (len(self._marcas) - 1) / max(lapso, 1e-6)
+        return len(self._marcas) / self.ventana
+
+# Registro de métricas
+
+class Metricas:
+    """Registro de contadores, histogramas, FPS y medidores, seguro entre hilos."""
+
+    def __init__(self, ventana_fps=VENTANA_FPS):
+        self.ventana_fps = ventana_fps
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._histogramas = {}
+        self._fps = {}
+        self._medidores = []
+        self._ayudas = {}
+
+    def describir(self, nombre, ayuda):
+        """Texto HELP que acompaña a una métrica al exportarla."""
+        self._ayudas[nombre] = ayuda
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        """Suma `valor` al contador `nombre`."""
+        clave = (nombre, _clave(etiquetas))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, etapa, segundos, **etiquetas):
+        """Registra la latencia de una etapa del pipeline."""
+        etiquetas['etapa'] = etapa
+        clave = _clave(etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(segundos)
+
+    @contextmanager
+    def medir(self, etapa, **etiquetas):
+        """Mide el bloque `with` como latencia de `etapa`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio, **etiquetas)
+
+    def marcar_cuadro(self, nombre='procesados', **etiquetas):
+        """Cuenta un cuadro para el FPS de ventana y para el contador total."""
+        clave = (nombre, _clave(etiquetas))
+        with self._lock:
+            ventana = self._fps.get(clave)
+            if ventana is None:
+                ventana = self._fps[clave] = VentanaFPS(self.ventana_fps)
+            ventana.marcar()
+            self._contadores[clave] = self._contadores.get(clave, 0) + 1
+
+    def fps(self, nombre='procesados', **etiquetas):
+        """FPS actuales de `nombre` en la ventana deslizante."""
+        with self._lock:
+            ventana = self._fps.get((nombre, _clave(etiquetas)))
+            return ventana.fps() if ventana is not None else 0.0
+
+    def registrar_medidor(self, nombre, funcion, ayuda='', tipo='gauge'):
+        """Registra una función que se consulta al exportar.
+
+        La función devuelve un número o un dict {etiquetas: valor}, donde las
+        etiquetas son una tupla de pares (nombre, valor).
+        """
+        self._medidores.append((nombre, funcion, tipo))
+        if ayuda:
+            self._ayudas[nombre] = ayuda
+
+    def texto_prometheus(self):
+        """Exporta todas las métricas en el formato de texto de Prometheus."""
+        lineas = []
+
+        def cabecera(nombre, tipo):
+            ayuda = self._ayudas.get(nombre)
+            if ayuda:
+                lineas.append(f'# HELP {PREFIJO}{nombre} {ayuda}')
+            lineas.append(f'# TYPE {PREFIJO}{nombre} {tipo}')
+
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {clave: (h.acumulados(), h.suma, h.total) for clave, h in self._histogramas.items()}
+            fps = {clave: ventana.fps() for clave, ventana in self._fps.items()}
+
+        for nombre in sorted({n for n, _ in contadores}):
+            cabecera(f'{nombre}_total', 'counter')
+            for (n, clave), valor in sorted(contadores.items()):
+                if n == nombre:
+                    lineas.append(f'{PREFIJO}{nombre}_total{_formatear_etiquetas(clave)} {valor}')
+
+        for nombre in sorted({n for n, _ in fps}):
+            cabecera(f'{nombre}_fps', 'gauge')
+            for (n, clave), valor in sorted(fps.items()):
+                if n == nombre:
+                    lineas.append(f'{PREFIJO}{nombre}_fps{_formatear_etiquetas(clave)} {valor:.3f}')
+
+        if histogramas:
+            cabecera('latencia_segundos', 'histogram')
+            for clave, (acumulados, suma, total) in sorted(histogramas.items()):
+                for limite, conteo in acumulados:
+                    etiquetas = _formatear_etiquetas(clave, [('le', limite)])
+                    lineas.append(f'{PREFIJO}latencia_segundos_bucket{etiquetas} {conteo}')
+                lineas.append(f'{PREFIJO}latencia_segundos_sum{_formatear_etiquetas(clave)} {suma:.6f}')
+                lineas.append(f'{PREFIJO}latencia_segundos_count{_formatear_etiquetas(clave)} {total}')
+
+        for nombre, funcion, tipo in self._medidores:
+            try:
+                valor = funcion()
+            except Exception:
+                continue
+            cabecera(nombre, tipo)
+            valores = valor if isinstance(valor, dict) else {(): valor}
+            for clave, dato in valores.items():
+                lineas.append(f'{PREFIJO}{nombre}{_formatear_etiquetas(clave)} {dato}')
+
+        return '\n'.join(lineas) + '\n'
+
+# Registro global que comparten los módulos del detector
+REGISTRO = Metricas()
+REGISTRO.describir('latencia_segundos', 'Latencia de cada etapa del pipeline')
+
+# Servidor HTTP de métricas
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    """Responde GET /metrics con el texto de Prometheus."""
+
+    registro = REGISTRO
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        cuerpo = self.registro.texto_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        """Silencia el registro por petición del servidor HTTP."""
+
+def iniciar_servidor_metricas(puerto, direccion='127.0.0.1', registro=REGISTRO):
+    """Sirve las métricas en http://direccion:puerto/metrics desde un hilo propio."""
+    manejador = type('ManejadorMetricas', (_ManejadorMetricas,), {'registro': registro})
+    servidor = ThreadingHTTPServer((direccion, puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='metricas', daemon=True).start()
+    return servidor
@@ -0,0 +1,294 @@
+# Captura concurrente de varias cámaras ESP32-CAM con asyncio.
+# Un solo hilo con un bucle de eventos descarga de todas las cámaras a la vez
+# (capturas sueltas o stream MJPEG) y conserva el JPEG más reciente de cada una;
+# el detector compartido toma los cuadros con una política justa entre cámaras.
+
+import asyncio
+import logging
+import threading
+import time
+import urllib.parse
+
+from detector import Cuadro
+from duplicados import EsperaDuplicados
+from metricas import REGISTRO
+
+TIMEOUT_CAMARA = 10  # Segundos sin respuesta antes de reintentar una cámara
+ESPERA_REINTENTO_CAMARA = 1.0  # Segundos de espera tras un error
+LIMITE_LECTURA = 1 << 20  # Tamaño máximo de un JPEG sin Content-Length
+
+# HTTP mínimo sobre asyncio (HTTP/1.0 para evitar transfer-encoding chunked)
+
+async def abrir_http(url, timeout=TIMEOUT_CAMARA):
+    """Envía un GET y devuelve (reader, writer, cabeceras) con las cabeceras en minúsculas."""
+    partes = urllib.parse.urlsplit(url)
+    puerto = partes.port or 80
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(partes.hostname, puerto, limit=LIMITE_LECTURA), timeout)
+    ruta = partes.path or '/'
+    if partes.query:
+        ruta += '?' + partes.query
+    writer.write(f"GET {ruta} HTTP/1.0\r\nHost: {partes.netloc}\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+
+    estado = await asyncio.wait_for(reader.readline(), timeout)
+    if len(estado.split()) < 2 or estado.split()[1] != b'200':
+        writer.close()
+        raise ConnectionError(f"Respuesta inesperada de {url}: {estado.strip()!r}")
+    cabeceras = await leer_cabeceras(reader, timeout)
+    return reader, writer, cabeceras
+
+async def leer_cabeceras(reader, timeout=TIMEOUT_CAMARA):
+    """Lee cabeceras HTTP hasta la línea vacía."""
+    cabeceras = {}
+    while True:
+        linea = await asyncio.wait_for(reader.readline(), timeout)
+        if not linea:
+            raise ConnectionError("Conexión cerrada leyendo cabeceras")
+        if linea in (b'\r\n', b'\n'):
+            return cabeceras
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        cabeceras[nombre.strip().lower()] = valor.strip()
+
+async def descargar_jpeg_async(url, timeout=TIMEOUT_CAMARA):
+    """Descarga una captura suelta (por ejemplo cam-hi.jpg)."""
+    reader, writer, cabeceras = await abrir_http(url, timeout)
+    try:
+        if 'content-length' in cabeceras:
+            return await asyncio.wait_for(reader.readexactly(int(cabeceras['content-length'])), timeout)
+        return await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+
+async def leer_mjpeg_async(url, timeout=TIMEOUT_CAMARA):
+    """Itera los JPEG de un stream multipart/x-mixed-replace por una sola conexión."""
+    reader, writer, cabeceras = await abrir_http(url, timeout)
+    delimitador = b'--frame'
+    for parametro in cabeceras.get('content-type', '').split(';'):
+        nombre, _, valor = parametro.strip().partition('=')
+        if nombre.lower() == 'boundary' and valor:
+            valor = valor.strip('"')
+            delimitador = (valor if valor.startswith('--') else '--' + valor).encode('latin-1')
+    try:
+        while True:
+            linea = await asyncio.wait_for(reader.readline(), timeout)
+            if not linea:
+                raise ConnectionError("El stream MJPEG se cerró")
+            if not linea.startswith(delimitador):
+                continue
+            parte = await leer_cabeceras(reader, timeout)
+            if 'content-length' in parte:
+                yield await asyncio.wait_for(reader.readexactly(int(parte['content-length'])), timeout)
+            else:
+                yield await asyncio.wait_for(reader.readuntil(b'\xff\xd9'), timeout)
+    finally:
+        writer.close()
+
+# Estado por cámara
+
+class EstadoCamara:
+    """Último JPEG pendiente y contadores de una cámara."""
+
+    def __init__(self, id_camara, url, modo='snapshot'):
+        self.id = id_camara
+        self.url = url
+        self.modo = modo
+        self.jpeg = None
+        self.marca_tiempo = 0.0
+        self.descargados = 0
+        self.descartados = 0
+        self.procesados = 0
+        self.errores = 0
+        self.duplicados = 0
+        self.ultimo_error = None
+        self.espera = EsperaDuplicados()
+
+# Captura de todas las cámaras
+
+class CapturadorMulticamara:
+    """Descarga de todas las cámaras en un bucle asyncio y reparte cuadros al detector.
+
+    Cada cámara conserva solo su JPEG más reciente (los reemplazados se cuentan
+    como descartados). `obtener` elige la siguiente cámara según la política:
+    'round_robin' rota entre cámaras con cuadro pendiente y 'mas_reciente' toma
+    el cuadro pendiente más nuevo. La decodificación ocurre en el hilo que llama
+    a `obtener`, así el bucle de eventos solo hace E/S; `decodificar` recibe
+    los bytes JPEG y devuelve (imagen, escala). Con un `FiltroDuplicados` los
+    JPEG idénticos al anterior de su cámara no se publican y, con capturas
+    sueltas, el próximo pedido a esa cámara se demora. Los `receptores` (el
+    grabador de clips y el archivo) reciben con `agregar(camara, marca_tiempo,
+    jpeg)` cada JPEG publicado, al ritmo de la cámara; corren dentro del
+    bucle de eventos, así que solo encolan.
+    """
+
+    def __init__(self, camaras, decodificar, politica='round_robin', duplicados=None, receptores=()):
+        if politica not in ('round_robin', 'mas_reciente'):
+            raise ValueError(f"Política de planificación desconocida: {politica}")
+        self.camaras = [EstadoCamara(c['id'], c['url'], c.get('modo', 'snapshot')) for c in camaras]
+        self.decodificar = decodificar
+        self.politica = politica
+        self.duplicados = duplicados
+        self.receptores = list(receptores)
+        self._turno = 0
+        self._condicion = threading.Condition()
+        self._activo = False
+        self._bucle_eventos = None
+        self._tareas = []
+        self._hilo = None
+
+    def iniciar(self):
+        """Arranca el hilo con el bucle de eventos."""
+        self._activo = True
+        self._hilo = threading.Thread(target=self._ejecutar, name='multicamara', daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        """Cancela las descargas y despierta a quien esté esperando."""
+        with self._condicion:
+            self._activo = False
+            self._condicion.notify_all()
+        if self._bucle_eventos is not None and not self._bucle_eventos.is_closed():
+            self._bucle_eventos.call_soon_threadsafe(self._cancelar_tareas)
+        if self._hilo is not None:
+            self._hilo.join(timeout=2)
+
+    def _ejecutar(self):
+        """Cuerpo del hilo: corre una tarea por cámara hasta que se detenga."""
+        self._bucle_eventos = asyncio.new_event_loop()
+        try:
+            self._bucle_eventos.run_until_complete(self._capturar_todas())
+        finally:
+            self._bucle_eventos.close()
+
+    async def _capturar_todas(self):
+        """Una tarea de descarga por cámara."""
+        self._tareas = [asyncio.ensure_future(self._capturar_camara(c)) for c in self.camaras]
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+
+    def _cancelar_tareas(self):
+        """Cancela las tareas de descarga; corre dentro del bucle de eventos."""
+        for tarea in self._tareas:
+            tarea.cancel()
+
+    def _publicar(self, camara, jpeg):
+        """Reemplaza el cuadro pendiente de la cámara y avisa al detector; False si era repetido."""
+        if self.duplicados is not None and self.duplicados.repetido(camara.id, jpeg):
+            camara.duplicados += 1
+            return False
+        marca_tiempo = time.time()
+        for receptor in self.receptores:
+            receptor.agregar(camara.id, marca_tiempo, jpeg)
+        with self._condicion:
+            if camara.jpeg is not None:
+                camara.descartados += 1
+            camara.jpeg = jpeg
+            camara.marca_tiempo = marca_tiempo
+            camara.descargados += 1
+            self._condicion.notify()
+        REGISTRO.marcar_cuadro('descargados', camara=camara.id)
+        return True
+
+    async def _capturar_camara(self, camara):
+        """Descarga cuadros de una cámara sin parar, reintentando ante errores."""
+        try:
+            while self._activo:
+                try:
+                    await self._descargar_camara(camara)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    camara.errores += 1
+                    camara.ultimo_error = str(e)
+                    REGISTRO.incrementar('errores_captura', camara=camara.id)
+                    logging.error("Error al capturar de la cámara %s: %s", camara.id, e,
+                                  extra={'clave': ('error_captura', camara.id)})
+                    await asyncio.sleep(ESPERA_REINTENTO_CAMARA)
+        except asyncio.CancelledError:
+            return
+
+    async def _descargar_camara(self, camara):
+        """Publica cuadros de una conexión (stream) o de una sola petición (captura)."""
+        inicio = time.perf_counter()
+        if camara.modo != 'mjpeg':
+            jpeg = await descargar_jpeg_async(camara.url)
+            REGISTRO.observar('descarga', time.perf_counter() - inicio, camara=camara.id)
+            if self._publicar(camara, jpeg):
+                camara.espera.reiniciar()
+            else:
+                await asyncio.sleep(camara.espera.siguiente())
+            return
+        async for jpeg in leer_mjpeg_async(camara.url):
+            REGISTRO.observar('descarga', time.perf_counter() - inicio, camara=camara.id)
+            self._publicar(camara, jpeg)
+            if not self._activo:
+                return
+            inicio = time.perf_counter()
+
+    def _elegir(self):
+        """Cámara con cuadro pendiente según la política, o None."""
+        pendientes = [c for c in self.camaras if c.jpeg is not None]
+        if not pendientes:
+            return None
+        if self.politica == 'mas_reciente':
+            return max(pendientes, key=lambda c: c.marca_tiempo)
+        total = len(self.camaras)
+        for desplazamiento in range(total):
+            camara = self.camaras[(self._turno + desplazamiento) % total]
+            if camara.jpeg is not None:
+                self._turno = (self._turno + desplazamiento + 1) % total
+                return camara
+
+    def obtener(self, timeout=1.0):
+        """Espera un cuadro de cualquier cámara y lo devuelve decodificado, o None."""
+        lote = self.obtener_lote(1, timeout)
+        return lote[0] if lote else None
+
+    def obtener_lote(self, maximo, timeout=1.0):
+        """Espera y devuelve hasta `maximo` cuadros decodificados, a lo sumo uno por cámara."""
+        tomados = []
+        with self._condicion:
+            self._condicion.wait_for(lambda: not self._activo or any(c.jpeg is not None for c in self.camaras),
+                                     timeout)
+            while len(tomados) < maximo:
+                camara = self._elegir()
+                if camara is None:
+                    break
+                jpeg, camara.jpeg = camara.jpeg, None
+                camara.procesados += 1
+                tomados.append((camara.id, jpeg, camara.marca_tiempo, camara.descargados))
+        lote = []
+        for id_camara, jpeg, marca_tiempo, id_cuadro in tomados:
+            with REGISTRO.medir('decodificacion', camara=id_camara):
+                imagen, escala = self.decodificar(jpeg)
+            if imagen is not None:
+                lote.append(Cuadro(imagen, jpeg, marca_tiempo, id_cuadro, id_camara, escala))
+        return lote
+
+    def pendientes(self):
+        """Cámaras con un cuadro esperando al detector."""
+        return sum(c.jpeg is not None for c in self.camaras)
+
+    def estadisticas(self):
+        """Contadores y FPS de descarga por cámara."""
+        return {
+            c.id: {
+                'descargados': c.descargados,
+                'procesados': c.procesados,
+                'descartados': c.descartados,
+                'errores': c.errores,
+                'duplicados': c.duplicados,
+                'ultimo_error': c.ultimo_error,
+                'fps_descarga': round(REGISTRO.fps('descargados', camara=c.id), 2),
+                'fps_procesados': round(REGISTRO.fps('procesados', camara=c.id), 2),
+            }
+            for c in self.camaras
+        }
+
+    def registrar_metricas(self):
+        """Expone los contadores por cámara en el registro de métricas."""
+        REGISTRO.registrar_medidor('cuadros_descartados_total',
+                                   lambda: {(('camara', c.id),): c.descartados for c in self.camaras},
+                                   'Cuadros reemplazados antes de llegar al detector', 'counter')
+        REGISTRO.registrar_medidor('camaras_con_cuadro_pendiente', self.pendientes,
+                                   'Cámaras esperando turno en el detector')
@@ -0,0 +1,321 @@
+# Puente de detecciones a MQTT.
+# Publica un evento compacto por cuadro con detecciones y, si una clase
+# configurada aparece dentro de la región de peligro, publica en el tópico de
+# alto que escucha el carrito (esp32/esp32 1/boot.py). Usa un cliente MQTT 3.1.1
+# mínimo (QoS 0) sobre un socket con TCP_NODELAY, para no depender de
+# bibliotecas externas, y mide la latencia desde la captura hasta el alto.
+
+import itertools
+import json
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from metricas import REGISTRO
+
+KEEPALIVE_MQTT = 30  # Segundos de keepalive negociados con el broker
+ESPERA_RECONEXION_MQTT = 2.0  # Segundos entre intentos de reconexión
+TAMANO_COLA_MQTT = 64  # Eventos pendientes de publicar; los más viejos se descartan
+
+# Cliente MQTT mínimo (QoS 0)
+
+def _longitud(valor):
+    """Codifica la longitud restante de un paquete MQTT (1 a 4 bytes)."""
+    codificada = bytearray()
+    while True:
+        byte, valor = valor % 128, valor // 128
+        codificada.append(byte | (0x80 if valor else 0))
+        if not valor:
+            return bytes(codificada)
+
+def _cadena(texto):
+    """Cadena MQTT: largo de 16 bits seguido de los bytes."""
+    datos = texto if isinstance(texto, bytes) else texto.encode('utf-8')
+    return struct.pack('!H', len(datos)) + datos
+
+def _leer_exacto(conexion, cantidad):
+    """Lee exactamente `cantidad` bytes del socket."""
+    datos = bytearray()
+    while len(datos) < cantidad:
+        parte = conexion.recv(cantidad - len(datos))
+        if not parte:
+            raise ConnectionError("El broker MQTT cerró la conexión")
+        datos += parte
+    return bytes(datos)
+
+def _leer_paquete(conexion):
+    """Lee un paquete y devuelve (tipo, banderas, cuerpo)."""
+    cabecera = _leer_exacto(conexion, 1)[0]
+    longitud, multiplicador = 0, 1
+    while True:
+        byte = _leer_exacto(conexion, 1)[0]
+        longitud += (byte & 0x7F) * multiplicador
+        multiplicador *= 128
+        if not byte & 0x80:
+            break
+    return cabecera >> 4, cabecera & 0x0F, _leer_exacto(conexion, longitud) if longitud else b''
+
+class ClienteMQTT:
+    """Conexión MQTT 3.1.1 con publicación y suscripción QoS 0.
+
+    Los mensajes recibidos se entregan a `al_recibir(topico, carga)` desde el
+    hilo lector de la conexión.
+    """
+
+    def __init__(self, servidor, puerto, id_cliente, keepalive=KEEPALIVE_MQTT, al_recibir=None):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.id_cliente = id_cliente
+        self.keepalive = keepalive
+        self.al_recibir = al_recibir
+        self._conexion = None
+        self._lock = threading.Lock()
+        self._ultimo_envio = 0.0
+        self._identificadores = itertools.count(1)
+
+    def conectar(self, timeout=10):
+        """Abre la conexión, envía CONNECT y espera el CONNACK."""
+        conexion = socket.create_connection((self.servidor, self.puerto), timeout)
+        conexion.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Sesión limpia, sin usuario ni will
+        variable = _cadena('MQTT') + bytes([4, 0x02]) + struct.pack('!H', self.keepalive)
+        cuerpo = variable + _cadena(self.id_cliente)
+        conexion.sendall(bytes([0x10]) + _longitud(len(cuerpo)) + cuerpo)
+        tipo, _, respuesta = _leer_paquete(conexion)
+        if tipo != 2 or len(respuesta) < 2 or respuesta[1] != 0:
+            conexion.close()
+            raise ConnectionError(f"El broker rechazó la conexión MQTT (código {respuesta[1:2].hex()})")
+        conexion.settimeout(None)
+        self._conexion = conexion
+        self._ultimo_envio = time.monotonic()
+        threading.Thread(target=self._leer, args=(conexion,), name='mqtt-lector', daemon=True).start()
+        logging.info(f"Conectado al broker MQTT {self.servidor}:{self.puerto}")
+
+    def conectado(self):
+        """True mientras la conexión con el broker siga abierta."""
+        return self._conexion is not None
+
+    def _enviar(self, paquete):
+        """Envía un paquete completo; ante un error cierra la conexión y lo propaga."""
+        with self._lock:
+            if self._conexion is None:
+                raise ConnectionError("Sin conexión MQTT")
+            try:
+                self._conexion.sendall(paquete)
+            except OSError:
+                self.cerrar()
+                raise
+            self._ultimo_envio = time.monotonic()
+
+    def publicar(self, topico, carga):
+        """PUBLISH con QoS 0."""
+        cuerpo = _cadena(topico) + carga
+        self._enviar(bytes([0x30]) + _longitud(len(cuerpo)) + cuerpo)
+
+    def suscribir(self, topico):
+        """SUBSCRIBE con QoS 0."""
+        cuerpo = struct.pack('!H', next(self._identificadores) % 0xFFFF or 1) + _cadena(topico) + b'\x00'
+        self._enviar(bytes([0x82]) + _longitud(len(cuerpo)) + cuerpo)
+
+    def mantener(self):
+        """Envía PINGREQ si la conexión lleva mucho sin tráfico saliente."""
+        if self._conexion is not None and time.monotonic() - self._ultimo_envio > self.keepalive / 2:
+            self._enviar(b'\xc0\x00')
+
+    def cerrar(self):
+        """Cierra la conexión (sin lanzar errores)."""
+        conexion, self._conexion = self._conexion, None
+        if conexion is not None:
+            try:
+                conexion.sendall(b'\xe0\x00')  # DISCONNECT
+            except OSError:
+                pass
+            conexion.close()
+
+    def _leer(self, conexion):
+        """Hilo lector: entrega los PUBLISH recibidos y detecta la desconexión."""
+        try:
+            while True:
+                tipo, banderas, cuerpo = _leer_paquete(conexion)
+                if tipo == 3 and self.al_recibir is not None:
+                    largo = struct.unpack('!H', cuerpo[:2])[0]
+                    inicio = 2 + largo + (2 if (banderas >> 1) & 0x03 else 0)
+                    self.al_recibir(cuerpo[2:2 + largo], cuerpo[inicio:])
+        except (OSError, ConnectionError, struct.error):
+            if self._conexion is conexion:
+                self._conexion = None
+
+# Puente con el detector
+
+def centro_en_region(cajas, region):
+    """Máscara de las cajas (x, y, ancho, alto) cuyo centro cae en la región."""
+    cajas = np.asarray(cajas, dtype=np.float32).reshape(-1, 4)
+    if region is None:
+        return np.ones(len(cajas), dtype=bool)
+    x, y, ancho, alto = region
+    centro_x = cajas[:, 0] + cajas[:, 2] / 2
+    centro_y = cajas[:, 1] + cajas[:, 3] / 2
+    return (centro_x >= x) & (centro_x < x + ancho) & (centro_y >= y) & (centro_y < y + alto)
+
+class PuenteMQTT:
+    """Publica detecciones por cuadro y órdenes de alto desde un hilo propio.
+
+    El hilo mantiene la conexión (reconectando si se cae) y vacía una cola
+    acotada; las órdenes de alto se anteponen a los eventos. La latencia de
+    cámara a alto se mide al publicar y, como el puente está suscrito al
+    tópico de alto, también cuando el broker devuelve el mensaje, que es lo
+    que tarda en llegar al carrito salvo su último tramo. Un alto se envía con
+    detecciones nuevas del detector o cuando la cámara entra en peligro; las
+    detecciones reutilizadas o rastreadas de un peligro que sigue no lo repiten.
+    """
+
+    def __init__(self, servidor, puerto, topico_detecciones, topico_alto, clases_alto, region_peligro=None,
+                 intervalo_alto=0.5, id_cliente=None):
+        self.topico_detecciones = topico_detecciones
+        self.topico_alto = topico_alto
+        self.clases_alto = tuple(clases_alto)
+        self.region_peligro = region_peligro
+        self.intervalo_alto = intervalo_alto
+        self.publicados = 0
+        self.altos = 0
+        self.descartados = 0
+        self._ultimo_alto = {}  # camara -> hora del último alto publicado
+        self._en_peligro = {}  # camara -> si el último cuadro tenía peligro
+        self._pendientes_eco = {}  # carga del alto -> hora de captura del cuadro
+        self._secuencia = itertools.count()
+        self._altos = queue.SimpleQueue()
+        self._eventos = queue.Queue(maxsize=TAMANO_COLA_MQTT)
+        self._activo = True
+        self.cliente = ClienteMQTT(servidor, puerto, id_cliente or f"detector-{socket.gethostname()}",
+                                   al_recibir=self._recibido)
+        self._hay_trabajo = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name='puente-mqtt', daemon=True)
+        self._hilo.start()
+
+    def _peligro(self, detecciones, tabla):
+        """True si alguna detección de una clase de alto tiene el centro en la región de peligro."""
+        if not self.clases_alto or len(detecciones.class_ids) == 0:
+            return False
+        de_alto = tabla.de_clases(self.clases_alto)[tabla.indices(detecciones.class_ids)]
+        return bool((centro_en_region(detecciones.boxes, self.region_peligro) & de_alto).any())
+
+    def publicar_cuadro(self, camara, marca_tiempo, id_cuadro, detecciones, tabla, nuevas=True):
+        """Encola el evento del cuadro y, si hay peligro, una orden de alto.
+
+        `tabla` es la `TablaClases` del detector; `nuevas` es False cuando las
+        detecciones se reutilizan de un cuadro anterior o vienen del rastreador.
+        """
+        peligro = self._peligro(detecciones, tabla)
+        cambio = peligro != self._en_peligro.get(camara, False)
+        self._en_peligro[camara] = peligro
+        if peligro and (nuevas or cambio):
+            ahora = time.time()
+            if ahora - self._ultimo_alto.get(camara, 0.0) >= self.intervalo_alto:
+                self._ultimo_alto[camara] = ahora
+                self._altos.put((camara, marca_tiempo))
+                self._hay_trabajo.set()
+        if len(detecciones.class_ids) == 0:
+            return
+        etiquetas = tabla.etiquetas
+        evento = {
+            'ts': round(marca_tiempo, 3),
+            'cam': camara,
+            'f': id_cuadro,
+            'd': [[etiquetas[i], round(float(p), 3), *(int(v) for v in caja)]
+                  for i, p, caja in zip(tabla.indices(detecciones.class_ids).tolist(), detecciones.confidences,
+                                        detecciones.boxes)],
+        }
+        carga = json.dumps(evento, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        while True:
+            try:
+                self._eventos.put_nowait(carga)
+                break
+            except queue.Full:
+                try:
+                    self._eventos.get_nowait()
+                    self.descartados += 1
+                except queue.Empty:
+                    pass
+        self._hay_trabajo.set()
+
+    def _recibido(self, topico, carga):
+        """Eco del broker de un alto propio: mide captura → broker → suscriptor."""
+        if topico == self.topico_alto:
+            marca_tiempo = self._pendientes_eco.pop(carga, None)
+            if marca_tiempo is not None:
+                REGISTRO.observar('camara_a_alto_broker', time.time() - marca_tiempo)
+
+    def _conectar(self):
+        """Conecta y se suscribe al tópico de alto para medir el eco."""
+        self.cliente.conectar()
+        self.cliente.suscribir(self.topico_alto)
+
+    def _publicar_pendientes(self):
+        """Publica primero los altos y luego los eventos encolados."""
+        while True:
+            try:
+                camara, marca_tiempo = self._altos.get_nowait()
+            except queue.Empty:
+                break
+            carga = f"vision:{camara}:{next(self._secuencia)}".encode('utf-8')
+            self._pendientes_eco[carga] = marca_tiempo
+            if len(self._pendientes_eco) > TAMANO_COLA_MQTT:
+                # Ecos que nunca llegaron (por ejemplo, tras una reconexión)
+                self._pendientes_eco.pop(next(iter(self._pendientes_eco)))
+            self.cliente.publicar(self.topico_alto, carga)
+            latencia = time.time() - marca_tiempo
+            REGISTRO.observar('camara_a_alto', latencia, camara=camara)
+            self.altos += 1
+            logging.info(f"Alto enviado al carrito por {camara} a {latencia * 1000:.0f} ms de la captura")
+        while True:
+            try:
+                carga = self._eventos.get_nowait()
+            except queue.Empty:
+                break
+            self.cliente.publicar(self.topico_detecciones, carga)
+            self.publicados += 1
+
+    def _bucle(self):
+        """Mantiene la conexión y publica lo que llega a las colas."""
+        while self._activo:
+            try:
+                if not self.cliente.conectado():
+                    self._conectar()
+                # Se limpia antes de vaciar las colas para no perder un aviso que llegue en medio
+                self._hay_trabajo.clear()
+                self._publicar_pendientes()
+                self.cliente.mantener()
+            except (OSError, ConnectionError) as e:
+                self.cliente.cerrar()
+                logging.error("Error en el puente MQTT: %s", e, extra={'clave': ('error_mqtt',)})
+                time.sleep(ESPERA_RECONEXION_MQTT)
+                continue
+            self._hay_trabajo.wait(1.0)
+        try:
+            if self.cliente.conectado():
+                self._publicar_pendientes()
+        except (OSError, ConnectionError):
+            pass
+        self.cliente.cerrar()
+
+    def cerrar(self):
+        """Publica lo pendiente si hay conexión y detiene el hilo."""
+        self._activo = False
+        self._hay_trabajo.set()
+        self._hilo.join(timeout=5)
+
+    def registrar_metricas(self):
+        """Expone los contadores del puente en el registro de métricas."""
+        REGISTRO.registrar_medidor('mqtt_eventos_total', lambda: self.publicados,
+                                   'Eventos de detección publicados en MQTT', 'counter')
+        REGISTRO.registrar_medidor('mqtt_altos_total', lambda: self.altos,
+                                   'Órdenes de alto enviadas al carrito', 'counter')
+        REGISTRO.registrar_medidor('mqtt_descartados_total', lambda: self.descartados,
+                                   'Eventos descartados por cola llena', 'counter')
+        REGISTRO.registrar_medidor('mqtt_conectado', lambda: int(self.cliente.conectado()),
+                                   'Conexión con el broker MQTT')
@@ -0,0 +1,135 @@
+# Retransmisión MJPEG de los cuadros anotados.
+# Cada cuadro anotado se codifica una sola vez y los mismos bytes se envían a
+# todos los espectadores conectados; un cliente lento siempre toma el cuadro
+# más reciente y se salta los intermedios en lugar de acumularlos. La cámara
+# sigue teniendo un único consumidor, este programa, sin importar cuánta gente
+# mire.
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from metricas import REGISTRO
+
+CALIDAD_JPEG = 70  # Calidad de la recodificación de los cuadros anotados
+ESPERA_CUADRO = 5.0  # Segundos sin cuadros nuevos antes de revisar si el cliente sigue conectado
+
+class CanalMJPEG:
+    """Último cuadro codificado de una cámara y su número de secuencia."""
+
+    def __init__(self):
+        self.jpeg = None
+        self.secuencia = 0
+        self.espectadores = 0
+        self.condicion = threading.Condition()
+
+class DifusorMJPEG:
+    """Reparte los cuadros anotados de cada cámara a los espectadores HTTP."""
+
+    def __init__(self, calidad=CALIDAD_JPEG):
+        self.parametros = [int(cv2.IMWRITE_JPEG_QUALITY), calidad]
+        self.codificados = 0
+        self._canales = {}
+        self._lock = threading.Lock()
+
+    def canal(self, camara):
+        """Canal de la cámara, creándolo si hace falta."""
+        with self._lock:
+            canal = self._canales.get(camara)
+            if canal is None:
+                canal = self._canales[camara] = CanalMJPEG()
+            return canal
+
+    def camaras(self):
+        """Cámaras que publicaron al menos un cuadro."""
+        with self._lock:
+            return list(self._canales)
+
+    def espectadores(self, camara=None):
+        """Clientes conectados a una cámara o a todas."""
+        with self._lock:
+            canales = list(self._canales.values()) if camara is None else [self._canales.get(camara)]
+        return sum(c.espectadores for c in canales if c is not None)
+
+    def publicar(self, camara, imagen):
+        """Codifica el cuadro una vez y despierta a los espectadores; sin espectadores no codifica."""
+        canal = self.canal(camara)
+        if canal.espectadores == 0:
+            return
+        with REGISTRO.medir('retransmision', camara=camara):
+            correcto, codificado = cv2.imencode('.jpg', imagen, self.parametros)
+        if not correcto:
+            return
+        with canal.condicion:
+            canal.jpeg = codificado.tobytes()
+            canal.secuencia += 1
+            canal.condicion.notify_all()
+        self.codificados += 1
+
+    def registrar_metricas(self):
+        """Expone los espectadores por cámara en el registro de métricas."""
+        REGISTRO.registrar_medidor('espectadores',
+                                   lambda: {(('camara', c),): self.espectadores(c) for c in self.camaras()},
+                                   'Clientes conectados a la retransmisión MJPEG')
+
+class _ManejadorMJPEG(BaseHTTPRequestHandler):
+    """GET / (primera cámara) o GET /<cámara>: stream multipart/x-mixed-replace."""
+
+    difusor = None
+    camara_predeterminada = None
+
+    def do_GET(self):
+        camara = self.path.split('?')[0].strip('/') or self.camara_predeterminada
+        if camara not in self.difusor.camaras():
+            self.send_error(404)
+            return
+        canal = self.difusor.canal(camara)
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        with canal.condicion:
+            canal.espectadores += 1
+        logging.info(f"Espectador {self.client_address[0]} conectado a {camara}")
+        vista = 0
+        try:
+            while True:
+                with canal.condicion:
+                    # Siempre el último cuadro: un cliente lento se salta los intermedios
+                    nuevo = canal.condicion.wait_for(lambda: canal.secuencia != vista, ESPERA_CUADRO)
+                    jpeg, vista = canal.jpeg, canal.secuencia
+                if not nuevo:
+                    # Sin cuadros se escribe un CRLF entre partes (el multipart lo admite): si el
+                    # espectador se fue la escritura falla y deja de contarse
+                    self.wfile.write(b'\r\n')
+                    self.wfile.flush()
+                    continue
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                 + f'Content-Length: {len(jpeg)}\r\n\r\n'.encode('ascii'))
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            with canal.condicion:
+                canal.espectadores -= 1
+            logging.info(f"Espectador {self.client_address[0]} desconectado de {camara}")
+
+    def log_message(self, formato, *args):
+        """Silencia el registro por petición del servidor HTTP."""
+
+def iniciar_servidor_mjpeg(difusor, puerto, direccion='127.0.0.1', camara_predeterminada=None):
+    """Sirve los streams en http://direccion:puerto/<cámara> desde un hilo propio.
+
+    Como las métricas, escucha solo en este equipo salvo que se pida otra
+    interfaz: el stream no tiene autenticación.
+    """
+    manejador = type('ManejadorMJPEG', (_ManejadorMJPEG,),
+                     {'difusor': difusor, 'camara_predeterminada': camara_predeterminada})
+    servidor = ThreadingHTTPServer((direccion, puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='retransmision', daemon=True).start()
+    return servidor
@@ -0,0 +1,105 @@
+# Salida estructurada de detecciones para el modo sin pantalla.
+# Cada cuadro con detecciones se escribe como una línea JSON (NDJSON) o como un
+# registro binario compacto, en stdout ('-') o en un archivo.
+
+import json
+import struct
+import sys
+
+# Formato binario (little-endian):
+#   cabecera: marca de tiempo (f64), id de cuadro (u64), nueva (u8),
+#             largo del id de cámara (u8), número de detecciones (u16)
+#   seguido del id de cámara en UTF-8 y de una entrada por detección:
+#             id de clase (u16), confianza (f32), x, y, ancho, alto (i16), id de pista (i32, -1 sin rastreo)
+CABECERA_BINARIA = struct.Struct('<dQBBH')
+DETECCION_BINARIA = struct.Struct('<Hfhhhhi')
+
+class SalidaDetecciones:
+    """Escribe detecciones por cuadro en formato 'ndjson' o 'binario'."""
+
+    def __init__(self, destino, formato='ndjson', camara='esp32cam', clases=None):
+        if formato not in ('ndjson', 'binario'):
+            raise ValueError(f"Formato de salida desconocido: {formato}")
+        self.formato = formato
+        self.camara = camara
+        self.clases = clases
+        self.escritos = 0
+        self._propio = destino != '-'
+        if formato == 'binario':
+            self._archivo = open(destino, 'ab') if self._propio else sys.stdout.buffer
+        else:
+            self._archivo = open(destino, 'a', encoding='utf-8') if self._propio else sys.stdout
+
+    def _etiqueta(self, class_id):
+        """Nombre de la clase si se conocen las etiquetas."""
+        if self.clases is not None and 0 < class_id <= len(self.clases):
+            return self.clases[class_id - 1]
+        return None
+
+    def _json(self, detecciones, marca_tiempo, id_cuadro, nueva, camara):
+        """Una línea JSON con todas las detecciones del cuadro."""
+        track_ids = detecciones.track_ids
+        lista = []
+        for i, (class_id, confianza, caja) in enumerate(zip(detecciones.class_ids, detecciones.confidences,
+                                                            detecciones.boxes)):
+            deteccion = {
+                'clase': self._etiqueta(int(class_id)),
+                'id_clase': int(class_id),
+                'confianza': round(float(confianza), 4),
+                'caja': [int(v) for v in caja],
+            }
+            if track_ids is not None:
+                deteccion['pista'] = int(track_ids[i])
+            lista.append(deteccion)
+        registro = {'ts': marca_tiempo, 'camara': camara, 'cuadro': id_cuadro, 'nueva': nueva,
+                    'detecciones': lista}
+        return json.dumps(registro, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def _binario(self, detecciones, marca_tiempo, id_cuadro, nueva, camara):
+        """Registro binario con cabecera y una entrada fija por detección."""
+        nombre = camara.encode('utf-8')[:255]
+        partes = [CABECERA_BINARIA.pack(marca_tiempo, id_cuadro, int(nueva), len(nombre),
+                                        len(detecciones.class_ids)), nombre]
+        track_ids = detecciones.track_ids
+        for i, (class_id, confianza, caja) in enumerate(zip(detecciones.class_ids, detecciones.confidences,
+                                                            detecciones.boxes)):
+            pista = int(track_ids[i]) if track_ids is not None else -1
+            partes.append(DETECCION_BINARIA.pack(int(class_id), float(confianza), *(int(v) for v in caja), pista))
+        return b''.join(partes)
+
+    def escribir(self, detecciones, marca_tiempo, id_cuadro, nueva=True, camara=None):
+        """Escribe las detecciones de un cuadro; los cuadros sin detecciones se omiten."""
+        if len(detecciones.class_ids) == 0:
+            return
+        camara = self.camara if camara is None else camara
+        if self.formato == 'binario':
+            registro = self._binario(detecciones, marca_tiempo, id_cuadro, nueva, camara)
+        else:
+            registro = self._json(detecciones, marca_tiempo, id_cuadro, nueva, camara)
+        self._archivo.write(registro)
+        self._archivo.flush()
+        self.escritos += 1
+
+    def cerrar(self):
+        """Cierra el archivo de salida (stdout se deja abierto)."""
+        if self._propio:
+            self._archivo.close()
+        else:
+            self._archivo.flush()
+
+def leer_registros_binarios(archivo):
+    """Itera los registros de un archivo binario como dicts, para herramientas que lo consumen."""
+    while True:
+        cabecera = archivo.read(CABECERA_BINARIA.size)
+        if len(cabecera) < CABECERA_BINARIA.size:
+            return
+        marca_tiempo, id_cuadro, nueva, largo_camara, cantidad = CABECERA_BINARIA.unpack(cabecera)
+        camara = archivo.read(largo_camara).decode('utf-8')
+        detecciones = []
+        for _ in range(cantidad):
+            class_id, confianza, x, y, ancho, alto, pista = DETECCION_BINARIA.unpack(
+                archivo.read(DETECCION_BINARIA.size))
+            detecciones.append({'id_clase': class_id, 'confianza': confianza, 'caja': [x, y, ancho, alto],
+                                'pista': pista if pista >= 0 else None})
+        yield {'ts': marca_tiempo, 'camara': camara, 'cuadro': id_cuadro, 'nueva': bool(nueva),
+               'detecciones': detecciones}
@@ -0,0 +1,24 @@
+# Los módulos de esp32cam se importan por nombre (como hace clasificacion.py),
+# así que la carpeta del proyecto va al principio de sys.path.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from detector import Detecciones
+
+def crear_detecciones(class_ids, confidences=0.9, boxes=(1, 2, 3, 4)):
+    """`Detecciones` desde listas; una confianza o una caja sola se repiten para todas las clases."""
+    cantidad = len(class_ids)
+    return Detecciones(np.array(class_ids, dtype=np.int32),
+                       np.broadcast_to(np.asarray(confidences, dtype=np.float32), (cantidad,)).copy(),
+                       np.broadcast_to(np.asarray(boxes, dtype=np.int32).reshape(-1, 4), (cantidad, 4)).copy())
+
+@pytest.fixture
+def detecciones():
+    """Fábrica de `Detecciones` para armar resultados del detector a mano."""
+    return crear_detecciones
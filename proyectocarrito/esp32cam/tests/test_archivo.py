@@ -0,0 +1,76 @@
+# Ida y vuelta del archivo de cuadros: EscritorArchivo escribe, LectorArchivo lee.
+
+import io
+import os
+
+import numpy as np
+
+from archivo import EXTENSION_DATOS, EscritorArchivo, LectorArchivo, es_archivo
+from detector import Detecciones
+
+def jpeg(numero):
+    return b'\xff\xd8' + bytes([numero % 256]) * (100 + numero) + b'\xff\xd9'
+
+def escribir(directorio, cuadros, **opciones):
+    escritor = EscritorArchivo(str(directorio), **opciones)
+    for camara, marca_tiempo, datos, detecciones in cuadros:
+        escritor.agregar(camara, marca_tiempo, datos, detecciones)
+    escritor.cerrar()
+    return escritor
+
+def test_ida_y_vuelta_con_resumen(tmp_path):
+    detecciones = Detecciones(np.array([3, 1], dtype=np.int32), np.array([0.4, 0.8], dtype=np.float32),
+                              np.zeros((2, 4), dtype=np.int32))
+    escribir(tmp_path, [('cam', 10.0, jpeg(1), None), ('cam', 11.0, jpeg(2), detecciones)])
+    assert es_archivo(str(tmp_path / 'cam'))
+    with LectorArchivo(str(tmp_path / 'cam')) as lector:
+        assert len(lector) == 2
+        marca_tiempo, datos, resumen = lector.cuadro(1)
+        assert marca_tiempo == 11.0 and bytes(datos) == jpeg(2)
+        del datos  # Las vistas sobre el segmento mapeado deben soltarse antes de cerrar
+        assert resumen['detecciones'] == 2 and resumen['clase'] == 1
+        assert abs(resumen['confianza'] - 0.8) < 1e-6
+        assert lector.cuadro(0)[2]['detecciones'] == 0
+
+def test_cuadros_sin_detecciones_llevan_las_ultimas_anotadas(tmp_path, detecciones):
+    escritor = EscritorArchivo(str(tmp_path))
+    escritor.agregar('cam', 1.0, jpeg(1))
+    escritor.anotar('cam', detecciones([2], 0.7))
+    escritor.agregar('cam', 2.0, jpeg(2))
+    escritor.agregar('otra', 2.0, jpeg(3))
+    escritor.cerrar()
+    with LectorArchivo(str(tmp_path / 'cam')) as lector:
+        assert lector.indice['detecciones'].tolist() == [0, 1]
+        assert lector.indice['clase'].tolist() == [0, 2]
+    with LectorArchivo(str(tmp_path / 'otra')) as lector:
+        assert lector.indice['detecciones'].tolist() == [0]
+
+def test_rango_y_exportar(tmp_path):
+    escribir(tmp_path, [('cam', float(i), jpeg(i), None) for i in range(10)])
+    with LectorArchivo(str(tmp_path / 'cam')) as lector:
+        assert lector.rango(3.0, 6.0) == (3, 7)
+        assert lector.rango(3.5, 3.7) == (4, 4)
+        destino = io.BytesIO()
+        assert lector.exportar(destino, 3.0, 6.0) == 4
+        assert destino.getvalue() == b''.join(jpeg(i) for i in range(3, 7))
+
+def test_cambia_de_segmento_y_reabre_en_uno_nuevo(tmp_path):
+    escribir(tmp_path, [('cam', float(i), jpeg(i), None) for i in range(6)], bytes_segmento=300)
+    escribir(tmp_path, [('cam', 100.0, jpeg(99), None)])
+    segmentos = [n for n in os.listdir(tmp_path / 'cam') if n.endswith(EXTENSION_DATOS)]
+    assert len(segmentos) > 2
+    with LectorArchivo(str(tmp_path / 'cam')) as lector:
+        assert [bytes(d) for _, d, _ in lector] == [jpeg(i) for i in range(6)] + [jpeg(99)]
+
+def test_cada_camara_en_su_carpeta(tmp_path):
+    escribir(tmp_path, [('a', 1.0, jpeg(1), None), ('b', 2.0, jpeg(2), None), ('a', 3.0, jpeg(3), None)])
+    with LectorArchivo(str(tmp_path / 'a')) as lector:
+        assert lector.indice['marca_tiempo'].tolist() == [1.0, 3.0]
+
+def test_ignora_el_cuadro_cortado_a_mitad_de_escritura(tmp_path):
+    escribir(tmp_path, [('cam', 1.0, jpeg(1), None), ('cam', 2.0, jpeg(2), None)])
+    datos = tmp_path / 'cam' / ('segmento_000000' + EXTENSION_DATOS)
+    with open(datos, 'r+b') as f:
+        f.truncate(os.path.getsize(datos) - 5)
+    with LectorArchivo(str(tmp_path / 'cam')) as lector:
+        assert len(lector) == 1 and bytes(lector.jpeg(0)) == jpeg(1)
@@ -0,0 +1,69 @@
+# Escalones de calidad de la cámara: bajada, subida y espera entre ambas.
+
+import pytest
+
+from clasificacion import ControladorCalidad
+
+ESCALONES = [('QVGA', 20), ('VGA', 15), ('SVGA', 15)]
+
+@pytest.fixture
+def reloj():
+    """Reloj manual: la prueba avanza `hora[0]` y el controlador lo lee."""
+    return [0.0]
+
+@pytest.fixture
+def controlador(reloj):
+    """Controlador en el escalón del medio que anota los escalones pedidos en vez de llamar a la cámara."""
+    controlador = ControladorCalidad('http://camara/control', ESCALONES, latencia_maxima=0.5,
+                                     ancho_banda_maximo=None, intervalo=5.0, espera_subida=30.0,
+                                     reloj=lambda: reloj[0])
+    controlador.escalon = 1
+    controlador.pedidos = []
+    controlador._en_segundo_plano = lambda funcion, escalon: controlador.pedidos.append(escalon)
+    return controlador
+
+def intervalo(controlador, reloj, latencia, cuadros=10):
+    """Un intervalo completo de descargas con la latencia dada, todas procesadas, y la revisión al final."""
+    for _ in range(cuadros):
+        controlador.medir_descarga(latencia, 20000)
+    controlador.medir_procesado(cuadros)
+    reloj[0] += controlador.intervalo
+    controlador.revisar()
+
+def test_no_decide_antes_del_intervalo(controlador, reloj):
+    controlador.medir_descarga(2.0, 20000)
+    reloj[0] += 1.0
+    controlador.revisar()
+    assert controlador.pedidos == []
+
+def test_baja_si_la_descarga_tarda(controlador, reloj):
+    intervalo(controlador, reloj, 1.0)
+    assert controlador.pedidos == [0]
+
+def test_no_baja_del_menor_escalon(controlador, reloj):
+    controlador.escalon = 0
+    intervalo(controlador, reloj, 1.0)
+    assert controlador.pedidos == []
+
+def test_sube_con_holgura(controlador, reloj):
+    intervalo(controlador, reloj, 0.05)
+    assert controlador.pedidos == [2]
+
+def test_no_sube_si_el_detector_no_alcanza(controlador, reloj):
+    for _ in range(10):
+        controlador.medir_descarga(0.05, 20000)
+    controlador.medir_procesado(5)
+    reloj[0] += controlador.intervalo
+    controlador.revisar()
+    assert controlador.pedidos == []
+
+def test_espera_despues_de_bajar_antes_de_subir(controlador, reloj):
+    intervalo(controlador, reloj, 1.0)
+    controlador.escalon = 0
+    controlador.pedidos.clear()
+    # Holgura de sobra, pero todavía dentro de `espera_subida`
+    while reloj[0] < 30.0:
+        intervalo(controlador, reloj, 0.05)
+    assert controlador.pedidos == []
+    intervalo(controlador, reloj, 0.05)
+    assert controlador.pedidos == [1]
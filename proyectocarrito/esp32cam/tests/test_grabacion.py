@@ -0,0 +1,47 @@
+# Clips disparados: anillo de segundos previos, extensión por disparos y cierre.
+
+import os
+
+import pytest
+
+from grabacion import GrabadorClips, fps_de_cuadros
+
+def jpeg(numero):
+    """Bytes que hacen de JPEG; el grabador MJPEG los concatena sin decodificar."""
+    return b'\xff\xd8' + bytes([numero]) + b'\xff\xd9'
+
+def test_fps_de_cuadros():
+    assert fps_de_cuadros([(10.0, b''), (10.5, b''), (11.0, b'')]) == pytest.approx(2.0)
+    assert fps_de_cuadros([(10.0, b'')], predeterminado=7) == 7
+
+def test_clip_con_cuadros_previos_y_posteriores(tmp_path):
+    grabador = GrabadorClips(str(tmp_path), segundos_antes=1.0, segundos_despues=1.0)
+    # La cámara entrega 10 cuadros por segundo; el detector solo dispara una vez
+    for numero in range(40):
+        marca_tiempo = 100.0 + numero / 10
+        grabador.agregar('patio', marca_tiempo, jpeg(numero))
+        if numero == 20:
+            grabador.disparar('patio', marca_tiempo)
+    grabador.cerrar()
+    clips = os.listdir(tmp_path)
+    assert len(clips) == 1
+    contenido = (tmp_path / clips[0]).read_bytes()
+    # Un segundo antes del disparo (cuadros 10 a 20) hasta un segundo después (30)
+    assert contenido == b''.join(jpeg(numero) for numero in range(10, 31))
+
+def test_un_disparo_durante_el_clip_lo_extiende(tmp_path):
+    grabador = GrabadorClips(str(tmp_path), segundos_antes=0.0, segundos_despues=1.0)
+    for numero in range(40):
+        marca_tiempo = 100.0 + numero / 10
+        grabador.agregar('patio', marca_tiempo, jpeg(numero))
+        if numero in (5, 15):
+            grabador.disparar('patio', marca_tiempo)
+    grabador.cerrar()
+    assert grabador.clips == 1
+    assert grabador.cuadros_escritos == 21
+
+def test_sin_cuadros_no_abre_clip(tmp_path):
+    grabador = GrabadorClips(str(tmp_path))
+    grabador.disparar('patio', 100.0)
+    assert grabador.grabando() == 0
+    grabador.cerrar()
@@ -0,0 +1,47 @@
+# Ida y vuelta del historial columnar: HistorialDetecciones escribe, ConsultaHistorial consulta.
+
+from historial import ConsultaHistorial, HistorialDetecciones
+
+def llenar(directorio, detecciones, filas_por_bloque=4):
+    historial = HistorialDetecciones(str(directorio), filas_por_bloque=filas_por_bloque)
+    for segundo in range(10):
+        camara = 'patio' if segundo % 2 else 'puerta'
+        historial.agregar(camara, 100.0 + segundo, detecciones([1] if segundo < 7 else [1, 3], 0.5 + segundo / 20))
+    historial.agregar('patio', 200.0, detecciones([]))
+    historial.cerrar()
+    return historial
+
+def test_ida_y_vuelta(tmp_path, detecciones):
+    historial = llenar(tmp_path, detecciones)
+    consulta = ConsultaHistorial(str(tmp_path))
+    assert historial.filas == 13
+    assert len(consulta.bloques) > 1
+    filas = consulta.filtrar()
+    assert len(filas) == 13
+    assert filas[0]['x'] == 1 and filas[0]['alto'] == 4
+
+def test_filtros_y_agregados(tmp_path, detecciones):
+    llenar(tmp_path, detecciones)
+    consulta = ConsultaHistorial(str(tmp_path))
+    assert consulta.contar_por_clase() == {1: 10, 3: 3}
+    assert consulta.contar_por_camara() == {'puerta': 6, 'patio': 7}
+    assert len(consulta.filtrar(102.0, 104.0)) == 3
+    assert len(consulta.filtrar(camaras=['patio'], clases=[3])) == 2
+    assert len(consulta.filtrar(confianza_minima=0.9)) == 4
+    inicios, conteos = consulta.contar_por_intervalo(5.0, 100.0, 110.0)
+    assert inicios.tolist() == [100.0, 105.0] and conteos.tolist() == [5, 8]
+
+def test_solo_carga_los_bloques_del_rango(tmp_path, detecciones):
+    llenar(tmp_path, detecciones)
+    consulta = ConsultaHistorial(str(tmp_path))
+    assert len(consulta._cargar(100.0, 101.0)) < len(consulta._cargar(None, None))
+
+def test_reabrir_continua_bloques_y_camaras(tmp_path, detecciones):
+    llenar(tmp_path, detecciones)
+    historial = HistorialDetecciones(str(tmp_path))
+    historial.agregar('garaje', 300.0, detecciones([2]))
+    historial.agregar('patio', 301.0, detecciones([2]))
+    historial.cerrar()
+    consulta = ConsultaHistorial(str(tmp_path))
+    assert consulta.contar_por_camara(300.0) == {'garaje': 1, 'patio': 1}
+    assert len(consulta.filtrar()) == 15
@@ -0,0 +1,14 @@
+# Formato de texto de Prometheus: valores de etiqueta escapados.
+
+from metricas import Metricas
+
+def test_escapa_barras_comillas_y_saltos_de_linea():
+    metricas = Metricas()
+    metricas.incrementar('errores_captura', camara='patio "norte"\\1\nb')
+    lineas = metricas.texto_prometheus().splitlines()
+    assert 'deteccion_errores_captura_total{camara="patio \\"norte\\"\\\\1\\nb"} 1' in lineas
+
+def test_medidor_con_etiquetas_escapadas():
+    metricas = Metricas()
+    metricas.registrar_medidor('espectadores', lambda: {(('camara', 'a"b'),): 2})
+    assert 'deteccion_espectadores{camara="a\\"b"} 2' in metricas.texto_prometheus().splitlines()
@@ -0,0 +1,63 @@
+# Separación de cuadros del stream MJPEG (LectorMJPEG.leer_jpeg) sin red.
+
+import pytest
+
+from clasificacion import LectorMJPEG
+
+JPEG_A = b'\xff\xd8' + b'A' * 50 + b'\xff\xd9'
+JPEG_B = b'\xff\xd8' + b'B\xff' * 20 + b'\xff\xd9'
+
+class RespuestaFalsa:
+    """Entrega el stream en trozos de `tamano` bytes, como `read1` sobre un socket."""
+
+    def __init__(self, datos, tamano):
+        self.datos = datos
+        self.tamano = tamano
+        self.posicion = 0
+
+    def read1(self, maximo):
+        parte = self.datos[self.posicion:self.posicion + min(maximo, self.tamano)]
+        self.posicion += len(parte)
+        return parte
+
+    def close(self):
+        pass
+
+def parte(jpeg, con_largo=True):
+    cabeceras = b'--frame\r\nContent-Type: image/jpeg\r\n'
+    if con_largo:
+        cabeceras += b'Content-Length: %d\r\n' % len(jpeg)
+    return cabeceras + b'\r\n' + jpeg + b'\r\n'
+
+def lector_con(datos, tamano=7):
+    lector = LectorMJPEG('http://camara/stream')
+    lector._respuesta = RespuestaFalsa(datos, tamano)
+    return lector
+
+@pytest.mark.parametrize('tamano', [1, 7, 4096])
+def test_separa_cuadros_con_content_length(tamano):
+    lector = lector_con(parte(JPEG_A) + parte(JPEG_B), tamano)
+    assert bytes(lector.leer_jpeg()) == JPEG_A
+    assert bytes(lector.leer_jpeg()) == JPEG_B
+
+@pytest.mark.parametrize('tamano', [1, 7, 4096])
+def test_sin_content_length_corta_en_el_marcador_eoi(tamano):
+    lector = lector_con(parte(JPEG_A, con_largo=False) + parte(JPEG_B, con_largo=False), tamano)
+    assert bytes(lector.leer_jpeg()) == JPEG_A
+    assert bytes(lector.leer_jpeg()) == JPEG_B
+
+def test_la_vista_anterior_sigue_valida():
+    lector = lector_con(parte(JPEG_A) + parte(JPEG_B) + parte(JPEG_A))
+    primero = lector.leer_jpeg()
+    lector.leer_jpeg()
+    lector.leer_jpeg()
+    assert bytes(primero) == JPEG_A
+
+def test_ignora_bytes_antes_del_delimitador():
+    lector = lector_con(b'basura\r\n' + parte(JPEG_A))
+    assert bytes(lector.leer_jpeg()) == JPEG_A
+
+def test_stream_cerrado_lanza_connection_error():
+    lector = lector_con(parte(JPEG_A)[:30])
+    with pytest.raises(ConnectionError):
+        lector.leer_jpeg()
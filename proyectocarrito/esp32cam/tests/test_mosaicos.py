@@ -0,0 +1,37 @@
+# Cuadrícula de mosaicos y NMS por clase del detector en mosaicos.
+
+import pytest
+
+from detector import cuadricula_mosaicos, suprimir_no_maximos
+
+def test_un_mosaico_es_el_cuadro_completo():
+    assert cuadricula_mosaicos(800, 600, 1, 1) == [(0, 0, 800, 600)]
+
+@pytest.mark.parametrize('columnas, filas', [(2, 1), (2, 2), (3, 2), (3, 3)])
+def test_cuadricula_cubre_el_cuadro_con_solape(columnas, filas):
+    mosaicos = cuadricula_mosaicos(800, 600, columnas, filas, solape=0.2)
+    assert len(mosaicos) == columnas * filas
+    assert min(x0 for x0, _, _, _ in mosaicos) == 0 and min(y0 for _, y0, _, _ in mosaicos) == 0
+    assert max(x1 for _, _, x1, _ in mosaicos) == 800 and max(y1 for _, _, _, y1 in mosaicos) == 600
+    # Mosaicos vecinos de la misma fila se solapan
+    primera_fila = sorted(m for m in mosaicos if m[1] == 0)
+    for izquierdo, derecho in zip(primera_fila, primera_fila[1:]):
+        assert derecho[0] < izquierdo[2]
+
+def test_nms_conserva_la_caja_mas_confiable_de_la_misma_clase(detecciones):
+    resultado = suprimir_no_maximos(detecciones([1, 1], [0.6, 0.9], [[10, 10, 100, 100], [12, 12, 100, 100]]))
+    assert resultado.confidences.tolist() == pytest.approx([0.9])
+    assert resultado.boxes.tolist() == [[12, 12, 100, 100]]
+
+def test_nms_no_compara_clases_distintas(detecciones):
+    resultado = suprimir_no_maximos(detecciones([1, 3], [0.6, 0.9], [[10, 10, 100, 100], [10, 10, 100, 100]]))
+    assert sorted(resultado.class_ids.tolist()) == [1, 3]
+
+def test_nms_conserva_cajas_separadas_y_su_orden(detecciones):
+    entrada = detecciones([1, 1, 1], [0.5, 0.9, 0.7], [[0, 0, 50, 50], [200, 200, 50, 50], [400, 0, 50, 50]])
+    resultado = suprimir_no_maximos(entrada)
+    assert resultado.boxes.tolist() == entrada.boxes.tolist()
+
+def test_nms_con_una_sola_deteccion_no_hace_nada(detecciones):
+    entrada = detecciones([1], [0.5], [[0, 0, 10, 10]])
+    assert suprimir_no_maximos(entrada) is entrada
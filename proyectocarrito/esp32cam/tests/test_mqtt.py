@@ -0,0 +1,62 @@
+# Codificación de paquetes del cliente MQTT mínimo.
+
+import socket
+import struct
+
+import pytest
+
+from puente_mqtt import _cadena, _leer_paquete, _longitud
+
+@pytest.mark.parametrize('valor, codificada', [
+    (0, b'\x00'),
+    (127, b'\x7f'),
+    (128, b'\x80\x01'),
+    (16383, b'\xff\x7f'),
+    (16384, b'\x80\x80\x01'),
+    (2097151, b'\xff\xff\x7f'),
+    (268435455, b'\xff\xff\xff\x7f'),
+])
+def test_longitud_restante(valor, codificada):
+    assert _longitud(valor) == codificada
+
+def test_cadena_con_largo_de_16_bits():
+    assert _cadena('MQTT') == b'\x00\x04MQTT'
+    assert _cadena(b'alto') == b'\x00\x04alto'
+    assert _cadena('ñ') == b'\x00\x02\xc3\xb1'
+
+@pytest.fixture
+def par():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+@pytest.mark.parametrize('largo_carga', [0, 5, 200, 20000])
+def test_leer_paquete_publish(par, largo_carga):
+    emisor, receptor = par
+    carga = bytes(range(256)) * (largo_carga // 256) + bytes(largo_carga % 256)
+    cuerpo = _cadena('altopapi') + carga
+    emisor.sendall(bytes([0x30]) + _longitud(len(cuerpo)) + cuerpo)
+    tipo, banderas, leido = _leer_paquete(receptor)
+    assert (tipo, banderas) == (3, 0)
+    assert struct.unpack('!H', leido[:2])[0] == len('altopapi')
+    assert leido[10:] == carga
+
+def test_leer_paquete_sin_cuerpo(par):
+    emisor, receptor = par
+    emisor.sendall(b'\xd0\x00')  # PINGRESP
+    assert _leer_paquete(receptor) == (13, 0, b'')
+
+def test_leer_paquete_llegado_en_trozos(par):
+    emisor, receptor = par
+    paquete = b'\x20\x02\x00\x00'  # CONNACK aceptado
+    for byte in paquete:
+        emisor.sendall(bytes([byte]))
+    assert _leer_paquete(receptor) == (2, 0, b'\x00\x00')
+
+def test_conexion_cerrada_a_mitad_de_paquete(par):
+    emisor, receptor = par
+    emisor.sendall(b'\x30\x10abc')
+    emisor.close()
+    with pytest.raises(ConnectionError):
+        _leer_paquete(receptor)
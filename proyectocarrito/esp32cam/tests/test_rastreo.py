@@ -0,0 +1,74 @@
+# IoU entre cajas y rastreador de pistas entre detecciones completas.
+
+import numpy as np
+import pytest
+
+import clasificacion
+from clasificacion import RastreadorIoU, calcular_iou
+
+def paso(rastreador, resultado):
+    """Un cuadro como lo atiende `procesar_lote`: (detecciones, nuevas); `resultado` es lo que daría la red."""
+    rastreadas = rastreador.consultar(None)
+    if rastreadas is not None:
+        return rastreadas, False
+    return rastreador.actualizar(None, resultado), True
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj manual para que la velocidad de las pistas sea determinista."""
+    hora = [1000.0]
+    monkeypatch.setattr(clasificacion.time, 'time', lambda: hora[0])
+    return hora
+
+def test_iou_de_cajas_iguales_disjuntas_y_a_medias():
+    iou = calcular_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [20, 20, 5, 5], [5, 0, 10, 10]])
+    assert iou.shape == (1, 3)
+    assert iou[0].tolist() == pytest.approx([1.0, 0.0, 50 / 150])
+
+def test_iou_con_conjuntos_vacios():
+    assert calcular_iou(np.zeros((0, 4)), [[0, 0, 1, 1]]).shape == (0, 1)
+
+def test_mantiene_el_id_de_una_caja_que_se_mueve(reloj, detecciones):
+    rastreador = RastreadorIoU(detectar_cada=1)
+    primero, nuevas = paso(rastreador, detecciones([1], 0.9, [100, 100, 50, 50]))
+    reloj[0] += 0.1
+    segundo, _ = paso(rastreador, detecciones([1], 0.9, [110, 100, 50, 50]))
+    assert nuevas
+    assert primero.track_ids.tolist() == segundo.track_ids.tolist() == [1]
+
+def test_entre_detecciones_predice_con_la_velocidad(reloj, detecciones):
+    rastreador = RastreadorIoU(detectar_cada=2, decaimiento=1.0)
+    paso(rastreador, detecciones([1], 0.9, [100, 100, 50, 50]))
+    reloj[0] += 1.0
+    _, nuevas = paso(rastreador, None)
+    assert not nuevas
+    reloj[0] += 1.0
+    _, nuevas = paso(rastreador, detecciones([1], 0.9, [120, 100, 50, 50]))
+    assert nuevas
+    reloj[0] += 1.0
+    rastreadas, nuevas = paso(rastreador, None)
+    assert not nuevas
+    # Velocidad suavizada: la mitad de 10 px/s medidos en la segunda detección
+    assert rastreadas.boxes.tolist() == [[125, 100, 50, 50]]
+    assert rastreadas.track_ids.tolist() == [1]
+
+def test_clases_distintas_no_se_asocian(reloj, detecciones):
+    rastreador = RastreadorIoU(detectar_cada=1)
+    paso(rastreador, detecciones([1], 0.9, [0, 0, 50, 50]))
+    reloj[0] += 0.1
+    segundo, _ = paso(rastreador, detecciones([2], 0.9, [0, 0, 50, 50]))
+    assert segundo.track_ids.tolist() == [2]
+
+def test_borra_pistas_perdidas(reloj, detecciones):
+    rastreador = RastreadorIoU(detectar_cada=1, max_perdidas=1)
+    for resultado in (detecciones([1], 0.9, [0, 0, 50, 50]), detecciones([]), detecciones([])):
+        paso(rastreador, resultado)
+        reloj[0] += 0.1
+    assert rastreador.estadisticas()['pistas'] == 0
+
+def test_confianza_baja_adelanta_la_deteccion(reloj, detecciones):
+    rastreador = RastreadorIoU(detectar_cada=10, decaimiento=0.5, umbral_confianza=0.35)
+    resultado = detecciones([1], 0.9, [0, 0, 50, 50])
+    assert paso(rastreador, resultado)[1]
+    assert not paso(rastreador, resultado)[1]  # 0.45: todavía rastreada
+    assert paso(rastreador, resultado)[1]  # 0.225 < 0.35
@@ -0,0 +1,36 @@
+# Retransmisión MJPEG: los espectadores que se van dejan de contarse aunque no lleguen cuadros.
+
+import socket
+import time
+
+import numpy as np
+
+import retransmision
+from retransmision import DifusorMJPEG, iniciar_servidor_mjpeg
+
+def esperar(condicion, segundos=3.0):
+    """Espera hasta que `condicion()` sea verdadera o pasen `segundos`."""
+    limite = time.monotonic() + segundos
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.02)
+    return condicion()
+
+def test_espectador_desconectado_sin_cuadros_nuevos(monkeypatch):
+    monkeypatch.setattr(retransmision, 'ESPERA_CUADRO', 0.1)
+    difusor = DifusorMJPEG()
+    difusor.canal('patio')
+    servidor = iniciar_servidor_mjpeg(difusor, 0, camara_predeterminada='patio')
+    try:
+        cliente = socket.create_connection(servidor.server_address, timeout=3)
+        cliente.sendall(b'GET /patio HTTP/1.0\r\n\r\n')
+        assert esperar(lambda: difusor.espectadores('patio') == 1)
+        difusor.publicar('patio', np.zeros((8, 8, 3), dtype=np.uint8))
+        recibido = b''
+        while b'image/jpeg' not in recibido:
+            recibido += cliente.recv(65536)
+        cliente.close()
+        # Ya no se publican cuadros: solo la escritura de mantenimiento detecta la desconexión
+        assert esperar(lambda: difusor.espectadores('patio') == 0)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
@@ -0,0 +1,267 @@
+# Inferencia en varios procesos con entrega de cuadros por memoria compartida.
+# Cada proceso trabajador carga su propio modelo con configurar_modelo; los
+# cuadros viajan por ranuras de un anillo en multiprocessing.shared_memory (por
+# la cola solo pasa el número de ranura y la forma) y los resultados vuelven en
+# el mismo orden en que se enviaron los cuadros. Los trabajadores no escriben
+# en deteccion.log: mandan sus registros al proceso principal por una cola.
+# Los procesos se crean con 'spawn': el principal ya tiene hilos de captura y de
+# registro corriendo, y un fork copiaría sus locks tomados.
+
+import logging
+import multiprocessing as mp
+import queue
+import signal
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from bitacora import escuchar_procesos, registrar_en_cola
+from detector import (UMBRAL_CONFIANZA, TAMANO_ENTRADA, Detecciones, DetectorMosaicos, DetectorPorLotes,
+                      calentar_modelo, configurar_modelo, detectar_en_regiones)
+from metricas import REGISTRO
+
+BYTES_RANURA = 800 * 600 * 3  # Un cuadro SVGA en BGR; el anillo crece si llega un cuadro mayor
+HILOS_POR_TRABAJADOR = 1  # Hilos de OpenCV por proceso, para no sobresuscribir la CPU
+ESPERA_TRABAJADOR = 1.0  # Segundos de espera de un resultado antes de revisar que los trabajadores sigan vivos
+
+def _trabajador(indice, en_curso, tareas, resultados, cola_registro, config, weights, hilos, regiones, mosaicos,
+                ajuste, tamano, umbral):
+    """Cuerpo de cada proceso: detecta sobre las ranuras que le llegan por la cola.
+
+    Cada tarea trae el nombre del bloque de memoria compartida y el
+    desplazamiento del cuadro, así el proceso principal puede reemplazar el
+    anillo por uno más grande sin reiniciar los trabajadores. `mosaicos` son
+    los parámetros de `DetectorMosaicos`, o None para detectar sin mosaicos.
+    En `en_curso[indice]` queda la secuencia que se está detectando, para que
+    el principal sepa qué cuadro se perdió si el proceso muere.
+    """
+    # Ctrl+C llega a todo el grupo de procesos; el principal los detiene con `detener`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    registrar_en_cola(cola_registro)
+    if mosaicos is not None:
+        # El cuadro y sus mosaicos van en un solo forward
+        modelo = DetectorPorLotes(config, weights, tamano, ajuste=ajuste)
+    else:
+        modelo = configurar_modelo(config, weights, ajuste, tamano)
+    # Los hilos por proceso mandan sobre los del ajuste, medidos para un solo proceso
+    cv2.setNumThreads(hilos)
+    calentar_modelo(modelo)
+    if mosaicos is not None:
+        modelo = DetectorMosaicos(modelo, **mosaicos)
+    memoria = None
+    try:
+        while True:
+            tarea = tareas.get()
+            if tarea is None:
+                return
+            secuencia, nombre_memoria, ranura, desplazamiento, forma, escala = tarea
+            en_curso[indice] = secuencia
+            if memoria is None or memoria.name != nombre_memoria:
+                if memoria is not None:
+                    memoria.close()
+                memoria = shared_memory.SharedMemory(name=nombre_memoria)
+            imagen = np.ndarray(forma, dtype=np.uint8, buffer=memoria.buf, offset=desplazamiento)
+            inicio = time.perf_counter()
+            detecciones = detectar_en_regiones(modelo, imagen, regiones, escala, umbral)
+            del imagen  # Libera la vista antes de que la ranura se reutilice
+            resultados.put((secuencia, ranura, detecciones.class_ids, detecciones.confidences, detecciones.boxes,
+                            time.perf_counter() - inicio))
+            en_curso[indice] = -1
+    finally:
+        if memoria is not None:
+            memoria.close()
+
+class PoolInferencia:
+    """Reparte cuadros entre procesos trabajadores y devuelve los resultados en orden.
+
+    El proceso principal copia cada cuadro a una ranura libre del anillo de
+    memoria compartida y encola la ranura con la forma y la escala del cuadro.
+    Las ranuras se liberan cuando vuelve el resultado. Si llega un cuadro que
+    no cabe (por ejemplo porque la cámara subió de resolución), se esperan los
+    cuadros en vuelo y el anillo se reemplaza por uno con ranuras más grandes.
+    `agregar_listo` permite intercalar cuadros que no necesitan detector sin
+    romper el orden de salida. Si un trabajador muere se arranca otro en su
+    lugar y el cuadro que tenía sale sin detecciones, así la salida no se
+    queda esperándolo.
+    """
+
+    def __init__(self, config, weights, trabajadores=2, ranuras=None, bytes_ranura=BYTES_RANURA,
+                 hilos=HILOS_POR_TRABAJADOR, regiones=(), mosaicos=None, ajuste=None, tamano=TAMANO_ENTRADA,
+                 umbral=UMBRAL_CONFIANZA):
+        self.config = config
+        self.weights = weights
+        self.trabajadores = trabajadores
+        self.ranuras = ranuras or 2 * trabajadores
+        self.bytes_ranura = bytes_ranura
+        self.hilos = hilos
+        self.regiones = list(regiones)
+        self.mosaicos = mosaicos
+        self.ajuste = ajuste
+        self.tamano = tamano
+        self.umbral = umbral
+        self._contexto = mp.get_context('spawn')
+        self._memoria = None
+        self._procesos = []
+        self._en_curso = None  # Secuencia que detecta cada trabajador, -1 si está libre
+        self._tareas = None
+        self._resultados = None
+        self._registro = None
+        self._escucha = None
+        self._libres = list(range(self.ranuras))
+        self._siguiente = 0  # Secuencia que se asignará al próximo cuadro
+        self._a_entregar = 0  # Secuencia que debe salir a continuación
+        self._datos = {}  # secuencia -> dato del llamador (por ejemplo el `Cuadro`)
+        self._ranuras_en_vuelo = {}  # secuencia -> ranura de los cuadros enviados sin resultado
+        self._listos = {}  # secuencia -> (detecciones, nuevas)
+
+    def iniciar(self):
+        """Crea el anillo de memoria compartida y arranca los procesos."""
+        self._memoria = shared_memory.SharedMemory(create=True, size=self.ranuras * self.bytes_ranura)
+        self._tareas = self._contexto.Queue()
+        self._resultados = self._contexto.Queue()
+        self._registro = self._contexto.Queue()
+        self._en_curso = self._contexto.Array('q', [-1] * self.trabajadores, lock=False)
+        self._escucha = escuchar_procesos(self._registro)
+        self._procesos = [self._arrancar(i) for i in range(self.trabajadores)]
+        logging.info(f"{self.trabajadores} procesos de inferencia con {self.ranuras} ranuras compartidas.")
+        return self
+
+    def _arrancar(self, indice):
+        """Arranca el trabajador `indice`."""
+        self._en_curso[indice] = -1
+        proceso = self._contexto.Process(target=_trabajador, name=f'inferencia-{indice}', daemon=True,
+                                         args=(indice, self._en_curso, self._tareas, self._resultados,
+                                               self._registro, self.config, self.weights, self.hilos, self.regiones,
+                                               self.mosaicos, self.ajuste, self.tamano, self.umbral))
+        proceso.start()
+        return proceso
+
+    def _revisar_trabajadores(self):
+        """Reemplaza los trabajadores muertos; el cuadro que tenían sale sin detecciones.
+
+        Un trabajador que muere sin estar detectando (por ejemplo al cargar el
+        modelo) volvería a morir al reiniciarlo, así que eso es un error.
+        """
+        for indice, proceso in enumerate(self._procesos):
+            if proceso.is_alive():
+                continue
+            perdida = self._en_curso[indice]
+            if perdida < 0:
+                raise RuntimeError(f"El trabajador {proceso.name} terminó con código {proceso.exitcode} "
+                                   "sin estar detectando.")
+            logging.error(f"El trabajador {proceso.name} terminó con código {proceso.exitcode} "
+                          f"detectando el cuadro {perdida}; se reinicia.")
+            REGISTRO.incrementar('trabajadores_reiniciados')
+            proceso.join()
+            if perdida in self._ranuras_en_vuelo:
+                self._libres.append(self._ranuras_en_vuelo.pop(perdida))
+                self._listos[perdida] = (Detecciones(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32),
+                                                     np.zeros((0, 4), dtype=np.int32)), False)
+            self._procesos[indice] = self._arrancar(indice)
+
+    def detener(self):
+        """Detiene los procesos y libera la memoria compartida."""
+        for _ in self._procesos:
+            self._tareas.put(None)
+        for proceso in self._procesos:
+            proceso.join(timeout=5)
+            if proceso.is_alive():
+                proceso.terminate()
+        if self._escucha is not None:
+            self._escucha.stop()
+            self._escucha = None
+        if self._memoria is not None:
+            self._memoria.close()
+            self._memoria.unlink()
+            self._memoria = None
+
+    def libres(self):
+        """Ranuras disponibles para nuevos cuadros."""
+        return len(self._libres)
+
+    def en_vuelo(self):
+        """Cuadros enviados cuyo resultado aún no se entregó."""
+        return self._siguiente - self._a_entregar
+
+    def _recibir(self, timeout=ESPERA_TRABAJADOR):
+        """Recibe un resultado de los trabajadores y libera su ranura; False si no llegó en `timeout`.
+
+        Cuando una espera se agota se revisa que los trabajadores sigan vivos:
+        si uno murió, su ranura vuelve a quedar libre aunque no haya resultado.
+        """
+        try:
+            resultado = self._resultados.get(timeout=timeout)
+        except queue.Empty:
+            if timeout:
+                self._revisar_trabajadores()
+            return False
+        secuencia, ranura, class_ids, confidences, boxes, duracion = resultado
+        # Un resultado que llega después de dar al trabajador por muerto ya se entregó vacío
+        if self._ranuras_en_vuelo.pop(secuencia, None) is None:
+            return True
+        self._libres.append(ranura)
+        self._listos[secuencia] = (Detecciones(class_ids, confidences, boxes), True)
+        REGISTRO.observar('inferencia_trabajador', duracion)
+        return True
+
+    def _ampliar(self, bytes_ranura):
+        """Reemplaza el anillo por uno con ranuras de `bytes_ranura`, esperando los cuadros en vuelo."""
+        while len(self._libres) < self.ranuras:
+            self._recibir()
+        anterior = self._memoria
+        self._memoria = shared_memory.SharedMemory(create=True, size=self.ranuras * bytes_ranura)
+        self.bytes_ranura = bytes_ranura
+        # Los trabajadores abren el bloque nuevo al ver su nombre en la próxima tarea
+        anterior.close()
+        anterior.unlink()
+        logging.info(f"Ranuras compartidas ampliadas a {bytes_ranura} bytes.")
+
+    def enviar(self, imagen, dato=None, escala=1):
+        """Copia la imagen a una ranura y la encola; espera si no hay ranuras libres."""
+        if imagen.dtype != np.uint8:
+            raise ValueError(f"Los trabajadores esperan imágenes uint8, no {imagen.dtype}")
+        if imagen.nbytes > self.bytes_ranura:
+            self._ampliar(imagen.nbytes)
+        secuencia = self._siguiente
+        self._siguiente += 1
+        self._datos[secuencia] = dato
+        while not self._libres:
+            self._recibir()
+        ranura = self._libres.pop()
+        self._ranuras_en_vuelo[secuencia] = ranura
+        desplazamiento = ranura * self.bytes_ranura
+        destino = np.ndarray(imagen.shape, dtype=np.uint8, buffer=self._memoria.buf, offset=desplazamiento)
+        np.copyto(destino, imagen)
+        del destino
+        self._tareas.put((secuencia, self._memoria.name, ranura, desplazamiento, imagen.shape, escala))
+        return secuencia
+
+    def agregar_listo(self, dato, detecciones, nuevas=False):
+        """Intercala un resultado que no pasó por los trabajadores, respetando el orden."""
+        secuencia = self._siguiente
+        self._siguiente += 1
+        self._datos[secuencia] = dato
+        self._listos[secuencia] = (detecciones, nuevas)
+        return secuencia
+
+    def resultados(self, bloquear=False):
+        """Devuelve [(dato, detecciones, nuevas)] listos en orden de envío.
+
+        Con `bloquear` espera al menos un resultado si hay cuadros en vuelo.
+        """
+        espera = ESPERA_TRABAJADOR if bloquear else 0
+        while self._recibir(espera):
+            espera = 0
+        entregables = []
+        while self._a_entregar in self._listos:
+            detecciones, nuevas = self._listos.pop(self._a_entregar)
+            entregables.append((self._datos.pop(self._a_entregar), detecciones, nuevas))
+            self._a_entregar += 1
+        return entregables
+
+    def registrar_metricas(self):
+        """Expone ranuras libres y cuadros en vuelo en el registro de métricas."""
+        REGISTRO.registrar_medidor('ranuras_libres', self.libres, 'Ranuras de memoria compartida disponibles')
+        REGISTRO.registrar_medidor('cuadros_en_vuelo', self.en_vuelo, 'Cuadros enviados a los trabajadores sin resultado')